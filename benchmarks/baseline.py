@@ -0,0 +1,30 @@
+import json
+
+
+def compare_to_baseline(results: dict, baseline_path: str, metrics: dict, tolerance: float) -> list:
+    '''
+    Compare benchmark results with a stored run and print the change of every metric
+
+    return:         names of the metrics that got worse by more than the tolerance
+    param results:      {case: {metric: value}} of this run
+    param baseline_path: JSON file written by an earlier run, its 'results' entry is compared
+    param metrics:      {metric: True if higher is better}
+    param tolerance:    allowed relative change in the worse direction
+    '''
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    for case, values in results.items():
+        for metric, higher_is_better in metrics.items():
+            old = baseline.get(case, {}).get(metric)
+            new = values.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / abs(old) if old else 0.0
+            worse = -change if higher_is_better else change
+            regressed = worse > tolerance
+            if regressed:
+                regressions.append(f'{case}.{metric}')
+            print(f"{case + '.' + metric:40s} {old:12.4f} -> {new:12.4f}  {change:+7.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    return regressions
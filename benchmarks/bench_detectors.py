@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+# run with the client and server modules importable the same way their entry scripts see them
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'client'))
+sys.path.append(os.path.join(ROOT, 'server'))
+from ball_detection import estimate_center
+from detectors import DETECTORS, make_detector
+from frame import Frame
+
+
+def generate_frames(count: int, width: int, height: int, radius: int, velocity: int, yuv: bool = True) -> tuple:
+    '''
+    Render frames with the server side generator and convert them to I420 like the video track does
+
+    return:     (frames, truths) where truths[i] is the ball center drawn in frames[i]
+    param yuv:  keep packed I420 frames as the client detects on, otherwise convert back to BGR
+    '''
+    generator = Frame(velocity, radius, width, height)
+    frames, truths = [], []
+    for _ in range(count):
+        truths.append((generator.x_position, generator.y_position))
+        frame = cv2.cvtColor(generator.get_frame(), cv2.COLOR_BGR2YUV_I420)
+        frames.append(frame if yuv else cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420))
+        generator.ball_move()
+    return frames, np.array(truths, dtype=float)
+
+
+def evaluate(detector, frames: list, truths: np.ndarray) -> dict:
+    '''
+    Measure per frame latency and error of a detector against the ground truth
+    '''
+    latencies = np.empty(len(frames))
+    estimates = np.full((len(frames), 2), np.nan)
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        found = estimate_center(frame, detector)
+        latencies[i] = time.perf_counter() - start
+        if found is not None:
+            estimates[i] = found[:2]
+    errors = np.linalg.norm(estimates - truths, axis=1)
+    found = ~np.isnan(errors)
+    return {
+        'latency_mean_ms': float(latencies.mean() * 1e3),
+        'latency_p95_ms': float(np.percentile(latencies, 95) * 1e3),
+        'error_mean': float(errors[found].mean()) if found.any() else None,
+        'error_max': float(errors[found].max()) if found.any() else None,
+        'miss_rate': float(1 - found.mean())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per frame latency and accuracy of the detector backends')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--radius', type=int, default=17)
+    parser.add_argument('--velocity', type=int, default=5)
+    parser.add_argument('--format', choices=('yuv', 'bgr'), default='yuv', help='frame format given to the detectors')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    frames, truths = generate_frames(args.frames, args.width, args.height, args.radius, args.velocity,
+                                     args.format == 'yuv')
+    results = {}
+    for name in DETECTORS:
+        for roi in (False, True):
+            label = f'{name}+roi' if roi else name
+            results[label] = evaluate(make_detector(name, roi), frames, truths)
+            r = results[label]
+            error = 'n/a' if r['error_mean'] is None else f"{r['error_mean']:.2f} (max {r['error_max']:.2f})"
+            print(f"{label:16s} {r['latency_mean_ms']:7.3f} ms  p95 {r['latency_p95_ms']:7.3f} ms  "
+                  f"error {error}  miss {r['miss_rate']:.1%}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from baseline import compare_to_baseline
+
+# client and server both have protocol and display modules, so each side runs in its own process
+# with only its own directory importable, the same way their entry scripts see them
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_STATS = 'CLIENT_STATS '
+
+# metric -> True if higher is better
+METRICS = {
+    'fps': True,
+    'latency_p50_ms': False,
+    'latency_p95_ms': False,
+    'latency_p99_ms': False,
+    'detector_mean_ms': False,
+    'drop_ratio': False,
+    'error_mean': False,
+}
+
+
+def run_client(args):
+    '''
+    Client side of the benchmark, prints its frame counters as one JSON line when the server hangs up
+    '''
+    sys.path.append(os.path.join(ROOT, 'client'))
+    from detectors import make_detector
+    from rtc_client import RTCClient
+
+    async def main():
+        client = RTCClient(host=args.host, port=args.port, workers=args.workers, display='off',
+                           detector=make_detector(args.detector, args.roi))
+        await client.run()
+        print(CLIENT_STATS + json.dumps(client.frame_stats()), flush=True)
+
+    asyncio.run(main())
+
+
+class Recorder():
+    '''
+    Collects the send time of every generated frame and the reports coming back for it
+    '''
+    def __init__(self, track, protocol):
+        self.track = track
+        self.protocol = protocol
+        self.pts_step = track.ground_truth.pts_step
+        self.sent = {}
+        self.latencies = []
+        self.detector_us = []
+        self.errors = []
+        self.misses = 0
+        self.records = 0
+        self.last_key = None
+
+    def wrap(self):
+        '''
+        Time stamp frames as they leave the track, right before encoding
+        '''
+        recv = self.track.recv
+
+        async def timed_recv():
+            frame = await recv()
+            self.sent[round(frame.pts / self.pts_step)] = time.perf_counter()
+            return frame
+        self.track.recv = timed_recv
+
+    def stop(self):
+        '''
+        Ignore reports of frames sent after this point
+        '''
+        self.last_key = max(self.sent, default=-1)
+
+    def on_message(self, message):
+        now = time.perf_counter()
+        try:
+            kind, records = self.protocol.decode_message(message)
+        except ValueError:
+            return
+        if kind != self.protocol.KIND_RESULTS:
+            return
+        keys = np.rint(records['pts'] / self.pts_step).astype(np.int64)
+        for key, x, y, confidence, latency_us in zip(keys.tolist(), records['x'].tolist(), records['y'].tolist(),
+                                                     records['confidence'].tolist(),
+                                                     records['latency_us'].tolist()):
+            if self.last_key is not None and key > self.last_key:
+                continue
+            self.records += 1
+            if key in self.sent:
+                self.latencies.append(now - self.sent.pop(key))
+            self.detector_us.append(latency_us)
+            if confidence == 0:
+                self.misses += 1
+                continue
+            self.errors.append(np.hypot(*np.subtract(self.track.frame_generator.position_at(key), (x, y))))
+
+
+async def run_server(args) -> dict:
+    '''
+    Serve one headless client over loopback signaling until enough frames were sent
+    '''
+    sys.path.append(os.path.join(ROOT, 'server'))
+    import protocol
+    from encoding import make_profile
+    from rtc_server import RTCServer
+
+    server = RTCServer(args.host, args.port, args.velocity, args.radius, args.width, args.height, display=False,
+                       fps=args.fps, paced=not args.uncapped, adaptive=args.adaptive, min_fps=args.min_fps,
+                       profile=make_profile(args.profile))
+    recorder = Recorder(server.stream_track, protocol)
+    recorder.wrap()
+    server.channel.on('message', recorder.on_message)
+    client = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--role', 'client', '--host', args.host,
+                               '--port', str(args.port), '--detector', args.detector, '--workers',
+                               str(args.workers)] + (['--roi'] if args.roi else []),
+                              stdout=subprocess.PIPE, text=True)
+    task = asyncio.ensure_future(server.run())
+    track = server.stream_track
+    while not task.done() and track.frames == 0:
+        await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    while not task.done():
+        elapsed = time.perf_counter() - start
+        if (args.seconds and elapsed >= args.seconds) or (not args.seconds and track.frames >= args.frames):
+            break
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    frames = track.frames
+    recorder.stop()
+    # reports of the last frames are still on their way
+    await asyncio.sleep(args.drain)
+    await server.shutdown()
+    task.cancel()
+    output, _ = await asyncio.get_running_loop().run_in_executor(None, client.communicate)
+    stats = [json.loads(line[len(CLIENT_STATS):]) for line in output.splitlines() if line.startswith(CLIENT_STATS)]
+
+    latencies = np.array(recorder.latencies) * 1e3
+    errors = np.array(recorder.errors)
+    return {
+        'frames': frames,
+        'records': recorder.records,
+        'seconds': elapsed,
+        'fps': recorder.records / elapsed,
+        'generated_fps': frames / elapsed,
+        'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'latency_p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else None,
+        'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        'detector_mean_ms': float(np.mean(recorder.detector_us) / 1e3) if recorder.detector_us else None,
+        'drop_ratio': 1 - recorder.records / frames if frames else None,
+        'miss_rate': recorder.misses / recorder.records if recorder.records else None,
+        'error_mean': float(errors.mean()) if len(errors) else None,
+        'error_p95': float(np.percentile(errors, 95)) if len(errors) else None,
+        'ground_truth': dict(server.ground_truth.counters),
+        'final_fps': server.rate_control.current_fps if server.rate_control else args.fps,
+        'kbps': track.encoder.kbps() if track.encoder else None,
+        'client': stats[-1] if stats else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end latency and throughput of server and client over loopback')
+    parser.add_argument('--frames', type=int, default=300, help='frames to send, ignored with --seconds')
+    parser.add_argument('--seconds', type=float, help='send frames for this long instead of a fixed count')
+    parser.add_argument('--width', type=int, default=300)
+    parser.add_argument('--height', type=int, default=200)
+    parser.add_argument('--radius', type=int, default=17)
+    parser.add_argument('--velocity', type=int, default=5)
+    parser.add_argument('--fps', type=float, default=30, help='frame rate of the video track')
+    parser.add_argument('--uncapped', action='store_true', help='send frames as fast as the pipeline takes them')
+    parser.add_argument('--adaptive', action='store_true', help='lower the frame rate while the client falls behind')
+    parser.add_argument('--min-fps', type=float, default=5, help='lowest frame rate with --adaptive')
+    parser.add_argument('--profile', default='default', help='server encoder profile, see encoding.PROFILES')
+    parser.add_argument('--detector', default='hough', help='client detector backend, see detectors.DETECTORS')
+    parser.add_argument('--roi', action='store_true', help='search near the last detection first')
+    parser.add_argument('--workers', type=int, default=1, help='client detection processes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12400)
+    parser.add_argument('--drain', type=float, default=0.5, help='seconds to wait for the last reports')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare with the JSON file of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change counted as a regression')
+    parser.add_argument('--role', choices=('server', 'client'), default='server', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.role == 'client':
+        run_client(args)
+        return
+
+    results = {'e2e': asyncio.run(run_server(args))}
+    r = results['e2e']
+    print(json.dumps(r, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+    if args.baseline and compare_to_baseline(results, args.baseline, METRICS, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from baseline import compare_to_baseline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'client'))
+sys.path.append(os.path.join(ROOT, 'server'))
+from ball_detection import detect_center
+from detectors import make_detector
+from frame import Frame
+from world import BallWorld
+
+METRICS = {'get_frame_us': False, 'ball_move_us': False, 'detect_center_ms': False, 'detect_all_ms': False}
+
+
+def time_calls(call, repeat: int) -> np.ndarray:
+    '''
+    Seconds taken by each of repeat calls
+    '''
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        call()
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def bench_resolution(width: int, height: int, radius: int, velocity: int, repeat: int) -> dict:
+    '''
+    Median time of Frame.get_frame, Frame.ball_move and detect_center on one resolution
+    '''
+    generator = Frame(velocity, radius, width, height)
+    # the ball moves between two renders like it does in the video track
+    get_frame = np.empty(repeat)
+    for i in range(repeat):
+        get_frame[i] = time_calls(generator.get_frame, 1)[0]
+        generator.ball_move()
+    ball_move = time_calls(generator.ball_move, repeat)
+    frame = generator.get_frame().copy()
+    detect = time_calls(lambda: detect_center(frame, 6, 8), max(repeat // 10, 1))
+    return {
+        'get_frame_us': float(np.median(get_frame) * 1e6),
+        'ball_move_us': float(np.median(ball_move) * 1e6),
+        'detect_center_ms': float(np.median(detect) * 1e3),
+    }
+
+
+def bench_world(balls: int, width: int, height: int, radius: int, velocity: int, collisions: bool,
+                repeat: int) -> dict:
+    '''
+    Median time of BallWorld.get_frame, BallWorld.ball_move and finding every ball with the components detector
+    '''
+    world = BallWorld(balls, radius, width, height, velocity, collisions)
+    get_frame = np.empty(repeat)
+    for i in range(repeat):
+        get_frame[i] = time_calls(world.get_frame, 1)[0]
+        world.ball_move()
+    ball_move = time_calls(world.ball_move, repeat)
+    frame = world.get_frame().copy()
+    detector = make_detector('components')
+    detect = time_calls(lambda: detector.detect_all(frame), max(repeat // 10, 1))
+    return {
+        'get_frame_us': float(np.median(get_frame) * 1e6),
+        'ball_move_us': float(np.median(ball_move) * 1e6),
+        'detect_all_ms': float(np.median(detect) * 1e3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks of frame generation and detection')
+    parser.add_argument('--resolutions', default='320x240,640x480,1280x720,1920x1080',
+                        help='comma separated WIDTHxHEIGHT list')
+    parser.add_argument('--radius', type=int, default=17)
+    parser.add_argument('--velocity', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=1000, help='calls per measurement, detect_center uses a tenth')
+    parser.add_argument('--balls', default='',
+                        help='comma separated ball counts of multi ball worlds, run on the first resolution')
+    parser.add_argument('--collisions', action='store_true', help='let the balls of the worlds collide')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare with the JSON file of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    results = {}
+    for resolution in args.resolutions.split(','):
+        width, height = (int(v) for v in resolution.split('x'))
+        results[resolution] = r = bench_resolution(width, height, args.radius, args.velocity, args.repeat)
+        print(f"{resolution:10s} get_frame {r['get_frame_us']:9.1f} us  ball_move {r['ball_move_us']:6.2f} us  "
+              f"detect_center {r['detect_center_ms']:8.3f} ms")
+    width, height = (int(v) for v in args.resolutions.split(',')[0].split('x'))
+    for balls in filter(None, args.balls.split(',')):
+        results[f'{balls} balls'] = r = bench_world(int(balls), width, height, args.radius, args.velocity,
+                                                    args.collisions, args.repeat)
+        print(f"{balls + ' balls':10s} get_frame {r['get_frame_us']:9.1f} us  ball_move {r['ball_move_us']:6.2f} us  "
+              f"detect_all {r['detect_all_ms']:8.3f} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+    if args.baseline and compare_to_baseline(results, args.baseline, METRICS, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
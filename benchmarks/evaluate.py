@@ -0,0 +1,191 @@
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'client'))
+sys.path.append(os.path.join(ROOT, 'server'))
+from ball_detection import estimate_center
+from detectors import make_detector
+from encoding import CODECS, PROFILES, FrameEncoder, make_profile
+from frame import Frame
+
+
+def parse_sweep(values: list) -> list:
+    '''
+    Every combination of the swept detector parameters
+
+    return:         list of parameter dicts
+    param values:   NAME=V1,V2,... strings
+    '''
+    names, choices = [], []
+    for value in values or []:
+        name, _, options = value.partition('=')
+        names.append(name)
+        choices.append([json.loads(option) for option in options.split(',')])
+    return [dict(zip(names, combination)) for combination in itertools.product(*choices)]
+
+
+def profile_encoder(profile: dict, fps: float = 30) -> FrameEncoder:
+    '''
+    Encoder of a profile. Profiles that leave encoding to aiortc get its encoder's settings at the bitrate
+    it starts with, and aiortc's first choice VP8 if they don't pick a codec either
+    '''
+    return FrameEncoder.from_profile(profile, fps) or FrameEncoder(profile.get('codec') or 'vp8', fps=fps)
+
+
+def i420_frames(config: dict, start: int, count: int, coding: dict = None):
+    '''
+    Frames start .. start + count - 1 as packed I420, optionally through an encode/decode round trip
+    with the encoder of config['profile']
+
+    yields: (frame index, I420 frame)
+    param coding:   receives the seconds spent in 'encode' and 'decode' and the packet 'bytes'
+    '''
+    generator = Frame(config['velocity'], config['radius'], config['width'], config['height'])
+    generator.seek(start)
+    if config['profile'] is None:
+        for index in range(start, start + count):
+            yield index, cv2.cvtColor(generator.get_frame(), cv2.COLOR_BGR2YUV_I420)
+            generator.ball_move()
+        return
+
+    import av
+    from aiortc.mediastreams import VIDEO_CLOCK_RATE
+    coding = {} if coding is None else coding
+    coding.update(encode=0.0, decode=0.0, bytes=0)
+    encoder = profile_encoder(config['profile'], config['fps'])
+    decoder = av.CodecContext.create(CODECS[encoder.codec][1], 'r')
+    # pts in the video clock like the track's frames
+    pts_step = round(VIDEO_CLOCK_RATE / encoder.fps)
+
+    def decode(packets):
+        for packet in packets:
+            begin = time.perf_counter()
+            frames = decoder.decode(packet)
+            coding['decode'] += time.perf_counter() - begin
+            for decoded in frames:
+                yield decoded.pts // pts_step, decoded.to_ndarray()
+
+    for index in range(start, start + count):
+        frame = av.VideoFrame.from_ndarray(cv2.cvtColor(generator.get_frame(), cv2.COLOR_BGR2YUV_I420),
+                                           format='yuv420p')
+        frame.pts = (index - start) * pts_step
+        generator.ball_move()
+        begin = time.perf_counter()
+        packets = encoder.encode(frame)
+        coding['encode'] += time.perf_counter() - begin
+        for offset, decoded in decode(packets):
+            yield start + offset, decoded
+    coding['bytes'] = encoder.bytes
+
+
+def evaluate_chunk(task: tuple) -> tuple:
+    '''
+    Detect the ball in one chunk of frames, runs in a pool process
+
+    return: (start, errors with nan for missed frames, seconds spent in detection, encode/decode seconds and bytes)
+    '''
+    config, params, start, count = task
+    detector = make_detector(config['detector'], config['roi'], **params)
+    truths = Frame(config['velocity'], config['radius'], config['width'], config['height']).positions_at(
+        np.arange(start, start + count))
+    errors = np.full(count, np.nan, dtype=np.float32)
+    detect_seconds = 0.0
+    coding = {}
+    for index, frame in i420_frames(config, start, count, coding):
+        begin = time.perf_counter()
+        found = estimate_center(frame, detector)
+        detect_seconds += time.perf_counter() - begin
+        if found is not None:
+            errors[index - start] = np.hypot(found[0] - truths[index - start][0], found[1] - truths[index - start][1])
+    return start, errors, detect_seconds, coding
+
+
+def evaluate(config: dict, params: dict, pool) -> dict:
+    '''
+    Score one detector configuration on all frames, with the encoder profile of the config
+    '''
+    frames, chunk = config['frames'], config['chunk']
+    tasks = [(config, params, start, min(chunk, frames - start)) for start in range(0, frames, chunk)]
+    errors = np.empty(frames, dtype=np.float32)
+    detect_seconds = 0.0
+    coding = dict.fromkeys(('encode', 'decode', 'bytes'), 0)
+    begin = time.perf_counter()
+    for start, chunk_errors, seconds, chunk_coding in pool.imap_unordered(evaluate_chunk, tasks):
+        errors[start:start + len(chunk_errors)] = chunk_errors
+        detect_seconds += seconds
+        for key, value in chunk_coding.items():
+            coding[key] += value
+    elapsed = time.perf_counter() - begin
+    found = ~np.isnan(errors)
+    return {
+        'profile': config['profile_name'],
+        'params': params,
+        'frames': frames,
+        'seconds': elapsed,
+        'fps': frames / elapsed,
+        'detect_mean_ms': detect_seconds / frames * 1e3,
+        'encode_mean_ms': coding['encode'] / frames * 1e3,
+        'decode_mean_ms': coding['decode'] / frames * 1e3,
+        'kbps': coding['bytes'] * 8 * config['fps'] / frames / 1000,
+        'miss_rate': float(1 - found.mean()),
+        'error_mean': float(errors[found].mean()) if found.any() else None,
+        'error_p95': float(np.percentile(errors[found], 95)) if found.any() else None,
+        'error_max': float(errors[found].max()) if found.any() else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline detector evaluation on generated frames, without WebRTC')
+    parser.add_argument('--frames', type=int, default=10000)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--radius', type=int, default=17)
+    parser.add_argument('--velocity', type=int, default=5)
+    parser.add_argument('--fps', type=float, default=30, help='frame rate the encoders plan for, sets the bitrate')
+    parser.add_argument('--codec', choices=tuple(CODECS), help='encode and decode the frames like the video track')
+    parser.add_argument('--bitrate', type=int, default=500000, help='encoder bitrate with --codec')
+    parser.add_argument('--profile', action='append', choices=tuple(PROFILES),
+                        help='encode and decode with this server encoder profile, repeat to compare several')
+    parser.add_argument('--detector', default='hough', help='detector backend, see detectors.DETECTORS')
+    parser.add_argument('--roi', action='store_true', help='search near the last detection first')
+    parser.add_argument('--sweep', action='append', metavar='NAME=V1,V2',
+                        help='detector parameter values to try, repeat for a grid, e.g. --sweep dp=4,6 --sweep minDist=8,16')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, default=500, help='frames per pool task')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    # named profiles, the --codec one, or frames that are never encoded
+    if args.profile:
+        profiles = [(name, make_profile(name)) for name in args.profile]
+    elif args.codec:
+        profiles = [(args.codec, make_profile(codec=args.codec, bitrate=args.bitrate))]
+    else:
+        profiles = [(None, None)]
+    results = []
+    with mp.Pool(args.workers) as pool:
+        for (name, profile), params in itertools.product(profiles, parse_sweep(args.sweep)):
+            config = dict(vars(args), profile=profile, profile_name=name)
+            r = evaluate(config, params, pool)
+            results.append(r)
+            error = 'n/a' if r['error_mean'] is None else f"{r['error_mean']:.2f} (p95 {r['error_p95']:.2f})"
+            coding = '' if profile is None else f"{name:10s} encode {r['encode_mean_ms']:6.3f} ms  " \
+                f"decode {r['decode_mean_ms']:6.3f} ms  {r['kbps']:6.0f} kbps  "
+            print(f"{coding}{json.dumps(params):32s} {r['fps']:9.0f} fps  detect {r['detect_mean_ms']:7.3f} ms  "
+                  f"error {error}  miss {r['miss_rate']:.1%}")
+    config = dict(vars(args), profiles=dict(profiles))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
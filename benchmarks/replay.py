@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from baseline import compare_to_baseline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'client'))
+sys.path.append(os.path.join(ROOT, 'server'))
+from ball_detection import DROP_FIFO, DROP_LATEST, estimate_center
+from capture import CaptureReader, ReplaySource
+from detection_pool import DetectionPool
+from detectors import make_detector
+from frame import Frame
+from tracker import BallTracker
+
+METRICS = {'fps': True, 'detect_mean_ms': False, 'miss_rate': False, 'error_mean': False}
+
+
+def ground_truth(info: dict, pts: np.ndarray) -> np.ndarray:
+    '''
+    Ball positions of the captured frames from the stream info the server sent
+    '''
+    keys = np.rint((pts + info['pts_offset']) / info['pts_step']).astype(np.int64)
+    return Frame(info['velocity'], info['radius'], info['width'], info['height']).positions_at(keys)
+
+
+def replay_direct(source: ReplaySource, detector, tracker: BallTracker = None) -> tuple:
+    '''
+    Detect on the mapped frames in this process, nothing is copied
+
+    return: (estimates with nan for misses, detection seconds per detected frame)
+    '''
+    estimates = np.full((len(source.reader), 2), np.nan)
+    seconds = []
+    for i, (pts, frame) in enumerate(source):
+        if tracker is not None and not tracker.should_detect():
+            found = tracker.predict(pts)
+        else:
+            start = time.perf_counter()
+            found = estimate_center(frame, detector)
+            seconds.append(time.perf_counter() - start)
+            if tracker is not None:
+                found = tracker.update(pts, found)
+        if found is not None:
+            estimates[i] = found[:2]
+    return estimates, np.array(seconds)
+
+
+def replay_pipeline(source: ReplaySource, detector, workers: int, drop_policy: str,
+                    tracker: BallTracker = None) -> tuple:
+    '''
+    Feed the frames through the client's detection processes, dropped frames count as misses
+    unless the tracker predicts them
+
+    return: (estimates with nan for misses, detection seconds per processed frame)
+    '''
+    pool = DetectionPool(workers, max_frame_shape=source.reader.shape, drop_policy=drop_policy, detector=detector,
+                         tracker=tracker)
+    pool.start()
+    rows = {int(pts): i for i, pts in enumerate(source.reader.pts)}
+    estimates = np.full((len(rows), 2), np.nan)
+    seconds = []
+
+    def collect():
+        for x, y, time_stamp, confidence, latency_us in pool.results():
+            if latency_us:
+                seconds.append(latency_us * 1e-6)
+            if confidence > 0:
+                estimates[rows[time_stamp]] = (x, y)
+    try:
+        for pts, frame in source:
+            if tracker is not None and not tracker.should_detect():
+                pool.skip(pts)
+                collect()
+                continue
+            while not pool.submit(frame, pts) and drop_policy == DROP_FIFO:
+                # as fast as possible replays wait for a free slot instead of dropping
+                collect()
+                time.sleep(0.0005)
+            collect()
+        # wait for every submitted frame, including the ones no worker has picked up yet
+        deadline = time.monotonic() + 5
+        while pool.pending() and time.monotonic() < deadline:
+            time.sleep(0.001)
+            collect()
+    finally:
+        pool.shutdown()
+    return estimates, np.array(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a capture recorded with client.py --capture through a detector')
+    parser.add_argument('capture', help='capture file')
+    parser.add_argument('--detector', default='hough', help='detector backend, see detectors.DETECTORS')
+    parser.add_argument('--roi', action='store_true', help='search near the last detection first')
+    parser.add_argument('--realtime', action='store_true', help='replay at the pace of the pts instead of as fast as possible')
+    parser.add_argument('--pipeline', action='store_true', help='detect in the client detection processes')
+    parser.add_argument('--workers', type=int, default=1, help='detection processes with --pipeline')
+    parser.add_argument('--track', action='store_true', help='predict the frames that are not detected')
+    parser.add_argument('--detect-every', type=int, default=1,
+                        help='with --track, detect every n-th frame and predict the ones in between')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare with the JSON file of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    reader = CaptureReader(args.capture)
+    if reader.info is None:
+        sys.exit(f"{args.capture} has no stream info, the ground truth is unknown")
+    source = ReplaySource(reader, realtime=args.realtime)
+    detector = make_detector(args.detector, args.roi)
+    tracker = None
+    if args.track:
+        tracker = BallTracker(args.detect_every)
+        tracker.bounds = (reader.shape[1], reader.shape[0] * 2 // 3)
+    start = time.perf_counter()
+    if args.pipeline:
+        # real time replays drop frames like the client does, fast ones wait for the detectors
+        estimates, seconds = replay_pipeline(source, detector, args.workers,
+                                             DROP_LATEST if args.realtime else DROP_FIFO, tracker)
+    else:
+        estimates, seconds = replay_direct(source, detector, tracker)
+    elapsed = time.perf_counter() - start
+
+    errors = np.linalg.norm(estimates - ground_truth(reader.info, reader.pts), axis=1)
+    found = ~np.isnan(errors)
+    r = {
+        'frames': len(reader),
+        'seconds': elapsed,
+        'fps': len(reader) / elapsed,
+        'detected': len(seconds),
+        'predicted': tracker.predicted if tracker is not None else 0,
+        'detect_mean_ms': float(seconds.mean() * 1e3) if len(seconds) else None,
+        'miss_rate': float(1 - found.mean()),
+        'error_mean': float(errors[found].mean()) if found.any() else None,
+        'error_p95': float(np.percentile(errors[found], 95)) if found.any() else None,
+        'error_max': float(errors[found].max()) if found.any() else None,
+    }
+    print(json.dumps(r, indent=2))
+    results = {'replay': r}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+    if args.baseline and compare_to_baseline(results, args.baseline, METRICS, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
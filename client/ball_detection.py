@@ -1,59 +1,241 @@
 import ctypes
+import os
+import time
 import multiprocessing as mp
 import numpy as np
 import cv2 
 
-class POINT(ctypes.Structure):
+class RESULT(ctypes.Structure):
     '''
-    Stores the position of ball and the corresponding timestamp.
+    Entry of the shared results table. Stores the position of ball and the corresponding timestamp.
 
+    param seq:          sequence number of the frame assigned by the client
+    param time_stamp:   corresponding timestamp
     param x:            position on x-axis of the ball
     param y:            position on y-axis of the ball
-    param time_stamp:   corresponding timestamp
+    param radius:       radius of the ball
+    param count:        balls stored in the target table for this entry, see DetectionPool max_targets
+    param latency_us:   time spent detecting, in microseconds
+    param status:       one of RESULT_PENDING, RESULT_FOUND, RESULT_MISSED, RESULT_DROPPED, RESULT_SKIPPED
+    '''
+    _fields_ = [
+        ("seq", ctypes.c_longlong),
+        ("time_stamp", ctypes.c_longlong),
+        ("x", ctypes.c_float),
+        ("y", ctypes.c_float),
+        ("radius", ctypes.c_float),
+        ("count", ctypes.c_int),
+        ("latency_us", ctypes.c_int),
+        ("status", ctypes.c_int)
+    ]
+
+# status of an entry in the results table
+RESULT_PENDING = 0  # frame submitted, no result yet
+RESULT_FOUND = 1    # ball detected, x and y are valid
+RESULT_MISSED = 2   # detection ran but found no ball
+RESULT_DROPPED = 3  # frame skipped by the drop policy
+RESULT_SKIPPED = 4  # frame never handed to a detector, see DetectionPool.skip
+
+class FRAME_STATS(ctypes.Structure):
+    '''
+    Counts frames seen by a detection process.
+
+    param received:     frames taken from the frame queue
+    param processed:    frames the detector ran on
+    param dropped:      frames skipped because of the drop policy
     '''
     _fields_ = [
-        ("x", ctypes.c_int),
-        ("y", ctypes.c_int),
-        ("time_stamp", ctypes.c_int)
+        ("received", ctypes.c_longlong),
+        ("processed", ctypes.c_longlong),
+        ("dropped", ctypes.c_longlong)
     ]
 
-def detect_center_proc(que: mp.Queue, val: mp.Value, cond: mp.Value):
+# drop policies of the detection process
+DROP_FIFO = 'fifo'              # process every frame in the (bounded) queue in order
+DROP_LATEST = 'latest'          # skip to the newest frame, dropping the ones in between
+DROP_EVERY_NTH = 'every_nth'    # process every n-th received frame
+DROP_POLICIES = (DROP_FIFO, DROP_LATEST, DROP_EVERY_NTH)
+
+# how long the detection process sleeps without a wakeup before checking the queue again
+WAKEUP_TIMEOUT = 0.5
+
+
+def detect_center_proc(que, results: mp.Array, wakeup: mp.Event = None, policy: str = DROP_FIFO,
+                       every_nth: int = 1, stats: mp.Value = None, detector = None, notify = None,
+                       targets: mp.Array = None):
     '''
-    Run detect_center function in a process. Continously update estimated ball center for frames in que
+    Run detect_center function in a process. Continously estimate ball centers for frames in que.
+    The process blocks on wakeup while there is nothing to do instead of polling, and writes a byte
+    to notify whenever results changed so the client's event loop picks them up right away.
 
-    param que:  used to pass frames and timestamps to process
-    param val:  used to pass image center coordinates and corresponding timestamp back to main thread
-    param cond: whether main thread has dealt with the value in val.
+    param que:          FrameRing used to pass frames, timestamps and sequence numbers to process
+    param results:      results table shared with the client, indexed by sequence number
+    param wakeup:       set by the client whenever a frame is added
+    param policy:       drop policy, one of DROP_POLICIES
+    param every_nth:    frame interval for the every_nth policy
+    param stats:        FRAME_STATS counters shared with the client
+    param detector:     detector backend (see detectors.py), detect_center is used if None
+    param notify:       write end of a pipe, see DetectionPool.notify_fileno
+    param targets:      shared float array of len(results) * max_targets * 3, every ball is detected if given
     '''
+    if stats is None:
+        stats = FRAME_STATS()
+    if targets is not None:
+        targets = np.frombuffer(targets, dtype=np.float32).reshape(len(results), -1, 3)
+    if notify is not None:
+        os.set_blocking(notify.fileno(), False)
     try:
         while True:
-            update_center_values(que, val, cond)
+            if wakeup is not None:
+                wakeup.clear()
+            received = stats.received
+            processed = update_center_values(que, results, policy, every_nth, stats, detector, targets)
+            if notify is not None and stats.received != received:
+                notify_results(notify)
+            if not processed and wakeup is not None:
+                wakeup.wait(WAKEUP_TIMEOUT)
     except Exception as e:
         print("Detect Center Error:", e)
         return
     
-def update_center_values(que: mp.Queue, val: mp.Value, cond: mp.Value):
+def notify_results(notify):
+    '''
+    Signal the client that results table entries changed, drops included
     '''
-    Update estimated ball center for frames
+    try:
+        os.write(notify.fileno(), b'\x01')
+    except BlockingIOError:
+        # the pipe is full, so the client is woken up anyway
+        pass
 
-    param que:  used to pass frames and timestamps to process
-    param val:  used to pass image center coordinates and corresponding timestamp back to main thread
-    param cond: whether main thread has dealt with the value in val.
+def update_center_values(que, results: mp.Array, policy: str = DROP_FIFO, every_nth: int = 1,
+                         stats: mp.Value = None, detector = None, targets: np.ndarray = None) -> bool:
     '''
-    if que.qsize() > 0 and cond.value==0:
-        with cond.get_lock():
-            frame, timestamp = que.get()
-            circles = detect_center(frame)
+    Estimate the ball center for the next frame in que and store it in the results table
 
-             # if detection fails, use last estimated position
-            if circles is None:
-                val.time_stamp = timestamp
-                cond.value = 1
-            else:
-                val.x = int(circles[0])
-                val.y = int(circles[1])
-                val.time_stamp = timestamp
-                cond.value = 1
+    return:             whether a frame was processed
+    param que:          FrameRing used to pass frames, timestamps and sequence numbers to process
+    param results:      results table shared with the client, indexed by sequence number
+    param policy:       drop policy, one of DROP_POLICIES
+    param every_nth:    frame interval for the every_nth policy
+    param stats:        FRAME_STATS counters, required for the every_nth policy
+    param detector:     detector backend (see detectors.py), detect_center is used if None
+    param targets:      (len(results), max_targets, 3) table receiving [x_position, y_position, radius] of every
+                        ball found, the entry only holds their count. Only the first ball is detected if None
+    '''
+    if policy == DROP_EVERY_NTH and stats is None:
+        raise ValueError("every_nth policy needs frame stats to count frames")
+    while que.qsize() > 0:
+        frame, timestamp, seq = que.get_tagged()
+        received = stats.received if stats is not None else 0
+        if stats is not None:
+            stats.received += 1
+        entry = results[seq % len(results)]
+
+        # skip frames according to the drop policy
+        if (policy == DROP_LATEST and que.qsize() > 0) or \
+                (policy == DROP_EVERY_NTH and received % every_nth != 0):
+            if stats is not None:
+                stats.dropped += 1
+            entry.status = RESULT_DROPPED
+            continue
+
+        start = time.perf_counter()
+        if targets is None:
+            circles = estimate_center(frame, detector)
+        else:
+            balls = estimate_centers(frame, detector)[:targets.shape[1]]
+            targets[seq % len(results), :len(balls)] = balls
+            entry.count = len(balls)
+            circles = balls[0] if len(balls) else None
+        entry.latency_us = int((time.perf_counter() - start) * 1e6)
+        if stats is not None:
+            stats.processed += 1
+
+        # status is written last, the client only reads an entry once it is no longer pending
+        if circles is None:
+            entry.status = RESULT_MISSED
+        else:
+            entry.x = circles[0]
+            entry.y = circles[1]
+            entry.radius = circles[2]
+            entry.status = RESULT_FOUND
+        return True
+    return False
+
+def estimate_center(frame: np.ndarray, detector = None):
+    '''
+    Estimate the ball center of a frame that is either BGR (height, width, 3) or packed I420 planes
+    (height * 3 / 2, width) as written by copy_i420. I420 frames are detected on the planes directly.
+
+    return:         list [x_position, y_position, radius] or None
+    param frame:    BGR or packed I420 frame
+    param detector: detector backend (see detectors.py), Hough Transformation if None
+    '''
+    if frame.ndim == 2:
+        y_plane, _, v_plane = split_i420(frame)
+        return detect_center_yuv(y_plane) if detector is None else detector.detect_yuv(y_plane, v_plane)
+    return detect_center(frame) if detector is None else detector.detect(frame)
+
+def estimate_centers(frame: np.ndarray, detector = None) -> np.ndarray:
+    '''
+    Same as estimate_center for every ball in the frame
+
+    return:         array (n, 3) of [x_position, y_position, radius], empty without balls
+    param frame:    BGR or packed I420 frame
+    param detector: detector backend (see detectors.py), Hough Transformation if None
+    '''
+    if frame.ndim == 2:
+        y_plane, _, v_plane = split_i420(frame)
+        return detect_centers_yuv(y_plane) if detector is None else detector.detect_all_yuv(y_plane, v_plane)
+    return detect_centers(frame) if detector is None else detector.detect_all(frame)
+
+def copy_i420(frame, dst: np.ndarray) -> np.ndarray:
+    '''
+    Copy the planes of a yuv420p av.VideoFrame into a packed I420 array, the layout to_ndarray() returns,
+    without building an intermediate array.
+
+    return:         dst
+    param frame:    av.VideoFrame in yuv420p format with even width and height
+    param dst:      array of shape (height * 3 / 2, width)
+    '''
+    width, height = frame.width, frame.height
+    offset = 0
+    for plane in frame.planes:
+        rows, cols = plane.height, plane.width
+        src = np.frombuffer(plane, np.uint8).reshape(rows, plane.line_size)[:, :cols]
+        # chroma planes are stored as rows of full width, each holding two half width rows
+        np.copyto(dst.reshape(-1)[offset:offset + rows * cols].reshape(rows, cols), src)
+        offset += rows * cols
+    return dst
+
+def split_i420(frame: np.ndarray) -> tuple:
+    '''
+    Views of the Y, U and V planes of a packed I420 frame
+
+    return:         (y_plane, u_plane, v_plane), chroma planes at half resolution
+    param frame:    array of shape (height * 3 / 2, width)
+    '''
+    height, width = frame.shape[0] * 2 // 3, frame.shape[1]
+    chroma = height * width // 4
+    flat = frame.reshape(-1)
+    u_plane = flat[height * width:height * width + chroma].reshape(height // 2, width // 2)
+    v_plane = flat[height * width + chroma:height * width + 2 * chroma].reshape(height // 2, width // 2)
+    return frame[:height], u_plane, v_plane
+
+def detect_center_yuv(y_plane: np.ndarray, dp: float = 6, minDist: float = 8) -> list[int, int, int]:
+    '''
+    Same as detect_center, on the luma plane of a decoded frame instead of a converted gray frame.
+
+    return:         list [x_position, y_position, radius]
+    param y_plane:  Y plane of a yuv420p frame
+    param dp:       accumulator matrix scale factor
+    param minDist:  minimum distance between estimated ball centers
+    '''
+    circles = cv2.HoughCircles(y_plane, cv2.HOUGH_GRADIENT, dp, minDist)
+    if circles is not None:
+        return circles[0][0]
+    return None
 
 def detect_center(frame: np.ndarray, dp: float = 6, minDist: float = 8) -> list[int, int, int]:
     '''
@@ -68,4 +250,24 @@ def detect_center(frame: np.ndarray, dp: float = 6, minDist: float = 8) -> list[
     circles = cv2.HoughCircles(gray_frame, cv2.HOUGH_GRADIENT, dp, minDist)
     if circles is not None:
         return circles[0][0]
-    return None
\ No newline at end of file
+    return None
+
+def detect_centers(frame: np.ndarray, dp: float = 6, minDist: float = 8) -> np.ndarray:
+    '''
+    Detect every ball in an image using the Hough Transformation, strongest circle first
+
+    return:         array (n, 3) of [x_position, y_position, radius], empty without balls
+    param frame:    ndarray in BGR24 format representing picture
+    param dp:       accumulator matrix scale factor
+    param minDist:  minimum distance between estimated ball centers
+    '''
+    return detect_centers_yuv(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), dp, minDist)
+
+def detect_centers_yuv(y_plane: np.ndarray, dp: float = 6, minDist: float = 8) -> np.ndarray:
+    '''
+    Same as detect_centers, on the luma plane of a decoded frame
+    '''
+    circles = cv2.HoughCircles(y_plane, cv2.HOUGH_GRADIENT, dp, minDist)
+    if circles is None:
+        return np.empty((0, 3), dtype=np.float32)
+    return circles[0]
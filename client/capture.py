@@ -0,0 +1,165 @@
+import asyncio
+import json
+import time
+import numpy as np
+from ball_detection import copy_i420
+
+# Capture file layout, all little-endian:
+#   header      HEADER_SIZE bytes: HEADER_FIELDS uint64 fields, then the stream info as JSON
+#   index       capacity int64 pts
+#   frames      capacity packed I420 frames of rows x cols bytes, starting at a page boundary
+MAGIC = int.from_bytes(b'BBCAPTUR', 'little')
+VERSION = 1
+HEADER_SIZE = 4096
+HEADER_FIELDS = ('magic', 'version', 'capacity', 'rows', 'cols', 'count', 'info_length', 'reserved')
+INFO_OFFSET = len(HEADER_FIELDS) * 8
+
+
+def _layout(capacity: int, rows: int, cols: int) -> tuple:
+    '''
+    return: (offset of the frames, file size)
+    '''
+    frames_offset = -(-(HEADER_SIZE + capacity * 8) // 4096) * 4096
+    return frames_offset, frames_offset + capacity * rows * cols
+
+
+class CaptureWriter():
+    '''
+    Appends received frames and their pts to a preallocated memory mapped file.
+
+    The file is created with the shape of the first frame; frames of another shape and frames beyond the
+    capacity are skipped. The server's stream info, which determines the ground truth of every pts, is
+    stored in the header once it arrives. See CaptureReader.
+    '''
+    def __init__(self, path: str, capacity: int = 3000):
+        '''
+        param path:         capture file, overwritten
+        param capacity:     largest number of frames stored
+        param skipped:      frames that didn't fit
+        '''
+        self.path = path
+        self.capacity = capacity
+        self.skipped = 0
+        self._map = None
+        self._header = None
+        self._index = None
+        self._frames = None
+        self._info = None
+
+    def _create(self, rows: int, cols: int):
+        frames_offset, size = _layout(self.capacity, rows, cols)
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='w+', shape=(size,))
+        self._header = self._map[:INFO_OFFSET].view('<u8')
+        self._header[:] = (MAGIC, VERSION, self.capacity, rows, cols, 0, 0, 0)
+        self._index = self._map[HEADER_SIZE:HEADER_SIZE + self.capacity * 8].view('<i8')
+        self._frames = self._map[frames_offset:].reshape(self.capacity, rows, cols)
+        if self._info is not None:
+            self.set_stream_info(self._info)
+
+    def __len__(self) -> int:
+        return 0 if self._header is None else int(self._header[5])
+
+    def append(self, frame) -> bool:
+        '''
+        Store a decoded frame
+
+        param frame:    av.VideoFrame in yuv420p format
+        return:         False if the frame was skipped
+        '''
+        rows, cols = frame.height * 3 // 2, frame.width
+        if self._map is None:
+            self._create(rows, cols)
+        count = len(self)
+        if count >= self.capacity or self._frames.shape[1:] != (rows, cols):
+            self.skipped += 1
+            return False
+        copy_i420(frame, self._frames[count])
+        self._index[count] = frame.pts
+        # the count is written last, a reader never sees a half written frame
+        self._header[5] = count + 1
+        return True
+
+    def set_stream_info(self, info: dict):
+        '''
+        Store the server's stream parameters, see protocol.decode_stream_info
+        '''
+        self._info = info
+        if self._map is None:
+            return
+        payload = json.dumps(info).encode('utf8')
+        if INFO_OFFSET + len(payload) > HEADER_SIZE:
+            raise ValueError("stream info does not fit into the capture header")
+        self._map[INFO_OFFSET:INFO_OFFSET + len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        self._header[6] = len(payload)
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map = self._header = self._index = self._frames = None
+
+
+class CaptureReader():
+    '''
+    Read-only view of a capture file. frame(i) returns a view into the mapped file, nothing is copied.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        header = dict(zip(HEADER_FIELDS, self._map[:INFO_OFFSET].view('<u8').tolist()))
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError(f"{path} is not a capture file of version {VERSION}")
+        capacity, rows, cols = header['capacity'], header['rows'], header['cols']
+        frames_offset, _ = _layout(capacity, rows, cols)
+        self.count = header['count']
+        self.shape = (rows, cols)
+        self.pts = self._map[HEADER_SIZE:HEADER_SIZE + capacity * 8].view('<i8')[:self.count]
+        self.frames = self._map[frames_offset:].reshape(capacity, rows, cols)[:self.count]
+        length = header['info_length']
+        self.info = json.loads(self._map[INFO_OFFSET:INFO_OFFSET + length].tobytes()) if length else None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def frame(self, i: int) -> np.ndarray:
+        '''
+        Packed I420 frame i, a read-only view into the file
+        '''
+        return self.frames[i]
+
+
+class ReplaySource():
+    '''
+    Serves the frames of a capture in order, paced by their pts or as fast as possible
+    '''
+    def __init__(self, reader: CaptureReader, realtime: bool = True, clock_rate: int = 90000):
+        '''
+        param reader:       capture to replay
+        param realtime:     wait until each frame is due relative to the first one
+        param clock_rate:   pts ticks per second
+        '''
+        self.reader = reader
+        self.realtime = realtime
+        self.clock_rate = clock_rate
+
+    def __iter__(self):
+        '''
+        yields: (pts, packed I420 frame view), blocking while pacing
+        '''
+        start = time.monotonic()
+        for i in range(len(self.reader)):
+            if self.realtime:
+                time.sleep(max(0.0, start + self._due(i) - time.monotonic()))
+            yield int(self.reader.pts[i]), self.reader.frame(i)
+
+    async def frames(self):
+        '''
+        Same as iterating, for event loops
+        '''
+        start = time.monotonic()
+        for i in range(len(self.reader)):
+            if self.realtime:
+                await asyncio.sleep(max(0.0, start + self._due(i) - time.monotonic()))
+            yield int(self.reader.pts[i]), self.reader.frame(i)
+
+    def _due(self, i: int) -> float:
+        return (int(self.reader.pts[i]) - int(self.reader.pts[0])) / self.clock_rate
@@ -1,18 +1,61 @@
+import argparse
 import asyncio
-from rtc_client import RTCClient
+from metrics import Metrics
+from detectors import make_detector
+from display import DISPLAY_MODES, DISPLAY_THREAD
+from runtime import ClientRuntime
+from tracker import BallTracker
 
 
-async def main():
+async def main(args):
     '''
     Build and run client
     '''
-    client = RTCClient(host='localhost', port='12345')
-    await client.run()
+    metrics = Metrics()
+    if args.metrics_jsonl or args.metrics_port:
+        metrics.export(args.metrics_jsonl, args.metrics_port, args.metrics_interval)
+    tracker = BallTracker(args.detect_every) if args.track else None
+    # detection processes stay up across sessions, every reconnect reuses them
+    runtime = ClientRuntime(host='localhost', port='12345', sessions=args.sessions,
+                            detector=make_detector(args.detector), tracker=tracker, max_targets=args.max_balls,
+                            metrics=metrics, capture=args.capture, capture_frames=args.capture_frames,
+                            codec=args.codec, batch_interval=args.batch_interval, display=args.display,
+                            display_every_nth=args.display_every_nth)
+    try:
+        await runtime.run()
+    finally:
+        metrics.close()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Ball detection client')
+    parser.add_argument('--metrics-jsonl', help='append stage timings to this file every --metrics-interval seconds')
+    parser.add_argument('--metrics-port', type=int, help='serve stage timings for Prometheus on this local port')
+    parser.add_argument('--metrics-interval', type=float, default=10)
+    parser.add_argument('--capture', help='record the received frames to this file, see benchmarks/replay.py')
+    parser.add_argument('--capture-frames', type=int, default=3000, help='largest number of frames recorded')
+    parser.add_argument('--detector', default='hough', help='detector backend, see detectors.DETECTORS')
+    parser.add_argument('--max-balls', type=int, default=1,
+                        help='report up to this many balls per frame, for servers started with --balls')
+    parser.add_argument('--track', action='store_true',
+                        help='report a predicted position for frames that were not detected')
+    parser.add_argument('--detect-every', type=int, default=1,
+                        help='with --track, detect every n-th frame and predict the ones in between')
+    parser.add_argument('--codec', choices=('vp8', 'h264'),
+                        help='only accept this video codec, the server must offer it')
+    parser.add_argument('--display', default=DISPLAY_THREAD, choices=DISPLAY_MODES,
+                        help="how received frames are shown, 'off' runs headless")
+    parser.add_argument('--display-every-nth', type=int, default=1,
+                        help='with --display every_nth, show every n-th frame')
+    parser.add_argument('--batch-interval', type=float, default=0,
+                        help='seconds a result may wait for more results to share its message, 0 sends right away')
+    parser.add_argument('--sessions', type=int, default=0,
+                        help='exit after this many sessions, 0 reconnects whenever a session ends')
+    args = parser.parse_args()
+    if args.capture and args.sessions != 1:
+        parser.error('--capture records a single session, pass --sessions 1')
     # run client in an event loop
     try:
-        asyncio.run(main())
+        asyncio.run(main(args))
     except KeyboardInterrupt:
         print("Key interrupt")
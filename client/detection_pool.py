@@ -0,0 +1,363 @@
+import ctypes
+import multiprocessing as mp
+import os
+import select
+import time
+import numpy as np
+from ball_detection import RESULT, RESULT_PENDING, RESULT_FOUND, RESULT_MISSED, RESULT_DROPPED, RESULT_SKIPPED, \
+    FRAME_STATS, DROP_LATEST, DROP_POLICIES, detect_center_proc
+from frame_ring import FrameRing
+
+
+class DetectionPool():
+    '''
+    Pool of detection processes fed round-robin through per-process frame rings.
+
+    Every submitted frame gets a sequence number and an entry in a shared results table. Workers fill
+    in the entries as they finish, in any order, and results() hands them back in submission (pts) order.
+    With a tracker, frames that were skipped, dropped or missed get its prediction instead.
+
+    Workers write a byte to a pipe after every frame they took, so an event loop can watch
+    notify_fileno() and collect results as soon as they are ready instead of polling.
+
+    With max_targets > 1 workers detect every ball, up to max_targets per frame, into a shared target
+    table next to the results table, and results() hands back one tuple per ball.
+
+    The workers outlive sessions: reset() starts the next session on the running processes, so a
+    reconnecting client pays neither process start nor the detector's first call again.
+    '''
+    def __init__(self, workers: int = 1, ring_slots: int = 4, max_frame_shape: tuple = (1080, 1920, 3),
+                 drop_policy: str = DROP_LATEST, every_nth: int = 1, table_size: int = 256, detector = None,
+                 tracker = None, max_targets: int = 1):
+        '''
+        param workers:          number of detection processes
+        param ring_slots:       number of frame slots per worker
+        param max_frame_shape:  largest frame the shared slots can hold
+        param drop_policy:      which frames a worker skips when it falls behind, one of DROP_POLICIES
+        param every_nth:        frame interval for the every_nth drop policy
+        param table_size:       number of entries in the results table
+        param detector:         detector backend each worker gets a copy of, detect_center if None
+        param tracker:          tracker.BallTracker fed with the results in pts order, None reports detections only
+        param max_targets:      balls reported per frame, more than one can't be combined with a tracker
+        param skipped:          frames passed to skip()
+        param lost:             frames of a worker that exited before it finished them
+        '''
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"unknown drop policy {drop_policy}, expected one of {DROP_POLICIES}")
+        if workers < 1:
+            raise ValueError("a detection pool needs at least one worker")
+        if max_targets > 1 and tracker is not None:
+            raise ValueError("the tracker follows a single ball, it can't be used with max_targets > 1")
+        self.workers = workers
+        self.drop_policy = drop_policy
+        self.every_nth = every_nth
+        self.detector = detector
+        self.tracker = tracker
+        self.max_targets = max_targets
+        self._rings = [FrameRing(ring_slots, max_frame_shape) for _ in range(workers)]
+        self._wakeups = [mp.Event() for _ in range(workers)]
+        self._stats = [mp.Value(FRAME_STATS, lock=False) for _ in range(workers)]
+        self._results = mp.Array(RESULT, max(table_size, workers * ring_slots * 2), lock=False)
+        self._target_table = None
+        self._targets = None
+        if max_targets > 1:
+            self._target_table = mp.Array(ctypes.c_float, len(self._results) * max_targets * 3, lock=False)
+            self._targets = np.frombuffer(self._target_table, dtype=np.float32).reshape(len(self._results),
+                                                                                      max_targets, 3)
+        self._notify_reader, self._notify_writer = mp.Pipe(duplex=False)
+        os.set_blocking(self._notify_reader.fileno(), False)
+        self._procs = []
+        self._dead = set()      # workers found exited, they get no more frames
+        self._entry_workers = [None] * len(self._results)
+        self._next_seq = 0      # sequence number of the next submitted frame
+        self._emit_seq = 0      # sequence number of the next result to hand back
+        self._next_worker = 0
+        self._pending_worker = None
+        self._last_point = (-1, -1)
+        self._skipped_pending = 0
+        self.ring_full = 0
+        self.table_full = 0
+        self.skipped = 0
+        self.lost = 0
+        self._stats_base = dict.fromkeys(('received', 'processed', 'dropped'), 0)
+
+    def start(self):
+        '''
+        Start the detection processes
+        '''
+        for ring, wakeup, stats in zip(self._rings, self._wakeups, self._stats):
+            proc = mp.Process(target=detect_center_proc, args=(
+                ring,
+                self._results,
+                wakeup,
+                self.drop_policy,
+                self.every_nth,
+                stats,
+                self.detector,
+                self._notify_writer,
+                self._target_table
+            ), daemon=True)
+            proc.start()
+            self._procs.append(proc)
+
+    def fits(self, shape: tuple) -> bool:
+        '''
+        Whether a frame of this shape fits the shared slots
+        '''
+        return self._rings[0].fits(shape)
+
+    def reserve(self, shape: tuple) -> np.ndarray:
+        '''
+        Reserve a frame slot on the next worker in turn, skipping workers whose ring is full or that exited.
+        Returns None if the frame has to be dropped, either because every ring is full or
+        the results table has no free entry.
+
+        param shape:    shape of the frame that will be written
+        '''
+        if self._next_seq - self._emit_seq >= len(self._results):
+            self.table_full += 1
+            return None
+        for i in range(self.workers):
+            worker = (self._next_worker + i) % self.workers
+            if not self._alive(worker):
+                continue
+            slot = self._rings[worker].reserve(shape)
+            if slot is not None:
+                self._pending_worker = worker
+                self._next_worker = worker + 1
+                return slot
+        if len(self._dead) == self.workers:
+            self.lost += 1
+        else:
+            self.ring_full += 1
+        return None
+
+    def _alive(self, worker: int) -> bool:
+        '''
+        Whether a worker's process is running, workers of a pool that isn't started count as running.
+        A worker found exited is reported once
+        '''
+        if worker in self._dead:
+            return False
+        if not self._procs or self._procs[worker].is_alive():
+            return True
+        print(f"Detection worker {worker} exited with code {self._procs[worker].exitcode}, its frames are dropped")
+        self._dead.add(worker)
+        return False
+
+    def commit(self, time_stamp: int):
+        '''
+        Hand the frame written into the reserved slot to its worker
+
+        param time_stamp:   pts of the frame
+        '''
+        seq, worker = self._next_seq, self._pending_worker
+        entry = self._results[seq % len(self._results)]
+        entry.seq = seq
+        entry.time_stamp = time_stamp
+        entry.status = RESULT_PENDING
+        self._entry_workers[seq % len(self._results)] = worker
+        self._rings[worker].commit(time_stamp, seq)
+        self._wakeups[worker].set()
+        self._pending_worker = None
+        self._next_seq = seq + 1
+
+    def submit(self, frame: np.ndarray, time_stamp: int) -> bool:
+        '''
+        Copy a frame to the next worker. Returns False if the frame was dropped.
+        '''
+        slot = self.reserve(frame.shape)
+        if slot is None:
+            return False
+        np.copyto(slot, frame)
+        self.commit(time_stamp)
+        return True
+
+    def skip(self, time_stamp: int) -> bool:
+        '''
+        Take a frame in pts order without detecting it, so the tracker predicts it.
+        Returns False if the results table has no free entry.
+
+        param time_stamp:   pts of the frame
+        '''
+        seq = self._next_seq
+        if seq - self._emit_seq >= len(self._results):
+            self.table_full += 1
+            return False
+        entry = self._results[seq % len(self._results)]
+        entry.seq = seq
+        entry.time_stamp = time_stamp
+        entry.status = RESULT_SKIPPED
+        self._next_seq = seq + 1
+        self._skipped_pending += 1
+        self.skipped += 1
+        return True
+
+    def results(self) -> list:
+        '''
+        Collect finished results in pts order, stopping at the first frame still being processed.
+        Frames of a worker that exited are dropped instead of holding back the ones after them.
+        Frames where detection found nothing report the last known position with zero confidence,
+        dropped and skipped frames are left out. With a tracker every frame reports its estimate,
+        see tracker.BallTracker.
+
+        return: list of (x, y, time_stamp, confidence, latency_us)
+        '''
+        done = []
+        while self._emit_seq < self._next_seq:
+            index = self._emit_seq % len(self._results)
+            entry = self._results[index]
+            if entry.status == RESULT_PENDING:
+                if self._alive(self._entry_workers[index]):
+                    break
+                # read again, the worker may have finished the frame right before it exited
+                if entry.status == RESULT_PENDING:
+                    entry.status = RESULT_DROPPED
+                    self.lost += 1
+            if entry.status == RESULT_SKIPPED:
+                self._skipped_pending -= 1
+            if self.tracker is not None:
+                self._track(entry, done)
+            elif self._targets is not None:
+                self._all_targets(entry, done)
+            elif entry.status == RESULT_FOUND:
+                self._last_point = (entry.x, entry.y)
+                done.append((*self._last_point, entry.time_stamp, 1.0, entry.latency_us))
+            elif entry.status == RESULT_MISSED:
+                done.append((*self._last_point, entry.time_stamp, 0.0, entry.latency_us))
+            self._emit_seq += 1
+        return done
+
+    def _all_targets(self, entry, done: list):
+        '''
+        Append one result per ball of a finished entry. A frame without balls reports nan with zero
+        confidence, so it still counts as reported
+        '''
+        if entry.status == RESULT_FOUND:
+            for x, y, _ in self._targets[entry.seq % len(self._results), :entry.count].tolist():
+                done.append((x, y, entry.time_stamp, 1.0, entry.latency_us))
+        elif entry.status == RESULT_MISSED:
+            done.append((np.nan, np.nan, entry.time_stamp, 0.0, entry.latency_us))
+
+    def _track(self, entry, done: list):
+        '''
+        Feed one finished entry to the tracker and append its estimate
+        '''
+        if entry.status == RESULT_FOUND:
+            estimate = self.tracker.update(entry.time_stamp, (entry.x, entry.y, entry.radius))
+        elif entry.status == RESULT_MISSED:
+            estimate = self.tracker.update(entry.time_stamp, None)
+        else:
+            estimate = self.tracker.predict(entry.time_stamp)
+        # nothing to report before the first detection
+        if estimate is not None:
+            x, y, confidence = estimate
+            latency_us = entry.latency_us if entry.status in (RESULT_FOUND, RESULT_MISSED) else 0
+            done.append((x, y, entry.time_stamp, confidence, latency_us))
+
+    def warm_up(self, shape: tuple, timeout: float = 5.0) -> bool:
+        '''
+        Run every worker's detector once on a blank frame, so the first frame of a session doesn't pay for
+        the detector's first call, then reset(). Call after start().
+
+        return:         whether every worker finished within timeout seconds
+        param shape:    shape of the blank frame, e.g. packed I420 planes (height * 3 / 2, width)
+        '''
+        frame = np.zeros(shape, dtype='uint8')
+        for _ in range(self.workers):
+            self.submit(frame, 0)
+        deadline = time.monotonic() + timeout
+        while self._emit_seq < self._next_seq and time.monotonic() < deadline:
+            select.select([self.notify_fileno()], [], [], max(0.0, deadline - time.monotonic()))
+            self.clear_notifications()
+            self.results()
+        done = self._emit_seq == self._next_seq
+        self.reset()
+        return done
+
+    def reset(self):
+        '''
+        Start a new session on the running workers. Results of frames still in flight are discarded, the
+        counters restart from zero and the tracker forgets the ball. Sequence numbers keep counting, so a
+        worker finishing a frame of the previous session never writes over an entry of the new one.
+        '''
+        self._emit_seq = self._next_seq
+        self._pending_worker = None
+        self._last_point = (-1, -1)
+        self._skipped_pending = 0
+        self.ring_full = 0
+        self.table_full = 0
+        self.skipped = 0
+        self.lost = 0
+        self._stats_base = self._worker_stats()
+        if self.tracker is not None:
+            self.tracker.reset()
+        self.clear_notifications()
+
+    def notify_fileno(self) -> int:
+        '''
+        File descriptor that becomes readable when a worker finished or dropped a frame,
+        e.g. for loop.add_reader. Call clear_notifications() before collecting results()
+        '''
+        return self._notify_reader.fileno()
+
+    def clear_notifications(self):
+        '''
+        Consume the pending notifications of notify_fileno()
+        '''
+        try:
+            while os.read(self._notify_reader.fileno(), 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def pending(self) -> int:
+        '''
+        Frames submitted to the detectors whose result was not handed back yet
+        '''
+        return self._next_seq - self._emit_seq - self._skipped_pending
+
+    def _worker_stats(self) -> dict:
+        '''
+        Counters of the worker processes, summed over all workers since they started
+        '''
+        return {
+            'received': sum(stats.received for stats in self._stats),
+            'processed': sum(stats.processed for stats in self._stats),
+            'dropped': sum(stats.dropped for stats in self._stats)
+        }
+
+    def stats(self) -> dict:
+        '''
+        Frame counters summed over all workers since the last reset()
+
+        return: {received, processed, dropped, ring_full, table_full, skipped, lost}
+        '''
+        totals = self._worker_stats()
+        return {
+            **{name: count - self._stats_base[name] for name, count in totals.items()},
+            'ring_full': self.ring_full,
+            'table_full': self.table_full,
+            'skipped': self.skipped,
+            'lost': self.lost
+        }
+
+    def kill(self):
+        '''
+        Kill the detection processes without waiting for them, e.g. from a destructor
+        '''
+        for proc in self._procs:
+            proc.kill()
+
+    def shutdown(self):
+        '''
+        Kill the detection processes and free the frame rings
+        '''
+        self.kill()
+        for proc in self._procs:
+            proc.join()
+        self._procs = []
+        for ring in self._rings:
+            ring.close()
+        self._notify_reader.close()
+        self._notify_writer.close()
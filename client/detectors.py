@@ -0,0 +1,272 @@
+import cv2
+import numpy as np
+from ball_detection import detect_center, detect_center_yuv, detect_centers, detect_centers_yuv
+
+
+class Detector():
+    '''
+    Base class of ball detector backends. detect() and detect_yuv() return [x_position, y_position, radius]
+    or None, detect_all() and detect_all_yuv() an array of them for every ball in the frame. Detectors are
+    plain objects so they can be handed to detection processes.
+    '''
+    name = 'base'
+
+    def detect(self, frame: np.ndarray):
+        '''
+        Estimate the center of the ball in a BGR frame
+        '''
+        raise NotImplementedError
+
+    def detect_yuv(self, y_plane: np.ndarray, v_plane: np.ndarray):
+        '''
+        Estimate the center of the ball from the Y plane and the half resolution V plane of a yuv420p frame
+        '''
+        raise NotImplementedError
+
+    def detect_all(self, frame: np.ndarray) -> np.ndarray:
+        '''
+        Estimate the centers of every ball in a BGR frame, an array of shape (n, 3). Backends that only
+        find one ball return at most one row
+        '''
+        return _rows(self.detect(frame))
+
+    def detect_all_yuv(self, y_plane: np.ndarray, v_plane: np.ndarray) -> np.ndarray:
+        '''
+        Same as detect_all on the planes of a yuv420p frame
+        '''
+        return _rows(self.detect_yuv(y_plane, v_plane))
+
+
+def _rows(found) -> np.ndarray:
+    if found is None:
+        return np.empty((0, 3), dtype=np.float32)
+    return np.asarray(found, dtype=np.float32).reshape(1, 3)
+
+
+class HoughDetector(Detector):
+    '''
+    Hough Transformation on the gray frame, see ball_detection.detect_center
+    '''
+    name = 'hough'
+
+    def __init__(self, dp: float = 6, minDist: float = 8):
+        '''
+        param dp:       accumulator matrix scale factor
+        param minDist:  minimum distance between estimated ball centers
+        '''
+        self.dp = dp
+        self.minDist = minDist
+
+    def detect(self, frame: np.ndarray):
+        return detect_center(frame, self.dp, self.minDist)
+
+    def detect_yuv(self, y_plane: np.ndarray, v_plane: np.ndarray):
+        return detect_center_yuv(y_plane, self.dp, self.minDist)
+
+    def detect_all(self, frame: np.ndarray) -> np.ndarray:
+        return detect_centers(frame, self.dp, self.minDist)
+
+    def detect_all_yuv(self, y_plane: np.ndarray, v_plane: np.ndarray) -> np.ndarray:
+        return detect_centers_yuv(y_plane, self.dp, self.minDist)
+
+
+class ThresholdDetector(Detector):
+    '''
+    Base class of detectors working on a binary mask of the red channel, or of the V (red chroma) plane
+    for yuv420p frames. Subclasses implement centroid(mask) -> (x, y, area) in mask coordinates, and
+    centroids(mask) -> array of (x, y, area) rows if they can tell balls apart.
+    '''
+    def __init__(self, threshold: int = 127, chroma_threshold: int = 192, min_area: int = 4):
+        '''
+        param threshold:        red channel value above which a pixel belongs to the ball
+        param chroma_threshold: V plane value above which a pixel belongs to the ball
+        param min_area:         smallest pixel count accepted as a ball, in full resolution pixels
+        '''
+        self.threshold = threshold
+        self.chroma_threshold = chroma_threshold
+        self.min_area = min_area
+
+    def centroid(self, mask: np.ndarray):
+        raise NotImplementedError
+
+    def centroids(self, mask: np.ndarray) -> np.ndarray:
+        found = self.centroid(mask)
+        return np.empty((0, 3)) if found is None else np.array([found], dtype=float)
+
+    def red_mask(self, frame: np.ndarray) -> np.ndarray:
+        red = cv2.extractChannel(frame, 2)
+        _, mask = cv2.threshold(red, self.threshold, 255, cv2.THRESH_BINARY)
+        return mask
+
+    def chroma_mask(self, v_plane: np.ndarray) -> np.ndarray:
+        _, mask = cv2.threshold(v_plane, self.chroma_threshold, 255, cv2.THRESH_BINARY)
+        return mask
+
+    def detect_all(self, frame: np.ndarray) -> np.ndarray:
+        found = self.centroids(self.red_mask(frame))
+        found = found[found[:, 2] >= self.min_area]
+        return np.column_stack((found[:, :2], np.sqrt(found[:, 2] / np.pi))).astype(np.float32)
+
+    def detect_all_yuv(self, y_plane: np.ndarray, v_plane: np.ndarray) -> np.ndarray:
+        found = self.centroids(self.chroma_mask(v_plane))
+        found = found[found[:, 2] * 4 >= self.min_area]
+        return np.column_stack((found[:, :2] * 2 + 0.5, np.sqrt(found[:, 2] * 4 / np.pi))).astype(np.float32)
+
+    def detect(self, frame: np.ndarray):
+        found = self.centroid(self.red_mask(frame))
+        if found is None or found[2] < self.min_area:
+            return None
+        x, y, area = found
+        return np.array([x, y, np.sqrt(area / np.pi)])
+
+    def detect_yuv(self, y_plane: np.ndarray, v_plane: np.ndarray):
+        found = self.centroid(self.chroma_mask(v_plane))
+        # a chroma sample covers 2x2 luma pixels
+        if found is None or found[2] * 4 < self.min_area:
+            return None
+        x, y, area = found
+        return np.array([x * 2 + 0.5, y * 2 + 0.5, np.sqrt(area * 4 / np.pi)])
+
+
+class MomentsDetector(ThresholdDetector):
+    '''
+    Centroid of the thresholded red channel from image moments
+    '''
+    name = 'moments'
+
+    def centroid(self, mask: np.ndarray):
+        moments = cv2.moments(mask, binaryImage=True)
+        area = moments['m00']
+        if area == 0:
+            return None
+        return moments['m10'] / area, moments['m01'] / area, area
+
+
+class ComponentsDetector(ThresholdDetector):
+    '''
+    Centroid of the largest connected component of the thresholded red channel, or of every component
+    for detect_all. Touching balls merge into one component
+    '''
+    name = 'components'
+
+    def centroids(self, mask: np.ndarray) -> np.ndarray:
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        # label 0 is the background
+        return np.column_stack((centroids[1:], stats[1:, cv2.CC_STAT_AREA]))
+
+    def centroid(self, mask: np.ndarray):
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        if count < 2:
+            return None
+        # label 0 is the background
+        label = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        return centroids[label][0], centroids[label][1], stats[label, cv2.CC_STAT_AREA]
+
+
+class RoiDetector(Detector):
+    '''
+    Runs another detector on a window around the predicted ball center and falls back to a full frame
+    search when the ball is not found there. The window is sized from the last radius and velocity.
+    '''
+    name = 'roi'
+
+    def __init__(self, detector: Detector, margin: float = 1.5, padding: int = 4):
+        '''
+        param detector:     detector run inside the window
+        param margin:       window half size in ball radii, on top of the velocity
+        param padding:      extra pixels added to the window half size
+        '''
+        self.detector = detector
+        self.margin = margin
+        self.padding = padding
+        self.last = None
+        self.velocity = (0.0, 0.0)
+        self.roi_searches = 0
+        self.full_searches = 0
+
+    def window(self, shape: tuple) -> tuple:
+        '''
+        Search window (x0, y0, x1, y1) around the predicted center, or None without a previous center
+        '''
+        if self.last is None:
+            return None
+        x, y, radius = self.last
+        vx, vy = self.velocity
+        half_x = int(radius * self.margin + abs(vx)) + self.padding
+        half_y = int(radius * self.margin + abs(vy)) + self.padding
+        # keep the origin on even pixels so the window lines up with the chroma planes
+        x0, y0 = max(0, int(x + vx) - half_x) & ~1, max(0, int(y + vy) - half_y) & ~1
+        x1, y1 = min(shape[1], int(x + vx) + half_x + 1), min(shape[0], int(y + vy) + half_y + 1)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1, y1
+
+    def detect(self, frame: np.ndarray):
+        found = None
+        window = self.window(frame.shape)
+        if window is not None:
+            x0, y0, x1, y1 = window
+            self.roi_searches += 1
+            found = self.detector.detect(frame[y0:y1, x0:x1])
+            found = self._offset(found, x0, y0)
+        if found is None:
+            self.full_searches += 1
+            found = self.detector.detect(frame)
+        return self._update(found)
+
+    def detect_yuv(self, y_plane: np.ndarray, v_plane: np.ndarray):
+        found = None
+        window = self.window(y_plane.shape)
+        if window is not None:
+            x0, y0, x1, y1 = window
+            self.roi_searches += 1
+            found = self.detector.detect_yuv(y_plane[y0:y1, x0:x1], v_plane[y0 // 2:(y1 + 1) // 2, x0 // 2:(x1 + 1) // 2])
+            found = self._offset(found, x0, y0)
+        if found is None:
+            self.full_searches += 1
+            found = self.detector.detect_yuv(y_plane, v_plane)
+        return self._update(found)
+
+    def detect_all(self, frame: np.ndarray) -> np.ndarray:
+        # a window only ever holds one ball, every ball is searched on the whole frame
+        return self.detector.detect_all(frame)
+
+    def detect_all_yuv(self, y_plane: np.ndarray, v_plane: np.ndarray) -> np.ndarray:
+        return self.detector.detect_all_yuv(y_plane, v_plane)
+
+    def _offset(self, found, x0: int, y0: int):
+        if found is None:
+            return None
+        return np.array([found[0] + x0, found[1] + y0, found[2]])
+
+    def _update(self, found):
+        '''
+        Remember the last center and velocity for the next window
+        '''
+        if found is None:
+            self.last = None
+            self.velocity = (0.0, 0.0)
+        else:
+            if self.last is not None:
+                self.velocity = (found[0] - self.last[0], found[1] - self.last[1])
+            self.last = (float(found[0]), float(found[1]), float(found[2]))
+        return found
+
+
+DETECTORS = {detector.name: detector for detector in (HoughDetector, MomentsDetector, ComponentsDetector)}
+
+
+def make_detector(name: str = 'hough', roi: bool = False, **params) -> Detector:
+    '''
+    Build a detector backend by name
+
+    param name:     one of DETECTORS
+    param roi:      only search a window around the last known center
+    param params:   backend parameters
+    '''
+    if name not in DETECTORS:
+        raise ValueError(f"unknown detector {name}, expected one of {tuple(DETECTORS)}")
+    detector = DETECTORS[name](**params)
+    if roi:
+        detector = RoiDetector(detector)
+    return detector
@@ -0,0 +1,102 @@
+import threading
+import cv2
+from metrics import Metrics
+
+# display modes of the client
+DISPLAY_OFF = 'off'             # headless, frames are never converted to BGR
+DISPLAY_EVERY_NTH = 'every_nth' # show every n-th frame inline
+DISPLAY_THREAD = 'thread'       # show the latest frame from a background thread
+DISPLAY_MODES = (DISPLAY_OFF, DISPLAY_EVERY_NTH, DISPLAY_THREAD)
+
+
+class FrameViewer():
+    '''
+    Shows received frames without holding up the receive -> detect -> report path.
+
+    offer() takes a decoded av.VideoFrame. In thread mode it is only put into a one frame mailbox and
+    a background thread converts and shows the latest one, frames offered in between are skipped.
+    Some HighGUI backends (Cocoa on macOS) only draw from the main thread; use every_nth there.
+    '''
+    def __init__(self, mode: str = DISPLAY_THREAD, every_nth: int = 1, window: str = 'client', metrics: Metrics = None):
+        '''
+        param mode:         one of DISPLAY_MODES
+        param every_nth:    frame interval for the every_nth mode
+        param window:       HighGUI window name
+        param metrics:      stage timings, disabled if None
+        '''
+        if mode not in DISPLAY_MODES:
+            raise ValueError(f"unknown display mode {mode}, expected one of {DISPLAY_MODES}")
+        self.mode = mode
+        self.every_nth = every_nth
+        self.window = window
+        self.metrics = Metrics() if metrics is None else metrics
+        self.offered = 0
+        self.shown = 0
+        self._mailbox = None
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        '''
+        Start the viewer thread in thread mode
+        '''
+        if self.mode != DISPLAY_THREAD or self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='frame-viewer', daemon=True)
+        self._thread.start()
+
+    def offer(self, frame):
+        '''
+        Hand a decoded frame to the viewer
+
+        param frame:    av.VideoFrame in yuv420p format
+        '''
+        if self.mode == DISPLAY_OFF:
+            return
+        self.offered += 1
+        if self.mode == DISPLAY_THREAD:
+            self._mailbox = frame
+            self._wakeup.set()
+        elif (self.offered - 1) % self.every_nth == 0:
+            self.show(frame)
+
+    def show(self, frame):
+        '''
+        print frame in bgr format
+        '''
+        start = self.metrics.start()
+        bgr = cv2.cvtColor(frame.to_ndarray(), cv2.COLOR_YUV2BGR_I420)
+        self.metrics.stop('convert', start)
+        start = self.metrics.start()
+        cv2.imshow(self.window, bgr)
+        cv2.waitKey(1)
+        self.metrics.stop('display', start)
+        self.shown += 1
+
+    def _run(self):
+        try:
+            while self._running:
+                if not self._wakeup.wait(0.1):
+                    continue
+                self._wakeup.clear()
+                frame, self._mailbox = self._mailbox, None
+                if frame is not None:
+                    self.show(frame)
+        except cv2.error as e:
+            print("Display Error:", e)
+
+    def stop(self):
+        '''
+        Stop the viewer thread and close its window
+        '''
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.mode != DISPLAY_OFF:
+            try:
+                cv2.destroyWindow(self.window)
+            except cv2.error:
+                pass
@@ -0,0 +1,195 @@
+import queue
+import numpy as np
+from multiprocessing import shared_memory
+
+# ring header:  [write_seq, read_seq, dropped, reserved]
+RING_HEADER_FIELDS = 4
+# slot header:  [seq, pts, ndim, shape_0, shape_1, shape_2, tag, reserved]
+SLOT_HEADER_FIELDS = 8
+ALIGNMENT = 64
+
+
+def _aligned(nbytes: int) -> int:
+    return (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class FrameRing():
+    '''
+    Single producer / single consumer ring of fixed size frame slots in shared memory.
+
+    Frames are written straight into a slot by the producer and read in place by the consumer,
+    so nothing is pickled or copied through a manager process. Every slot carries a small header
+    with the sequence number, pts and shape of the frame stored in it.
+
+    The consumer side mimics the parts of the queue interface used by the detection process:
+    qsize() and get(). A frame returned by get() stays valid until the next get() or release().
+    '''
+    def __init__(self, slots: int = 4, max_shape: tuple = (1080, 1920, 3), dtype: str = 'uint8'):
+        '''
+        param slots:        number of frame slots in the ring
+        param max_shape:    largest frame shape a slot can hold
+        param dtype:        pixel data type
+        '''
+        self.slots = slots
+        self.max_shape = tuple(max_shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_bytes = _aligned(int(np.prod(self.max_shape)) * self.dtype.itemsize)
+        self._shm = shared_memory.SharedMemory(create=True, size=self._size())
+        self._owner = True
+        self._attach()
+        self._header[:] = 0
+        self._slot_headers[:] = 0
+
+    def _size(self) -> int:
+        header_bytes = _aligned(RING_HEADER_FIELDS * 8) + _aligned(self.slots * SLOT_HEADER_FIELDS * 8)
+        return header_bytes + self.slots * self.slot_bytes
+
+    def _attach(self):
+        '''
+        Build numpy views of the headers and slot data on top of the shared memory block
+        '''
+        buf = self._shm.buf
+        offset = 0
+        self._header = np.ndarray((RING_HEADER_FIELDS,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += _aligned(RING_HEADER_FIELDS * 8)
+        self._slot_headers = np.ndarray((self.slots, SLOT_HEADER_FIELDS), dtype=np.int64, buffer=buf, offset=offset)
+        offset += _aligned(self.slots * SLOT_HEADER_FIELDS * 8)
+        self._data_offset = offset
+        self._pending_shape = None
+        self._held = False
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'slots': self.slots, 'max_shape': self.max_shape, 'dtype': self.dtype.str}
+
+    def __setstate__(self, state):
+        '''
+        Attach to an existing ring, used when the ring is handed to a spawned process
+        '''
+        self.slots = state['slots']
+        self.max_shape = state['max_shape']
+        self.dtype = np.dtype(state['dtype'])
+        self.slot_bytes = _aligned(int(np.prod(self.max_shape)) * self.dtype.itemsize)
+        # child processes share the creator's resource tracker, so attaching does not add an owner
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = False
+        self._attach()
+
+    def _slot_view(self, index: int, shape: tuple) -> np.ndarray:
+        offset = self._data_offset + index * self.slot_bytes
+        return np.ndarray(shape, dtype=self.dtype, buffer=self._shm.buf, offset=offset)
+
+    @property
+    def dropped(self) -> int:
+        '''
+        Number of frames the producer could not write because the ring was full
+        '''
+        return int(self._header[2])
+
+    # ---- producer side ----
+
+    def fits(self, shape: tuple) -> bool:
+        '''
+        Whether a frame of this shape fits a slot
+        '''
+        return len(shape) <= 3 and int(np.prod(shape)) * self.dtype.itemsize <= self.slot_bytes
+
+    def reserve(self, shape: tuple) -> np.ndarray:
+        '''
+        Reserve the next free slot and return a writable view of it, or None if the ring is full.
+        The frame becomes visible to the consumer once commit() is called.
+
+        param shape:    shape of the frame that will be written
+        '''
+        shape = tuple(shape)
+        if not self.fits(shape):
+            raise ValueError(f"frame of shape {shape} does not fit a slot of shape {self.max_shape}")
+        write_seq, read_seq = int(self._header[0]), int(self._header[1])
+        if write_seq - read_seq >= self.slots:
+            self._header[2] += 1
+            return None
+        self._pending_shape = shape
+        return self._slot_view(write_seq % self.slots, shape)
+
+    def commit(self, pts: int, tag: int = 0):
+        '''
+        Publish the frame written into the reserved slot
+
+        param pts:  presentation timestamp of the frame
+        param tag:  caller defined value stored with the frame
+        '''
+        if self._pending_shape is None:
+            raise RuntimeError("commit() called without a reserved slot")
+        write_seq = int(self._header[0])
+        slot_header = self._slot_headers[write_seq % self.slots]
+        shape = self._pending_shape + (0,) * (3 - len(self._pending_shape))
+        slot_header[0] = write_seq
+        slot_header[1] = pts
+        slot_header[2] = len(self._pending_shape)
+        slot_header[3:6] = shape
+        slot_header[6] = tag
+        self._pending_shape = None
+        # publish only after data and slot header are written
+        self._header[0] = write_seq + 1
+
+    def put(self, frame: np.ndarray, pts: int, tag: int = 0) -> bool:
+        '''
+        Copy a frame into the ring. Returns False if the ring was full and the frame was dropped.
+        '''
+        slot = self.reserve(frame.shape)
+        if slot is None:
+            return False
+        np.copyto(slot, frame)
+        self.commit(pts, tag)
+        return True
+
+    # ---- consumer side ----
+
+    def qsize(self) -> int:
+        '''
+        Number of committed frames not yet handed to the consumer
+        '''
+        return int(self._header[0]) - int(self._header[1]) - int(self._held)
+
+    def release(self):
+        '''
+        Give the slot returned by the last get() back to the producer
+        '''
+        if self._held:
+            self._held = False
+            self._header[1] += 1
+
+    def get(self) -> tuple:
+        '''
+        Return the oldest committed frame as (frame, pts). The frame is a view into shared memory.
+
+        raise queue.Empty: if there is no frame available
+        '''
+        return self.get_tagged()[:2]
+
+    def get_tagged(self) -> tuple:
+        '''
+        Same as get() but returns (frame, pts, tag)
+        '''
+        self.release()
+        read_seq = int(self._header[1])
+        if int(self._header[0]) == read_seq:
+            raise queue.Empty
+        slot_header = self._slot_headers[read_seq % self.slots]
+        ndim = int(slot_header[2])
+        shape = tuple(int(v) for v in slot_header[3:3 + ndim])
+        self._held = True
+        return self._slot_view(read_seq % self.slots, shape), int(slot_header[1]), int(slot_header[6])
+
+    def close(self):
+        '''
+        Detach from the shared memory block and unlink it if this process created it
+        '''
+        self._header = self._slot_headers = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # a caller still holds a view of a slot; the mapping goes away with the process
+            pass
+        if self._owner:
+            self._shm.unlink()
+            self._owner = False
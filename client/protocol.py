@@ -0,0 +1,124 @@
+import json
+import struct
+import time
+import numpy as np
+
+# Binary messages on the data channel. Mirrors server/protocol.py, keep both in sync.
+# A message is a header followed by `count` fixed width little-endian records. Stream info messages
+# from the server carry a JSON object instead, their count is its length in bytes.
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('<BBH')  # version, kind, record count
+
+KIND_RESULTS = 1         # client -> server, RESULT_RECORD records
+KIND_STREAM_INFO = 2     # server -> client, JSON parameters of the video stream
+KIND_FEEDBACK = 3        # client -> server, FEEDBACK_RECORD load of the detection pipeline
+
+RESULT_RECORD = np.dtype([
+    ('pts', '<i8'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('confidence', '<f4'),
+    ('latency_us', '<u4')
+])
+
+# counters are totals since the session started
+FEEDBACK_RECORD = np.dtype([
+    ('queue_depth', '<u4'),     # frames handed to the detectors and not reported yet
+    ('latency_us', '<u4'),      # mean detection time since the previous feedback
+    ('received', '<u4'),        # frames received from the track
+    ('processed', '<u4'),       # frames detected
+    ('dropped', '<u4')          # frames skipped by the drop policy or for lack of a free slot
+])
+
+
+def encode_records(kind: int, records: np.ndarray) -> bytes:
+    '''
+    Pack records of one kind into a message
+    '''
+    return HEADER.pack(PROTOCOL_VERSION, kind, len(records)) + records.tobytes()
+
+
+# largest data channel message aiortc accepts, and the result records that fit into it
+MAX_MESSAGE_SIZE = 65536
+MAX_BATCH_RECORDS = (MAX_MESSAGE_SIZE - HEADER.size) // RESULT_RECORD.itemsize
+
+
+class ResultBatcher():
+    '''
+    Collects detection results into a preallocated record array and packs them into one message
+    once enough records are waiting or the oldest one has waited long enough. By default nothing waits,
+    results finished together still share a message.
+    '''
+    def __init__(self, max_records: int = 8, flush_interval: float = 0):
+        '''
+        param max_records:      records per message, a message is due as soon as this many are waiting
+        param flush_interval:   seconds a record may wait before a message is due, 0 sends every record
+        '''
+        if not 0 < max_records <= 0xffff:
+            raise ValueError("max_records must be between 1 and 65535")
+        self.max_records = max_records
+        self.flush_interval = flush_interval
+        self._records = np.zeros(max_records, dtype=RESULT_RECORD)
+        self._count = 0
+        self._first_time = 0.0
+        self.messages = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, pts: int, x: float, y: float, confidence: float = 1.0, latency_us: int = 0):
+        '''
+        Add a result. Callers flush before adding to a full batch, see due().
+        '''
+        if self._count == 0:
+            self._first_time = time.monotonic()
+        record = self._records[self._count]
+        record['pts'], record['x'], record['y'] = pts, x, y
+        record['confidence'], record['latency_us'] = confidence, latency_us
+        self._count += 1
+
+    def full(self) -> bool:
+        return self._count >= self.max_records
+
+    def room(self) -> int:
+        '''
+        Records that can still be added to the current batch
+        '''
+        return self.max_records - self._count
+
+    def due(self) -> bool:
+        '''
+        Whether the waiting records should be sent now
+        '''
+        return self._count > 0 and (self.full() or time.monotonic() - self._first_time >= self.flush_interval)
+
+    def wait_time(self) -> float:
+        '''
+        Seconds until the waiting records are due, None without records
+        '''
+        if self._count == 0:
+            return None
+        return max(0.0, self._first_time + self.flush_interval - time.monotonic())
+
+    def flush(self) -> bytes:
+        '''
+        Pack the waiting records into a message and start a new batch
+        '''
+        message = encode_records(KIND_RESULTS, self._records[:self._count])
+        self._count = 0
+        self.messages += 1
+        return message
+
+
+def decode_stream_info(message: bytes) -> dict:
+    '''
+    Unpack a stream info message of the server
+
+    raise ValueError:   if the message is not a stream info message of this protocol version
+    '''
+    if not isinstance(message, (bytes, bytearray)) or len(message) < HEADER.size:
+        raise ValueError("not a binary protocol message")
+    version, kind, count = HEADER.unpack_from(message)
+    if version != PROTOCOL_VERSION or kind != KIND_STREAM_INFO or len(message) != HEADER.size + count:
+        raise ValueError("not a stream info message")
+    return json.loads(bytes(message[HEADER.size:]).decode('utf8'))
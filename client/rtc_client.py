@@ -1,10 +1,37 @@
-import cv2
-import numpy as np
+import asyncio
+import itertools
+import time
 import aiortc
+import numpy as np
 from aiortc.contrib.signaling import TcpSocketSignaling, BYE
-import ctypes
-import multiprocessing as mp
-from ball_detection import POINT, detect_center_proc
+from aiortc.exceptions import InvalidStateError
+from ball_detection import DROP_LATEST, copy_i420
+from detection_pool import DetectionPool
+from detectors import Detector
+from display import DISPLAY_THREAD, FrameViewer
+from metrics import Metrics
+from protocol import FEEDBACK_RECORD, KIND_FEEDBACK, MAX_BATCH_RECORDS, ResultBatcher, decode_stream_info, \
+    encode_records
+from capture import CaptureWriter
+from tracker import BallTracker
+
+# seconds between attempts to reach the signaling server, doubling up to the max while it is down
+RECONNECT_DELAY = 0.05
+MAX_RECONNECT_DELAY = 0.5
+
+# video codecs the client can ask for, see server/encoding.py
+CODECS = ('vp8', 'h264')
+
+
+def codec_preferences(codec: str) -> list:
+    '''
+    Capabilities to pass to RTCRtpTransceiver.setCodecPreferences so only codec is negotiated,
+    retransmissions stay enabled
+    '''
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec {codec}, expected one of {CODECS}")
+    return [capability for capability in aiortc.RTCRtpReceiver.getCapabilities('video').codecs
+            if capability.mimeType.lower() in (f'video/{codec}', 'video/rtx')]
 
 
 class RTCClient():
@@ -12,32 +39,90 @@ class RTCClient():
     RTCClient receives frames from the server, determines location of the ball, and sends location back to server
     '''
 
-    def __init__(self, host: str, port: str):
+    def __init__(self, host: str, port: str, workers: int = 1, ring_slots: int = 4,
+                 max_frame_shape: tuple = (1620, 1920), drop_policy: str = DROP_LATEST, every_nth: int = 1,
+                 detector: Detector = None, display: str = DISPLAY_THREAD, display_every_nth: int = 1,
+                 batch_records: int = 8, batch_interval: float = 0, metrics: Metrics = None,
+                 capture: str = None, capture_frames: int = 3000, feedback_interval: float = 0.25,
+                 tracker: BallTracker = None, max_targets: int = 1, pool: DetectionPool = None,
+                 exit_on_failure: bool = True, started: float = None, reconnect_delay: float = RECONNECT_DELAY,
+                 max_reconnect_delay: float = MAX_RECONNECT_DELAY, codec: str = None):
         '''
-        Initialze values and start process for analyzing frames
+        Initialze values and start processes for analyzing frames
 
-        param _proc_value:  estimated ball center location 
-        param _proc_que:    queue for sending frames
-        param _proc_cond:   whether value is processed
+        param workers:          number of detection processes
+        param ring_slots:       number of frame slots shared with each detection process
+        param max_frame_shape:  largest frame the shared slots can hold, frames are stored as I420 planes
+        param drop_policy:      which frames the detectors skip when they fall behind, one of DROP_POLICIES
+        param every_nth:        frame interval for the every_nth drop policy
+        param detector:         detector backend, see detectors.make_detector. Hough Transformation if None
+        param display:          how received frames are shown, one of display.DISPLAY_MODES. 'off' runs headless
+        param display_every_nth: frame interval for the every_nth display mode
+        param batch_records:    results packed into one data channel message
+        param batch_interval:   seconds a result may wait for its batch to fill up, 0 sends results as soon as they are ready
+        param metrics:          stage timings, disabled if None
+        param capture:          file the received frames are recorded to for replay, see capture.py
+        param capture_frames:   largest number of frames recorded
+        param feedback_interval: seconds between two reports of the detection load to the server, 0 disables them
+        param tracker:          predicts the frames that are not detected, see tracker.BallTracker
+        param max_targets:      balls reported per frame, for servers streaming several balls
+        param pool:             running detection processes to reuse, see runtime.ClientRuntime. They are reset
+                                for this session and left running at shutdown. The client starts its own if None,
+                                from workers, ring_slots, max_frame_shape, drop_policy, every_nth, detector,
+                                tracker and max_targets
+        param exit_on_failure:  exit the program when the connection fails, otherwise only this session ends
+        param started:          time.monotonic() the startup times are measured from, now if None
+        param reconnect_delay:  seconds before the first retry while the signaling server can't be reached
+        param max_reconnect_delay: longest delay between two retries
+        param codec:            only accept this video codec, one of CODECS. The server's preference wins if None
+        param startup:          seconds from started until the offer arrived ('offer') and until the first
+                                frame was decoded ('first_frame')
+        param _pool:            detection processes and the shared results table
         '''
+        if pool is not None:
+            tracker, max_targets = pool.tracker, pool.max_targets
+        if max_targets > MAX_BATCH_RECORDS:
+            raise ValueError(f"the results of {max_targets} balls do not fit one message, "
+                             f"at most {MAX_BATCH_RECORDS} are supported")
+        self.metrics = Metrics() if metrics is None else metrics
         self.signal: TcpSocketSignaling = TcpSocketSignaling(host, port)
         self.pc = aiortc.RTCPeerConnection()
+        if codec is not None:
+            # the offer's video is received on this transceiver, its preferences filter the answer
+            self.pc.addTransceiver('video', direction='recvonly').setCodecPreferences(codec_preferences(codec))
         self.channel = None
         self.track = None
-        self._m = mp.Manager()
-        self._proc_que = self._m.Queue()
-        self._proc_value = mp.Value(POINT, lock=False) 
-        self._proc_cond = mp.Value(ctypes.c_int, lock=True)
-        self._proc_value.x = -1
-        self._proc_value.y = -1
-        self._proc_value.time_stamp = -1
-        self._proc_cond.value = 0
-        self._frame_proc = mp.Process(target=detect_center_proc, args=(
-            self._proc_que,
-            self._proc_value,
-            self._proc_cond
-        ))
-        self._frame_proc.start()
+        self.capture = CaptureWriter(capture, capture_frames) if capture else None
+        self.viewer = FrameViewer(display, display_every_nth, metrics=self.metrics)
+        self.tracker = tracker
+        # all balls of a frame travel in one message
+        self._batcher = ResultBatcher(max(batch_records, max_targets), batch_interval)
+        self.feedback_interval = feedback_interval
+        self._next_feedback = 0.0
+        self._feedback = np.zeros(1, dtype=FEEDBACK_RECORD)
+        self._frames = 0
+        self._latency_sum = 0
+        self._latency_count = 0
+        self._results_ready = asyncio.Event()
+        self._delivery = None
+        self.exit_on_failure = exit_on_failure
+        self.started = time.monotonic() if started is None else started
+        self.startup = {}
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.unsupported = 0
+        self._unsupported_size = None
+        self._closed = False
+        self._shut_down = False
+        if pool is None:
+            self._pool = DetectionPool(workers, ring_slots, max_frame_shape, drop_policy, every_nth,
+                                       detector=detector, tracker=tracker, max_targets=max_targets)
+            self._pool.start()
+        else:
+            self._pool = pool
+            self._pool.reset()
+        # set last, the destructor only kills the processes of a client that got as far as starting them
+        self._owns_pool = pool is None
 
     async def register_on_callbacks(self):
         '''
@@ -48,6 +133,17 @@ class RTCClient():
             #When a data channel is connected, set self.channel to this channel
             print("channel connected")
             self.channel = chan
+
+            @chan.on("message")
+            def on_message(message):
+                # the server describes its stream once, recorded so captures can be scored later
+                try:
+                    info = decode_stream_info(message)
+                except ValueError as e:
+                    print("Process Server Message Error:", e)
+                    return
+                if self.capture is not None:
+                    self.capture.set_stream_info(info)
         
         @self.pc.on("track")
         def on_track(track: aiortc.MediaStreamTrack):
@@ -57,47 +153,173 @@ class RTCClient():
 
         @self.pc.on("connectionstatechange")
         async def on_connectionstatechange():
-            # Log details about connection state. If connection fails, just exit program
+            # Log details about connection state. If connection fails, exit program or end this session
             print(f"connection state is {self.pc.connectionState}")
             if self.pc.connectionState == "failed":
+                self._closed = True
                 await self.pc.close()
-                exit(-1)
-     
-    def show_frame(self, ndarr_frame: np.ndarray):
-        '''
-        print frame in bgr format
-        '''
-        cv2.imshow('client', ndarr_frame)
-        cv2.waitKey(1)
+                if self.exit_on_failure:
+                    exit(-1)
 
     async def _run_track(self) -> bool:
         '''
         Get the next frame from the track
         '''
+        metrics = self.metrics
+        # waiting for the next frame and decoding it
+        start = metrics.start()
         try:
             frame = await self.track.recv()
         except aiortc.mediastreams.MediaStreamError as e:
             print("Run Track Error:", e)
             return False
-        
+        metrics.stop('recv', start)
+        metrics.count('frames')
+        if not self._frames:
+            self._record_startup('first_frame')
+        self._frames += 1
+        if self.feedback_interval and self.channel is not None and self.channel.readyState == 'open' \
+                and time.monotonic() >= self._next_feedback:
+            self.channel.send(self.feedback())
+            self._next_feedback = time.monotonic() + self.feedback_interval
+
+        # copy the decoded planes straight into a shared slot, detection runs on them without
+        # color conversion. If the detectors are behind or the slots can't hold the frame, drop it.
+        # Frames the tracker predicts are only queued for their estimate
+        start = metrics.start()
         time_stamp = frame.pts
-        ndarr_frame = frame.to_ndarray()
-        ndarr_frame = cv2.cvtColor(ndarr_frame, cv2.COLOR_YUV2BGR_I420)
-        self._proc_que.put((ndarr_frame, time_stamp))
-        self.show_frame(ndarr_frame)
-        
-        with self._proc_cond.get_lock():
-            if self._proc_cond.value == 1:
-                self.channel.send(f'{self._proc_value.x}\t{self._proc_value.y}\t{self._proc_value.time_stamp}')
-                self._proc_cond.value = 0
+        supported = self._supported(frame)
+        if self.tracker is not None:
+            self.tracker.bounds = (frame.width, frame.height)
+        if self.tracker is not None and not self.tracker.should_detect():
+            self._pool.skip(time_stamp)
+            # no worker reports a skipped frame, the prediction may be ready right away
+            self._results_ready.set()
+            metrics.count('predicted')
+        elif not supported:
+            if self.tracker is not None:
+                self._pool.skip(time_stamp)
+                self._results_ready.set()
+        else:
+            slot = self._pool.reserve((frame.height * 3 // 2, frame.width))
+            if slot is not None:
+                copy_i420(frame, slot)
+                self._pool.commit(time_stamp)
+            else:
+                metrics.count('dropped')
+                if self.tracker is not None:
+                    self._pool.skip(time_stamp)
+                    self._results_ready.set()
+        metrics.stop('handoff', start)
+        if self.capture is not None and supported:
+            self.capture.append(frame)
+        # the viewer converts and shows frames on its own thread unless it is set to every_nth
+        self.viewer.offer(frame)
         return True
+
+    def _supported(self, frame) -> bool:
+        '''
+        Whether a frame can be stored as packed I420 planes, which need an even size and have to fit the
+        shared slots. Frames that can't are dropped and counted as unsupported
+        '''
+        if frame.width % 2 == 0 and frame.height % 2 == 0 and self._pool.fits((frame.height * 3 // 2, frame.width)):
+            return True
+        if self._unsupported_size != (frame.width, frame.height):
+            print(f"Unsupported frame size {frame.width}x{frame.height}, these frames are not detected")
+            self._unsupported_size = (frame.width, frame.height)
+        self.unsupported += 1
+        self.metrics.count('unsupported')
+        return False
+
+    def _record_startup(self, stage: str):
+        '''
+        Record the time from started until a startup stage was reached
+        '''
+        seconds = time.monotonic() - self.started
+        self.startup[stage] = seconds
+        self.metrics.observe(stage, seconds)
+        print(f"{stage} after {seconds:.3f}s")
+
+    def _on_results_ready(self):
+        '''
+        Reader callback of the pool's notification pipe
+        '''
+        self._pool.clear_notifications()
+        self._results_ready.set()
+
+    async def _deliver_results(self):
+        '''
+        Send results as soon as the detectors finish them, independent of frame arrival.
+        Waits for a notification, or until the waiting batch is due. Results wait in the pool while
+        the channel isn't open
+        '''
+        while True:
+            try:
+                await asyncio.wait_for(self._results_ready.wait(), self._batcher.wait_time())
+            except asyncio.TimeoutError:
+                pass
+            self._results_ready.clear()
+            if self.channel is None or self.channel.readyState != 'open':
+                continue
+            try:
+                self.send_results()
+            except InvalidStateError as e:
+                print("Send Results Error:", repr(e))
+
+    def send_results(self):
+        '''
+        Batch finished results in pts order and send them once a batch is due
+        '''
+        metrics = self.metrics
+        start = metrics.start()
+        for _, frame_results in itertools.groupby(self._pool.results(), key=lambda result: result[2]):
+            # the server scores all results of a frame together, they are never split across messages
+            frame_results = list(frame_results)
+            if len(frame_results) > self._batcher.room():
+                self.channel.send(self._batcher.flush())
+            # detection ran in a worker process, it measured its own time. Predictions take none
+            latency_us = frame_results[0][4]
+            if latency_us:
+                metrics.observe('detect', latency_us * 1e-6)
+                self._latency_sum += latency_us
+                self._latency_count += 1
+            for x, y, time_stamp, confidence, latency_us in frame_results:
+                self._batcher.add(time_stamp, x, y, confidence, latency_us)
+        if self._batcher.due():
+            self.channel.send(self._batcher.flush())
+        metrics.stop('send', start)
+
+    def feedback(self) -> bytes:
+        '''
+        Feedback message with the current load of the detection pipeline, see protocol.FEEDBACK_RECORD
+        '''
+        stats = self._pool.stats()
+        record = self._feedback[0]
+        record['queue_depth'] = self._pool.pending()
+        record['latency_us'] = self._latency_sum // self._latency_count if self._latency_count else 0
+        record['received'] = self._frames
+        record['processed'] = stats['processed']
+        record['dropped'] = stats['dropped'] + stats['ring_full'] + stats['table_full'] + stats['lost']
+        self._latency_sum = self._latency_count = 0
+        return encode_records(KIND_FEEDBACK, self._feedback)
+
+    def frame_stats(self) -> dict:
+        '''
+        Frame counters of the detection pipeline
+
+        return: {received, processed, dropped, ring_full, table_full, skipped, lost, unsupported}
+        '''
+        return dict(self._pool.stats(), unsupported=self.unsupported)
     
     async def run(self):
         '''
         Run client
         '''
         await self.register_on_callbacks()
-        while await self.consume_signal():
+        self.viewer.start()
+        asyncio.get_running_loop().add_reader(self._pool.notify_fileno(), self._on_results_ready)
+        self._delivery = asyncio.ensure_future(self._deliver_results())
+        while not self._closed and await self.consume_signal():
             if self.track is not None:
                 while await self._run_track():
                     pass
@@ -106,15 +328,42 @@ class RTCClient():
     
     async def shutdown(self):
         '''
-        Shut down client, kill process
+        Shut down client, say goodbye to the server, kill detection processes and free shared frame rings
+        unless they are shared
         '''
-        self._frame_proc.kill()
+        if self._shut_down:
+            return
+        self._shut_down = True
+        self._closed = True
+        self.viewer.stop()
+        if self._delivery is not None:
+            # the delivery task only ends on its own if it failed
+            if self._delivery.done() and not self._delivery.cancelled() and self._delivery.exception() is not None:
+                print("Deliver Results Error:", repr(self._delivery.exception()))
+            self._delivery.cancel()
+            self._delivery = None
+            asyncio.get_running_loop().remove_reader(self._pool.notify_fileno())
+        if self._owns_pool:
+            self._pool.shutdown()
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+        try:
+            await self.signal.close()
+        except OSError:
+            # the server may have closed the connection already
+            pass
+        try:
+            await self.pc.close()
+        except TypeError:
+            pass
     
     def __del__(self):
         '''
-        Kill process when destructor is called
+        Kill processes when destructor is called
         '''
-        self._frame_proc.kill()
+        if getattr(self, '_owns_pool', False):
+            self._pool.kill()
 
     async def consume_signal(self) ->bool:
         '''
@@ -122,20 +371,24 @@ class RTCClient():
 
         If the data recieved through the signal is an ICE Candidate or and SDP offer/answer,
         handle that case and return True. 
-        If signal was an sdp offer, create an answer and send it
+        If signal was an sdp offer, create an answer and send it.
+        While the server can't be reached, retry with a delay that doubles up to max_reconnect_delay
         '''
         obj = None
+        delay = self.reconnect_delay
         while True:
             try:
                 obj = await self.signal.receive()
                 break
             except (FileNotFoundError, OSError):
-                pass
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
 
         if isinstance(obj, aiortc.RTCSessionDescription):
             await self.pc.setRemoteDescription(obj)
             if obj.type == "offer":
                 print("received offer")
+                self._record_startup('offer')
                 await self.pc.setLocalDescription(await self.pc.createAnswer())
                 await self.signal.send(self.pc.localDescription)
             return True
@@ -0,0 +1,78 @@
+import time
+from ball_detection import DROP_LATEST
+from detection_pool import DetectionPool
+from detectors import Detector
+from metrics import Metrics
+from rtc_client import RTCClient
+from tracker import BallTracker
+
+
+class ClientRuntime():
+    '''
+    Long lived client that serves one session after another from the same process. The detection
+    processes are started and warmed up once and every session runs an RTCClient on them, so a reconnect
+    only pays for its peer connection, not for process start, imports and the detector's first call.
+    Between sessions the client retries the signaling server with a bounded backoff, see
+    RTCClient.consume_signal.
+
+    The first session's startup times are measured from the creation of the runtime, later ones from the
+    end of the previous session.
+    '''
+    def __init__(self, host: str, port: str, sessions: int = 0, workers: int = 1, ring_slots: int = 4,
+                 max_frame_shape: tuple = (1620, 1920), drop_policy: str = DROP_LATEST, every_nth: int = 1,
+                 detector: Detector = None, tracker: BallTracker = None, max_targets: int = 1,
+                 metrics: Metrics = None, **client_args):
+        '''
+        param host:             signaling host
+        param port:             signaling port
+        param sessions:         number of sessions to run, 0 keeps reconnecting until cancelled
+        param workers:          number of detection processes
+        param ring_slots:       number of frame slots shared with each detection process
+        param max_frame_shape:  largest frame the shared slots can hold, frames are stored as I420 planes
+        param drop_policy:      which frames the detectors skip when they fall behind, one of DROP_POLICIES
+        param every_nth:        frame interval for the every_nth drop policy
+        param detector:         detector backend, see detectors.make_detector. Hough Transformation if None
+        param tracker:          predicts the frames that are not detected, see tracker.BallTracker
+        param max_targets:      balls reported per frame, for servers streaming several balls
+        param metrics:          stage timings shared by all sessions, disabled if None
+        param client_args:      further RTCClient arguments of every session
+        param startups:         RTCClient.startup of every finished session
+        '''
+        self.started = time.monotonic()
+        self.host = host
+        self.port = port
+        self.sessions = sessions
+        self.metrics = Metrics() if metrics is None else metrics
+        self.client_args = client_args
+        self.client = None
+        self.startups = []
+        self.pool = DetectionPool(workers, ring_slots, max_frame_shape, drop_policy, every_nth, detector=detector,
+                                  tracker=tracker, max_targets=max_targets)
+        self.pool.start()
+        if not self.pool.warm_up(max_frame_shape):
+            print("detection processes did not warm up in time")
+
+    async def run(self):
+        '''
+        Run sessions until `sessions` of them ended, then stop the detection processes
+        '''
+        started = self.started
+        try:
+            while not self.sessions or len(self.startups) < self.sessions:
+                self.client = RTCClient(self.host, self.port, metrics=self.metrics, pool=self.pool,
+                                        exit_on_failure=False, started=started, **self.client_args)
+                try:
+                    await self.client.run()
+                finally:
+                    await self.client.shutdown()
+                self.startups.append(self.client.startup)
+                print(f"session {len(self.startups)} ended:", self.client.frame_stats())
+                started = time.monotonic()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        '''
+        Kill the detection processes and free the shared frame rings
+        '''
+        self.pool.shutdown()
@@ -0,0 +1,170 @@
+import numpy as np
+
+# confidence reported for positions the tracker predicted instead of measured
+PREDICTED_CONFIDENCE = 0.5
+
+
+class BallTracker():
+    '''
+    Constant velocity Kalman filter on the ball center that fills in the frames detection skipped,
+    dropped or missed, so every frame gets an estimate.
+
+    Both axes are filtered independently with the state (position, velocity) and time taken from the pts.
+    Once the frame size is known the prediction bounces off the frame edges like the ball does. A ball
+    that moves in steps turns at the first position past the edge, so the turning points are widened to
+    the outermost detections, and the first detection after a predicted bounce moves its turning point
+    by half the miss. With
+    detect_every > 1 only every n-th frame is detected and the frames in between are predicted. Detection
+    runs on every frame again until the filter has seen two consecutive detections, after a miss and
+    after a detection further than max_innovation pixels from the prediction.
+
+    Detected frames report the detection itself, the filter only smooths the state the predictions
+    are made from.
+    '''
+    def __init__(self, detect_every: int = 1, max_innovation: float = 6.0, process_noise: float = 1000.0,
+                 measurement_noise: float = 1.0, clock_rate: int = 90000):
+        '''
+        param detect_every:     detect every n-th frame and predict the others while tracking
+        param max_innovation:   distance in pixels between detection and prediction that resets the filter
+        param process_noise:    acceleration noise spectral density in pixels^2 / s^3
+        param measurement_noise: variance of a detection in pixels^2
+        param clock_rate:       pts ticks per second
+        param bounds:           (width, height) of the frames, the prediction does not bounce while None
+        param predicted:        positions reported from a prediction
+        param resets:           detections rejected by the innovation gate
+        '''
+        if detect_every < 1:
+            raise ValueError("detect_every must be at least 1")
+        self.detect_every = detect_every
+        self.max_innovation = max_innovation
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.clock_rate = clock_rate
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget the ball and the frame size, e.g. before a new session
+        '''
+        self.bounds = None
+        self.predicted = 0
+        self.resets = 0
+        self._state = None                  # rows x, y of (position, velocity)
+        self._cov = None                    # per axis 2x2 covariance
+        self._time_stamp = None
+        self._radius = 0.0
+        self._turns = np.full((2, 2), np.nan)     # turning points, rows x, y of (low, high)
+        self._bounced = [None, None]                # side of the last predicted bounce per axis
+        self._confirmed = 0                 # consecutive detections since the last reset
+        self._since_detect = 0
+
+    @property
+    def tracking(self) -> bool:
+        '''
+        Whether the filter has a velocity estimate to predict from
+        '''
+        return self._confirmed >= 2
+
+    def should_detect(self) -> bool:
+        '''
+        Call once per received frame in pts order: whether it has to be detected or can be predicted
+        '''
+        if not self.tracking or self._since_detect + 1 >= self.detect_every:
+            self._since_detect = 0
+            return True
+        self._since_detect += 1
+        return False
+
+    def update(self, time_stamp: int, found) -> tuple:
+        '''
+        Fold in the detection result of a frame
+
+        return:             (x, y, confidence), or None before the first detection
+        param time_stamp:   pts of the frame, not older than the previous one
+        param found:        [x_position, y_position] or [x_position, y_position, radius], None on a miss
+        '''
+        if found is None:
+            self._confirmed = 0
+            return self.predict(time_stamp)
+        x, y = float(found[0]), float(found[1])
+        if len(found) > 2 and found[2] > 0:
+            self._radius = float(found[2])
+        self._turns[:, 0] = np.fmin(self._turns[:, 0], (x, y))
+        self._turns[:, 1] = np.fmax(self._turns[:, 1], (x, y))
+        if self._state is None:
+            self._reset(time_stamp, x, y)
+            return x, y, 1.0
+        self._advance(time_stamp)
+        innovation = np.array([x, y]) - self._state[:, 0]
+        for axis, side in enumerate(self._bounced):
+            if side is not None:
+                # a turning point off by d puts the bounced prediction off by 2d
+                self._turns[axis, side] = self._walls(axis)[side] + innovation[axis] / 2
+                self._state[axis, 0] += innovation[axis]
+                innovation[axis] = 0
+        self._bounced = [None, None]
+        if self.tracking and np.hypot(*innovation) > self.max_innovation:
+            self.resets += 1
+            self._reset(time_stamp, x, y)
+            return x, y, 1.0
+        # per axis Kalman gain, only the position is measured
+        gain = self._cov[:, :, 0] / (self._cov[:, 0, 0] + self.measurement_noise)[:, None]
+        self._state += gain * innovation[:, None]
+        self._cov -= gain[:, :, None] * self._cov[:, None, 0, :]
+        self._confirmed += 1
+        return x, y, 1.0
+
+    def predict(self, time_stamp: int) -> tuple:
+        '''
+        Estimate the position of a frame that was not detected
+
+        return:             (x, y, confidence), or None before the first detection
+        param time_stamp:   pts of the frame, not older than the previous one
+        '''
+        if self._state is None:
+            return None
+        self._advance(time_stamp)
+        self.predicted += 1
+        return float(self._state[0, 0]), float(self._state[1, 0]), PREDICTED_CONFIDENCE
+
+    def _reset(self, time_stamp: int, x: float, y: float):
+        '''
+        Restart the filter at a detection with an unknown velocity
+        '''
+        self._state = np.array([[x, 0.0], [y, 0.0]])
+        velocity_variance = 1e6     # (pixels / s)^2, anything the ball can do
+        self._cov = np.tile(np.diag([self.measurement_noise, velocity_variance]), (2, 1, 1))
+        self._time_stamp = time_stamp
+        self._confirmed = 1
+
+    def _advance(self, time_stamp: int):
+        '''
+        Move the state forward to time_stamp, bouncing off the frame edges
+        '''
+        dt = (time_stamp - self._time_stamp) / self.clock_rate
+        if dt <= 0:
+            return
+        self._time_stamp = time_stamp
+        transition = np.array([[1.0, dt], [0.0, 1.0]])
+        noise = self.process_noise * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        self._state[:, 0] += self._state[:, 1] * dt
+        self._cov = transition @ self._cov @ transition.T + noise
+        if self.bounds is None:
+            return
+        for axis in range(2):
+            low, high = self._walls(axis)
+            position = self._state[axis, 0]
+            if low < high and not low <= position <= high:
+                side = int(position > high)
+                self._bounced[axis] = side
+                self._state[axis] = (2 * (low, high)[side] - position, -self._state[axis, 1])
+                # the velocity flipped, so does its correlation with the position
+                self._cov[axis, 0, 1] *= -1
+                self._cov[axis, 1, 0] *= -1
+
+    def _walls(self, axis: int) -> tuple:
+        '''
+        return: (low, high) turning points of the ball center along an axis
+        '''
+        low, high = self._turns[axis]
+        return np.fmin(self._radius, low), np.fmax(self.bounds[axis] - self._radius, high)
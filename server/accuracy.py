@@ -0,0 +1,222 @@
+import numpy as np
+
+
+class AccuracyStats():
+    '''
+    Streaming accuracy of the client estimates.
+
+    add() buffers (truth, estimate) pairs; once batch_size pairs are buffered their Euclidean errors are
+    computed in one vectorized step and folded into the running count, mean, RMSE and max, a fixed
+    histogram for percentiles over the whole session and a ring of the most recent errors for the
+    rolling window view.
+    '''
+    def __init__(self, batch_size: int = 64, window: int = 300, resolution: float = 0.25, max_error: float = 256):
+        '''
+        param batch_size:   pairs buffered before they are scored
+        param window:       number of most recent errors in the rolling window
+        param resolution:   histogram bin width in pixels, session percentiles are accurate to this
+        param max_error:    errors above this share the last bin, their percentile is reported as the max
+        '''
+        self.batch_size = batch_size
+        self.resolution = resolution
+        self.count = 0
+        self.max = 0.0
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._bins = int(np.ceil(max_error / resolution))
+        self._histogram = np.zeros(self._bins + 1, dtype=np.int64)
+        self._window = np.zeros(window)
+        self._window_size = 0
+        self._window_next = 0
+        self._truths = np.empty((batch_size, 2))
+        self._estimates = np.empty((batch_size, 2))
+        self._buffered = 0
+
+    def add(self, truths: np.ndarray, estimates: np.ndarray):
+        '''
+        Buffer pairs of ball positions, both arrays have shape (n, 2)
+        '''
+        truths = np.asarray(truths, dtype=float).reshape(-1, 2)
+        estimates = np.asarray(estimates, dtype=float).reshape(-1, 2)
+        while len(truths):
+            n = min(len(truths), self.batch_size - self._buffered)
+            self._truths[self._buffered:self._buffered + n] = truths[:n]
+            self._estimates[self._buffered:self._buffered + n] = estimates[:n]
+            self._buffered += n
+            truths, estimates = truths[n:], estimates[n:]
+            if self._buffered == self.batch_size:
+                self.flush()
+
+    def flush(self):
+        '''
+        Score the buffered pairs, pairs without a finite error are left out
+        '''
+        if not self._buffered:
+            return
+        n, self._buffered = self._buffered, 0
+        errors = np.hypot(*(self._truths[:n] - self._estimates[:n]).T)
+        errors = errors[np.isfinite(errors)]
+        if not len(errors):
+            return
+        bins = np.minimum((errors / self.resolution).astype(np.int64), self._bins)
+        self.count += len(errors)
+        self._sum += float(errors.sum())
+        self._sum_squares += float(np.dot(errors, errors))
+        self.max = max(self.max, float(errors.max()))
+        self._histogram += np.bincount(bins, minlength=self._bins + 1)
+
+        capacity = len(self._window)
+        errors = errors[-capacity:]
+        index = (self._window_next + np.arange(len(errors))) % capacity
+        self._window[index] = errors
+        self._window_next = (self._window_next + len(errors)) % capacity
+        self._window_size = min(self._window_size + len(errors), capacity)
+
+    def percentile(self, q: float) -> float:
+        '''
+        Session percentile of the error, q in [0, 100], interpolated within its histogram bin
+        '''
+        self.flush()
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        cumulative = np.cumsum(self._histogram)
+        b = int(np.searchsorted(cumulative, rank))
+        if b >= self._bins:
+            return self.max
+        before = cumulative[b - 1] if b else 0
+        inside = (rank - before) / self._histogram[b] if self._histogram[b] else 0.0
+        return float(min((b + inside) * self.resolution, self.max))
+
+    def window(self) -> dict:
+        '''
+        Exact statistics of the most recent errors
+        '''
+        self.flush()
+        if not self._window_size:
+            return {'count': 0}
+        errors = self._window[:self._window_size]
+        return {
+            'count': self._window_size,
+            'mean': float(errors.mean()),
+            'rmse': float(np.sqrt(np.mean(errors ** 2))),
+            'max': float(errors.max()),
+            'p50': float(np.percentile(errors, 50)),
+            'p95': float(np.percentile(errors, 95)),
+        }
+
+    def summary(self) -> dict:
+        '''
+        Statistics of the whole session and of the rolling window
+        '''
+        self.flush()
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self._sum / self.count,
+            'rmse': float(np.sqrt(self._sum_squares / self.count)),
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'window': self.window(),
+        }
+
+
+def assign_targets(truths: np.ndarray, estimates: np.ndarray, gate: float, chunk: int = 256) -> tuple:
+    '''
+    Match estimates to balls: an estimate and a ball are paired when each is the other's nearest and
+    they are less than gate pixels apart. Distances are computed in chunks of estimates, so memory stays
+    bounded for thousands of balls.
+
+    return:         (ball indices, estimate indices, distances) of the pairs
+    param truths:   (n, 2) ball positions, the index is the ball id
+    param estimates: (k, 2) estimated positions
+    param gate:     largest distance of a pair
+    '''
+    truths = np.asarray(truths, dtype=float).reshape(-1, 2)
+    estimates = np.asarray(estimates, dtype=float).reshape(-1, 2)
+    empty = np.empty(0, dtype=np.int64)
+    if not len(truths) or not len(estimates):
+        return empty, empty, np.empty(0)
+    nearest_truth = np.empty(len(estimates), dtype=np.int64)
+    nearest_distance = np.empty(len(estimates))
+    truth_best = np.full(len(truths), np.inf)
+    truth_nearest = np.full(len(truths), -1, dtype=np.int64)
+    for start in range(0, len(estimates), chunk):
+        block = estimates[start:start + chunk]
+        distances = np.hypot(block[:, None, 0] - truths[None, :, 0], block[:, None, 1] - truths[None, :, 1])
+        rows = np.arange(len(block))
+        nearest_truth[start:start + len(block)] = columns = distances.argmin(axis=1)
+        nearest_distance[start:start + len(block)] = distances[rows, columns]
+        best = distances.argmin(axis=0)
+        better = distances[best, np.arange(len(truths))] < truth_best
+        truth_best[better] = distances[best[better], np.flatnonzero(better)]
+        truth_nearest[better] = best[better] + start
+    estimate_index = np.flatnonzero((truth_nearest[nearest_truth] == np.arange(len(estimates)))
+                                    & (nearest_distance < gate))
+    return nearest_truth[estimate_index], estimate_index, nearest_distance[estimate_index]
+
+
+class TargetStats():
+    '''
+    Accuracy of multi ball streams. Every reported frame's estimates are assigned to ball ids with
+    assign_targets; the errors of the pairs go to an AccuracyStats and to per ball sums. Balls without
+    an estimate count as missed, estimates without a ball as false positives.
+    '''
+    def __init__(self, count: int, gate: float, accuracy: AccuracyStats = None):
+        '''
+        param count:        number of balls
+        param gate:         largest distance between a ball and its estimate, in pixels
+        param accuracy:     statistics of the paired errors, a new AccuracyStats if None
+        '''
+        self.count = count
+        self.gate = gate
+        self.accuracy = AccuracyStats() if accuracy is None else accuracy
+        self.frames = 0
+        self.missed = 0
+        self.false_positives = 0
+        self._matched = np.zeros(count, dtype=np.int64)
+        self._error_sum = np.zeros(count)
+
+    def add(self, truths: np.ndarray, estimates: np.ndarray):
+        '''
+        Score the estimates of one frame
+
+        param truths:       (count, 2) ball positions of the frame
+        param estimates:    (k, 2) estimated positions
+        '''
+        balls, paired, errors = assign_targets(truths, estimates, self.gate)
+        self.frames += 1
+        self.missed += self.count - len(balls)
+        self.false_positives += len(estimates) - len(paired)
+        self._matched[balls] += 1
+        self._error_sum[balls] += errors
+        self.accuracy.add(np.asarray(truths)[balls], np.asarray(estimates)[paired])
+
+    def ball_errors(self) -> np.ndarray:
+        '''
+        Mean error of every ball, nan for balls that were never matched
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self._error_sum / self._matched
+
+    def summary(self, worst: int = 5) -> dict:
+        '''
+        Detection counters, the spread of the per ball mean errors and the worst balls by mean error
+        '''
+        matched = int(self._matched.sum())
+        errors = self.ball_errors()
+        seen = np.flatnonzero(self._matched)
+        worst_ids = seen[np.argsort(errors[seen])[::-1][:worst]]
+        return {
+            'frames': self.frames,
+            'matched': matched,
+            'missed': self.missed,
+            'false_positives': self.false_positives,
+            'recall': matched / (self.frames * self.count) if self.frames else None,
+            'ball_mean_p50': float(np.median(errors[seen])) if len(seen) else None,
+            'ball_mean_max': float(errors[seen].max()) if len(seen) else None,
+            'worst_balls': {int(i): float(errors[i]) for i in worst_ids},
+        }
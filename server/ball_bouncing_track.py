@@ -1,39 +1,180 @@
+import asyncio
+import collections
+import time
 import aiortc
+from aiortc.mediastreams import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE, MediaStreamError
+from encoding import FrameEncoder
 from frame import Frame
+from ground_truth import GroundTruthRing
+from metrics import Metrics
+from world import BallWorld
 import av
 
+# ball positions kept in the ground truth of a multi ball stream, bounds the memory of large worlds
+MULTI_BALL_GROUND_TRUTH = 2 ** 20
+
 
 class BallBouncingTrack(aiortc.VideoStreamTrack):
     '''
     Ball Bouncing Video Stream Track
     '''
-    def __init__(self, velocity: int, radius: int, width: int, height: int, ball_location_dict: dict = {}):
+    def __init__(self, velocity: int, radius: int, width: int, height: int, ground_truth_capacity: int = 4096,
+                 metrics: Metrics = None, fps: float = 30, paced: bool = True, balls: int = 1,
+                 collisions: bool = False, encoder: FrameEncoder = None):
         '''
-        param velocity:             ball moving velocity in both x and y axis
-        param radius:               ball radius
-        param width:                frame width
-        param height:               frame height
-        param frame_generator:      generator of ball bouncing video frames
-        param ball_location_dict:   dictionary to store ball locations {timestamp: (x_position, y_position)}
+        param velocity:                 ball moving velocity in both x and y axis
+        param radius:                   ball radius
+        param width:                    frame width
+        param height:                   frame height
+        param ground_truth_capacity:    number of frames whose ball location is kept for scoring
+        param metrics:                  stage timings, disabled if None
+        param fps:                      frame rate, pts advance by VIDEO_CLOCK_RATE / fps per frame
+        param paced:                    hold frames back until they are due, False hands out frames as fast as
+                                        the consumer pulls them while pts still follow the fps clock
+        param balls:                    number of balls, more than one are simulated by a world.BallWorld
+        param collisions:               let the balls of a multi ball stream bounce off each other
+        param encoder:                  encodes the frames with fixed settings, recv() returns its packets and
+                                        the sender only packetizes them. The sender's encoder runs if None
+        param frame_interval:           send every frame_interval-th frame only; the ball and the pts keep
+                                        moving with the skipped ones, which are never rendered
+        param frame_generator:          generator of ball bouncing video frames
+        param ground_truth:             ball locations of the recent frames, indexed by pts
+        param frames:                   number of frames generated
         '''
         super().__init__()
         self.velocity = velocity
         self.radius = radius
         self.width = width
         self.height = height
-        self.frame_generator = Frame(velocity, radius, width, height)
-        self.ball_location_dict = ball_location_dict
+        self.balls = balls
+        self.collisions = collisions
+        self.encoder = encoder
+        self._packets = collections.deque()
+        if balls == 1:
+            self.frame_generator = Frame(velocity, radius, width, height)
+            self.ground_truth_capacity = ground_truth_capacity
+        else:
+            self.frame_generator = BallWorld(balls, radius, width, height, velocity, collisions)
+            self.ground_truth_capacity = max(16, min(ground_truth_capacity, MULTI_BALL_GROUND_TRUTH // balls))
+        self.frames = 0
+        self.metrics = Metrics() if metrics is None else metrics
+        self.fps = fps
+        self.paced = paced
+        self.pts_step = round(VIDEO_CLOCK_RATE / fps)
+        self.frame_interval = 1
+        self._next_step = 0
+        self._next_pts = None
+        self._start_time = None
+        self._ground_truths = []
+        # frame k has pts k * pts_step, its ball position is computed from k when a report comes in
+        self.ground_truth = self.new_ground_truth()
+
+    def new_ground_truth(self) -> GroundTruthRing:
+        '''
+        Ground truth store fed with every frame this track generates from now on, used to score each
+        client of a shared track separately
+        '''
+        if self.balls == 1:
+            ground_truth = GroundTruthRing(self.pts_step, self.ground_truth_capacity,
+                                           self.frame_generator.positions_at)
+        else:
+            # ball positions of a world can't be computed from the frame index, every frame stores them
+            ground_truth = GroundTruthRing(self.pts_step, self.ground_truth_capacity, targets=self.balls)
+        self._ground_truths = self._ground_truths + [ground_truth]
+        return ground_truth
+
+    def release_ground_truth(self, ground_truth: GroundTruthRing):
+        '''
+        Stop feeding a ground truth store returned by new_ground_truth
+        '''
+        self._ground_truths = [g for g in self._ground_truths if g is not ground_truth]
+
+    async def next_timestamp(self) -> tuple:
+        '''
+        pts and time base of the next frame, waiting until it is due when paced
+        '''
+        if self.readyState != 'live':
+            raise MediaStreamError
+        if self._next_pts is None:
+            self._start_time = time.time()
+            self._next_pts = 0
+        else:
+            self._next_pts += self.pts_step * self.frame_interval
+            if self.paced:
+                wait = self._start_time + self._next_pts / VIDEO_CLOCK_RATE - time.time()
+                await asyncio.sleep(max(0.0, wait))
+            else:
+                # let the rest of the event loop run between frames
+                await asyncio.sleep(0)
+        return self._next_pts, VIDEO_TIME_BASE
 
     async def recv(self):
         '''
-        Generate and return the next frame in the stream
+        Generate and return the next frame in the stream, or the next packet with an encoder
+        '''
+        if self.encoder is None:
+            return await self.next_frame()
+        while not self._packets:
+            frame = await self.next_frame()
+            start = self.metrics.start()
+            # encoding takes milliseconds, like the sender's encoder it runs off the event loop
+            packets = await asyncio.get_running_loop().run_in_executor(None, self.encoder.encode, frame)
+            self.metrics.stop('encode', start)
+            self._packets.extend(packets)
+        return self._packets.popleft()
+
+    async def next_frame(self) -> av.VideoFrame:
+        '''
+        Generate the next frame in the stream
         '''
         pts, time_base = await self.next_timestamp()
+        metrics = self.metrics
+        start = metrics.start()
+        # the ball is where it would be had every skipped frame been generated
+        step = pts // self.pts_step
+        if step != self._next_step:
+            self.frame_generator.seek(step)
         frame = self.frame_generator.get_frame()
+        centers = None if self.balls == 1 else self.frame_generator.centers()
+        for ground_truth in self._ground_truths:
+            ground_truth.insert(pts, centers)
         self.frame_generator.ball_move()
-        self.ball_location_dict[pts] = (self.frame_generator.x_position, self.frame_generator.y_position)
+        self._next_step = step + 1
+        self.frames += 1
+        metrics.stop('generate', start)
+        start = metrics.start()
         frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+        metrics.stop('from_ndarray', start)
+        metrics.count('frames')
         frame.pts = pts
         frame.time_base = time_base
         return frame
-    
\ No newline at end of file
+    
+
+class RelayedTrack(aiortc.MediaStreamTrack):
+    '''
+    One client's view of a shared BallBouncingTrack. The client counts pts from the first frame it
+    receives, so that frame's pts becomes the offset of the client's ground truth.
+    '''
+    kind = 'video'
+
+    def __init__(self, track: aiortc.MediaStreamTrack, ground_truth: GroundTruthRing):
+        '''
+        param track:        relayed subscription of the shared track, see MediaRelay.subscribe
+        param ground_truth: ground truth store of this client, see BallBouncingTrack.new_ground_truth
+        '''
+        super().__init__()
+        self.track = track
+        self.ground_truth = ground_truth
+        self._first = True
+
+    async def recv(self):
+        frame = await self.track.recv()
+        if self._first:
+            self.ground_truth.pts_offset = frame.pts
+            self._first = False
+        return frame
+
+    def stop(self):
+        super().stop()
+        self.track.stop()
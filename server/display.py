@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Tuple
+import cv2
+import numpy as np
+
+
+class OverlayDisplay():
+    '''
+    Shows the overlay of the server side ball (green) and the ball estimated by the client (red)
+    on its own thread, so HighGUI never blocks the event loop.
+
+    update() only stores the latest pair of locations in a mailbox; the thread redraws at most
+    max_fps times per second into reused buffers. Locations arriving in between are skipped.
+    Some HighGUI backends (Cocoa on macOS) only draw from the main thread; run headless there.
+    '''
+    def __init__(self, width: int, height: int, radius: int, max_fps: float = 30, headless: bool = False,
+                 window: str = 'server'):
+        '''
+        param width:        frame width
+        param height:       frame height
+        param radius:       ball radius
+        param max_fps:      highest redraw rate
+        param headless:     skip all drawing and don't start a thread
+        param window:       HighGUI window name
+        '''
+        self.radius = radius
+        self.max_fps = max_fps
+        self.headless = headless
+        self.window = window
+        self.frames = 0
+        self._green = np.zeros((height, width), dtype='uint8')
+        self._red = np.zeros((height, width), dtype='uint8')
+        self._blue = np.zeros((height, width), dtype='uint8')
+        self._frame = np.zeros((height, width, 3), dtype='uint8')
+        self._mailbox = None
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        '''
+        Start the display thread
+        '''
+        if self.headless or self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='overlay-display', daemon=True)
+        self._thread.start()
+
+    def update(self, server_loc: Tuple[int, int], client_estimated_loc: Tuple[int, int]):
+        '''
+        Hand the latest locations to the display thread, never blocks
+        '''
+        if self.headless:
+            return
+        self._mailbox = (server_loc, client_estimated_loc)
+        self._wakeup.set()
+
+    def render(self, server_loc: Tuple[int, int], client_estimated_loc: Tuple[int, int]) -> np.ndarray:
+        '''
+        Draw the overlay into the reused frame, same colors as blending the two balls at half weight
+        '''
+        self._green[:] = 0
+        self._red[:] = 0
+        cv2.circle(self._green, server_loc, radius=self.radius, color=128, thickness=-1)
+        cv2.circle(self._red, client_estimated_loc, radius=self.radius, color=128, thickness=-1)
+        return cv2.merge((self._blue, self._green, self._red), dst=self._frame)
+
+    def _run(self):
+        interval = 1 / self.max_fps if self.max_fps else 0
+        next_time = 0.0
+        try:
+            while self._running:
+                if not self._wakeup.wait(0.1):
+                    continue
+                time.sleep(max(0.0, next_time - time.monotonic()))
+                self._wakeup.clear()
+                server_loc, client_estimated_loc = self._mailbox
+                cv2.imshow(self.window, self.render(server_loc, client_estimated_loc))
+                cv2.waitKey(1)
+                self.frames += 1
+                next_time = time.monotonic() + interval
+        except cv2.error as e:
+            print("Display Error:", e)
+
+    def stop(self):
+        '''
+        Stop the display thread and close its window
+        '''
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            try:
+                cv2.destroyWindow(self.window)
+            except cv2.error:
+                pass
@@ -0,0 +1,143 @@
+from fractions import Fraction
+import av
+from aiortc import RTCRtpSender
+from aiortc.codecs import h264, vpx
+from aiortc.mediastreams import VIDEO_TIME_BASE
+
+# codec name -> (PyAV encoder, PyAV decoder), names are the subtypes of the RTP mime types
+CODECS = {'vp8': ('libvpx', 'libvpx'), 'h264': ('libx264', 'h264')}
+
+# bitrate aiortc's encoders start with before the receiver's estimates come in
+DEFAULT_BITRATES = {'vp8': vpx.DEFAULT_BITRATE, 'h264': h264.DEFAULT_BITRATE}
+
+# encoder options aiortc uses, a profile's options are applied on top
+DEFAULT_OPTIONS = {
+    'vp8': {'cpu-used': '-6', 'deadline': 'realtime', 'lag-in-frames': '0', 'noise-sensitivity': '4',
+            'static-thresh': '1', 'partitions': '0', 'overshoot-pct': '15', 'undershoot-pct': '100'},
+    'h264': {'level': '31', 'tune': 'zerolatency'},
+}
+
+# Encoder profiles of the outgoing video track:
+#   codec               preferred codec, the offer only lists this one. Negotiated by aiortc if None
+#   bitrate             bits per second. The track encodes with these fixed settings and hands the sender
+#                       packets. aiortc's encoder runs if None, its bitrate follows the receiver's estimates
+#   keyframe_interval   frames between two keyframes, with bitrate
+#   options             encoder options, with bitrate
+PROFILES = {
+    'default': {'codec': None},
+    'vp8': {'codec': 'vp8'},
+    'h264': {'codec': 'h264'},
+    'vp8-fast': {'codec': 'vp8', 'bitrate': 500000, 'keyframe_interval': 60, 'options': {'cpu-used': '16'}},
+    'vp8-low': {'codec': 'vp8', 'bitrate': 150000, 'keyframe_interval': 60, 'options': {'cpu-used': '16'}},
+    'h264-fast': {'codec': 'h264', 'bitrate': 1000000, 'keyframe_interval': 60,
+                  'options': {'preset': 'ultrafast'}},
+    'h264-low': {'codec': 'h264', 'bitrate': 300000, 'keyframe_interval': 60, 'options': {'preset': 'ultrafast'}},
+}
+
+
+def make_profile(name: str = 'default', **overrides) -> dict:
+    '''
+    Encoder profile by name with some of its settings replaced
+
+    param name:         one of PROFILES
+    param overrides:    codec, bitrate, keyframe_interval or options, None keeps the profile's value
+    '''
+    if name not in PROFILES:
+        raise ValueError(f"unknown encoder profile {name}, expected one of {tuple(PROFILES)}")
+    profile = dict(PROFILES[name], **{key: value for key, value in overrides.items() if value is not None})
+    if profile.get('codec') not in (None, *CODECS):
+        raise ValueError(f"unknown codec {profile['codec']}, expected one of {tuple(CODECS)}")
+    if profile.get('bitrate') is not None and profile.get('codec') is None:
+        raise ValueError("an encoder bitrate needs a codec")
+    return profile
+
+
+def codec_preferences(codec: str) -> list:
+    '''
+    Capabilities to pass to RTCRtpTransceiver.setCodecPreferences so only codec is negotiated,
+    retransmissions stay enabled
+    '''
+    return [capability for capability in RTCRtpSender.getCapabilities('video').codecs
+            if capability.mimeType.lower() in (f'video/{codec}', 'video/rtx')]
+
+
+class FrameEncoder():
+    '''
+    Encodes video frames with fixed settings. aiortc's encoders only let the receiver's estimates set
+    their bitrate, but its sender passes av.Packet through as they are, so a track that encodes its own
+    frames controls codec, bitrate, keyframes and encoder options.
+
+    The sender's keyframe requests don't reach this encoder, a receiver that lost packets waits for the
+    next regular keyframe.
+    '''
+    def __init__(self, codec: str = 'vp8', bitrate: int = None, keyframe_interval: int = 3000, options: dict = None,
+                 fps: float = 30):
+        '''
+        param codec:            one of CODECS
+        param bitrate:          bits per second, the bitrate aiortc's encoder starts with if None
+        param keyframe_interval: frames between two keyframes
+        param options:          encoder options on top of the ones aiortc uses
+        param fps:              frame rate the rate control plans for
+        param frames:           frames encoded
+        param bytes:            size of all packets
+        '''
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec}, expected one of {tuple(CODECS)}")
+        self.codec = codec
+        self.bitrate = DEFAULT_BITRATES[codec] if bitrate is None else bitrate
+        self.keyframe_interval = keyframe_interval
+        self.options = dict(DEFAULT_OPTIONS[codec], **(options or {}))
+        self.fps = fps
+        self.frames = 0
+        self.bytes = 0
+        self._context = None
+
+    @classmethod
+    def from_profile(cls, profile: dict, fps: float = 30):
+        '''
+        Encoder of a profile with fixed settings, None if the profile leaves encoding to aiortc
+        '''
+        if profile.get('bitrate') is None:
+            return None
+        return cls(profile['codec'], profile['bitrate'], profile.get('keyframe_interval', 3000),
+                   profile.get('options'), fps)
+
+    def _open(self, width: int, height: int):
+        context = av.CodecContext.create(CODECS[self.codec][0], 'w')
+        context.width = width
+        context.height = height
+        context.pix_fmt = 'yuv420p'
+        context.time_base = VIDEO_TIME_BASE
+        context.framerate = Fraction(self.fps).limit_denominator(1000)
+        context.bit_rate = self.bitrate
+        context.gop_size = self.keyframe_interval
+        options = dict(self.options)
+        if self.codec == 'vp8':
+            # constant bitrate with a one second buffer, like aiortc
+            options.update(bufsize=str(self.bitrate), minrate=str(self.bitrate), maxrate=str(self.bitrate))
+        else:
+            # the only profile every H.264 decoder in the negotiation supports
+            context.profile = 'Baseline'
+        context.options = options
+        return context
+
+    def encode(self, frame: av.VideoFrame) -> list:
+        '''
+        Encode a frame with pts in VIDEO_TIME_BASE
+
+        return: av.Packet list, one packet per frame with the realtime options
+        '''
+        if frame.format.name != 'yuv420p':
+            frame = frame.reformat(format='yuv420p')
+        if self._context is None or (frame.width, frame.height) != (self._context.width, self._context.height):
+            self._context = self._open(frame.width, frame.height)
+        packets = self._context.encode(frame)
+        self.frames += 1
+        self.bytes += sum(packet.size for packet in packets)
+        return packets
+
+    def kbps(self) -> float:
+        '''
+        Mean bitrate of the packets so far
+        '''
+        return self.bytes * 8 * self.fps / self.frames / 1000 if self.frames else 0.0
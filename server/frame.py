@@ -2,15 +2,51 @@ import cv2 as cv
 import numpy as np
 
 
+def bounce_position(steps, start: int, velocity: int, low: int, high: int) -> tuple:
+    '''
+    Closed form of Frame.ball_move along one axis: position and velocity after a number of moves.
+
+    ball_move reverses the velocity once the position is already outside [low, high], so the ball
+    turns at the first position past each bound in its residue class modulo the speed and follows
+    a triangle wave between those two turning points.
+
+    return:         (positions, velocities), arrays shaped like steps
+    param steps:    number of moves, int or array of ints
+    param start:    position before the first move, within [low, high]
+    param velocity: velocity before the first move
+    param low:      smallest position without a bounce
+    param high:     largest position without a bounce
+    '''
+    steps = np.asarray(steps, dtype=np.int64)
+    speed = abs(velocity)
+    if high < low or not low <= start <= high:
+        raise ValueError(f"start {start} must lie within [{low}, {high}]")
+    if speed == 0:
+        return np.full(steps.shape, start, dtype=np.int64), np.zeros(steps.shape, dtype=np.int64)
+
+    bottom = start - ((start - low) // speed + 1) * speed     # last position below low
+    top = start + ((high - start) // speed + 1) * speed       # first position above high
+    half = (top - bottom) // speed
+    phase = (start - bottom) // speed if velocity > 0 else half + (top - start) // speed
+    s = (steps + phase) % (2 * half)
+    positions = np.where(s <= half, bottom + s * speed, top - (s - half) * speed)
+    # the move onto the bottom turning point was still a falling one
+    rising = (s > 0) & (s <= half)
+    return positions, np.where(rising, speed, -speed)
+
+
 class Frame():
     '''
     Generate frames of ball bouncing across the screen
     '''
-    def __init__(self, velocity: int = 5, radius: int = 40, width = 640, height = 480):
+    def __init__(self, velocity: int = 5, radius: int = 40, width = 640, height = 480, buffers: int = 3,
+                 cache_size: int = 0):
         '''
         param radius:       ball radius
         param width:        frame width
         param height:       frame height
+        param buffers:      number of reused output frames, a returned frame is redrawn `buffers` frames later
+        param cache_size:   number of full frames cached by ball position, 0 disables the cache
         param x_position:   position of ball on x-axis
         param y_position:   position of ball on y-axis
         param x_velocity:   velocity of ball on x-axis
@@ -23,15 +59,56 @@ class Frame():
         self.y_position = radius
         self.x_velocity = velocity
         self.y_velocity = velocity             
+        self.cache_size = cache_size
+        self._start = (self.x_position, self.y_position, self.x_velocity, self.y_velocity)
+
+        # ball drawn once on a black square, blitted into the output frames
+        self._sprite = np.zeros((2 * radius + 1, 2 * radius + 1, 3), dtype='uint8')
+        cv.circle(self._sprite, (radius, radius), radius = radius, thickness = -1, color = (0, 0, 255))
+        self._buffers = [np.zeros((height, width, 3), dtype='uint8') for _ in range(buffers)] # bgr representation
+        self._boxes = [None] * buffers
+        self._next_buffer = 0
+        self._cache = {}
     
     def get_frame(self):
         '''
-        Generate the next frame
+        Generate the next frame. Only the area of the ball drawn previously into the reused buffer is
+        cleared and the ball sprite is copied to the current position, so the cost does not depend on the
+        frame size. The returned frame must not be modified; with the cache enabled it is shared.
         '''
-        # draw frame with ball in current position and add ball position to location queue
-        frame = np.zeros((self.height, self.width, 3), dtype='uint8') # image will be in bgr representation
-        cv.circle(frame, (self.x_position, self.y_position), radius = self.radius, thickness = -1, color = (0, 0, 255)) 
+        position = (self.x_position, self.y_position)
+        if self.cache_size:
+            frame = self._cache.get(position)
+            if frame is not None:
+                return frame
+
+        index = self._next_buffer
+        self._next_buffer = (index + 1) % len(self._buffers)
+        frame = self._buffers[index]
+        if self._boxes[index] is not None:
+            frame[self._boxes[index]] = 0
+        self._boxes[index] = self._blit(frame)
+
+        if self.cache_size and len(self._cache) < self.cache_size:
+            cached = frame.copy()
+            cached.flags.writeable = False
+            self._cache[position] = cached
         return frame
+
+    def _blit(self, frame: np.ndarray) -> tuple:
+        '''
+        Copy the ball sprite centered at the current position, clipped to the frame
+
+        return: slices of the area written, or None if the ball is outside the frame
+        '''
+        size = 2 * self.radius + 1
+        x0, y0 = self.x_position - self.radius, self.y_position - self.radius
+        fx0, fy0 = max(0, x0), max(0, y0)
+        fx1, fy1 = min(self.width, x0 + size), min(self.height, y0 + size)
+        if fx1 <= fx0 or fy1 <= fy0:
+            return None
+        frame[fy0:fy1, fx0:fx1] = self._sprite[fy0 - y0:fy1 - y0, fx0 - x0:fx1 - x0]
+        return (slice(fy0, fy1), slice(fx0, fx1))
     
     def ball_move(self):
         '''
@@ -46,3 +123,32 @@ class Frame():
         # modify position
         self.x_position += self.x_velocity
         self.y_position += self.y_velocity
+
+    def seek(self, step: int):
+        '''
+        Move the ball to its state after `step` ball_move calls from the initial state, so frames can be
+        generated starting anywhere in the sequence
+        '''
+        x, y, x_velocity, y_velocity = self._start
+        xs, x_velocities = bounce_position(step, x, x_velocity, self.radius, self.width - self.radius)
+        ys, y_velocities = bounce_position(step, y, y_velocity, self.radius, self.height - self.radius)
+        self.x_position, self.y_position = int(xs), int(ys)
+        self.x_velocity, self.y_velocity = int(x_velocities), int(y_velocities)
+
+    def positions_at(self, steps) -> np.ndarray:
+        '''
+        Ball positions after a number of ball_move calls from the initial state, computed in closed form
+
+        return:         array of shape steps.shape + (2,) with [x_position, y_position]
+        param steps:    number of moves, int or array of ints
+        '''
+        x, y, x_velocity, y_velocity = self._start
+        xs, _ = bounce_position(steps, x, x_velocity, self.radius, self.width - self.radius)
+        ys, _ = bounce_position(steps, y, y_velocity, self.radius, self.height - self.radius)
+        return np.stack((xs, ys), axis=-1)
+
+    def position_at(self, step: int) -> tuple:
+        '''
+        Ball position after `step` ball_move calls from the initial state
+        '''
+        return tuple(self.positions_at(step).tolist())
@@ -0,0 +1,90 @@
+import numpy as np
+
+
+class GroundTruthRing():
+    '''
+    Fixed capacity store of ball positions indexed by pts.
+
+    pts advances in fixed steps, so frame k lives in slot k % capacity and inserts and lookups are O(1).
+    Inserting frame k evicts frame k - capacity. Reports are matched to the nearest step, which absorbs
+    the off-by-one rounding of pts after the RTP round trip. Given a trajectory, positions are computed
+    from the frame index instead of being stored. pts_offset is added to reported pts, for clients whose
+    first received frame was not the first generated one. With targets > 1 every frame stores the
+    positions of that many balls.
+
+    Counters:
+        reported:   reports matched to a stored frame
+        missing:    frames evicted without ever being reported
+        late:       reports for frames already evicted
+        duplicate:  reports for frames that were already reported
+        unknown:    reports for frames that were never generated
+    '''
+    def __init__(self, pts_step: int, capacity: int = 4096, trajectory = None, targets: int = 1):
+        '''
+        param pts_step:     pts increment between two frames
+        param capacity:     number of frames kept
+        param trajectory:   optional function mapping an array of frame indices to positions, see Frame.positions_at
+        param targets:      balls per frame, positions of a frame have shape (targets, 2) if more than one
+        '''
+        self.pts_step = pts_step
+        self.capacity = capacity
+        self.trajectory = trajectory
+        self.pts_offset = 0
+        self._keys = np.full(capacity, -1, dtype=np.int64)
+        self.targets = targets
+        shape = (capacity, 2) if targets == 1 else (capacity, targets, 2)
+        self._positions = np.zeros(shape, dtype=np.int32) if trajectory is None else None
+        self._reported = np.zeros(capacity, dtype=bool)
+        self.counters = dict.fromkeys(('reported', 'missing', 'late', 'duplicate', 'unknown'), 0)
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._keys >= 0))
+
+    def insert(self, pts: int, position: tuple = None):
+        '''
+        Store the ball position of the frame with this pts, evicting the frame one capacity older.
+        The position is ignored when positions come from the trajectory. With several targets,
+        position is an array of shape (targets, 2).
+        '''
+        key = round(pts / self.pts_step)
+        slot = key % self.capacity
+        if self._keys[slot] >= 0 and not self._reported[slot]:
+            self.counters['missing'] += 1
+        self._keys[slot] = key
+        if self.trajectory is None:
+            self._positions[slot] = position
+        self._reported[slot] = False
+
+    def lookup(self, pts: int) -> tuple:
+        '''
+        Ball position of a reported frame, or None if the report can't be scored
+        '''
+        positions, found = self.lookup_many(np.array([pts]))
+        return tuple(positions[0].tolist()) if found[0] else None
+
+    def lookup_many(self, pts: np.ndarray) -> tuple:
+        '''
+        Ball positions for a batch of reported pts
+
+        return: (positions, found) where positions[i] is only valid if found[i]
+        '''
+        keys = np.rint((np.asarray(pts) + self.pts_offset) / self.pts_step).astype(np.int64)
+        slots = keys % self.capacity
+        stored = self._keys[slots]
+        hit = stored == keys
+        duplicate = hit & self._reported[slots]
+        found = hit & ~duplicate
+        # a frame reported twice within one batch only counts the first time
+        _, first = np.unique(slots[found], return_index=True)
+        in_batch = np.flatnonzero(found)
+        found[np.setdiff1d(in_batch, in_batch[first])] = False
+        self._reported[slots[found]] = True
+
+        late = ~hit & (keys < stored)
+        self.counters['reported'] += int(found.sum())
+        self.counters['duplicate'] += int((hit & ~found).sum())
+        self.counters['late'] += int(late.sum())
+        self.counters['unknown'] += int((~hit & ~late).sum())
+        if self.trajectory is not None:
+            return self.trajectory(keys), found
+        return self._positions[slots], found
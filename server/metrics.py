@@ -0,0 +1,179 @@
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# client/metrics.py and server/metrics.py are the same file, keep them in sync
+
+# histogram upper bounds in seconds, 10us doubling up to about 10s
+DEFAULT_BUCKETS = tuple(1e-5 * 2 ** i for i in range(21))
+
+
+class Histogram():
+    '''
+    Counts of observed durations in fixed buckets, bucket i holds values <= bounds[i], the last one the rest
+    '''
+    def __init__(self, bounds: tuple = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        '''
+        Upper bound of the bucket holding the q-th quantile, inf if it is beyond the last bucket
+        '''
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return float('inf')
+
+
+class Metrics():
+    '''
+    Opt-in stage timings and counters of one process.
+
+    Hot paths call start() and stop(stage, start) around a stage, or count(name). While disabled these
+    are a single attribute check. snapshot() and prometheus() read the current values, export() writes
+    them periodically to a JSONL file and serves them on a local Prometheus text endpoint.
+    '''
+    def __init__(self, enabled: bool = False, buckets: tuple = DEFAULT_BUCKETS, prefix: str = 'ball'):
+        '''
+        param enabled:      collect timings and counters
+        param buckets:      histogram upper bounds in seconds
+        param prefix:       prefix of the exported metric names
+        param histograms:   stage name -> Histogram of its durations
+        param counters:     counter name -> value
+        '''
+        self.enabled = enabled
+        self.buckets = buckets
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self._thread = None
+        self._httpd = None
+        self._stop = threading.Event()
+
+    def start(self) -> float:
+        '''
+        Start time of a stage, pass it to stop()
+        '''
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, stage: str, start: float):
+        '''
+        Record the duration of a stage started with start()
+        '''
+        if self.enabled:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float):
+        '''
+        Record a duration measured elsewhere, e.g. in a detection process
+        '''
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        '''
+        Current values, {'time', 'counters', 'stages': {stage: {count, sum, p50, p99, buckets}}}
+        '''
+        stages = {}
+        for stage, h in list(self.histograms.items()):
+            stages[stage] = {'count': h.count, 'sum': h.sum, 'p50': h.quantile(0.5), 'p99': h.quantile(0.99),
+                             'buckets': list(h.counts)}
+        return {'time': time.time(), 'counters': dict(self.counters), 'stages': stages}
+
+    def prometheus(self) -> str:
+        '''
+        Current values in the Prometheus text exposition format
+        '''
+        name = f'{self.prefix}_stage_seconds'
+        lines = [f'# TYPE {name} histogram']
+        for stage, h in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self._labels(), h.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+        for counter, value in sorted(self.counters.items()):
+            lines.append(f'# TYPE {self.prefix}_{counter}_total counter')
+            lines.append(f'{self.prefix}_{counter}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _labels(self) -> list:
+        return [f'{bound:.6g}' for bound in self.buckets] + ['+Inf']
+
+    def write_jsonl(self, path: str):
+        '''
+        Append the current snapshot as one line
+        '''
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.snapshot()) + '\n')
+
+    def export(self, jsonl: str = None, port: int = None, interval: float = 10, host: str = '127.0.0.1'):
+        '''
+        Enable collection and start exporting
+
+        param jsonl:    file a snapshot is appended to every interval seconds
+        param port:     serve the Prometheus text on http://host:port/metrics
+        param interval: seconds between two JSONL snapshots
+        '''
+        self.enabled = True
+        if port is not None:
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = metrics.prometheus().encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self._httpd = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=self._httpd.serve_forever, name='metrics-http', daemon=True).start()
+        if jsonl is not None:
+            self._thread = threading.Thread(target=self._run, args=(jsonl, interval), name='metrics-jsonl',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self, path: str, interval: float):
+        while not self._stop.wait(interval):
+            self.write_jsonl(path)
+        self.write_jsonl(path)
+
+    def close(self):
+        '''
+        Write the last snapshot and stop exporting
+        '''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
@@ -0,0 +1,60 @@
+import json
+import struct
+import numpy as np
+
+# Binary messages on the data channel. Mirrors client/protocol.py, keep both in sync.
+# A message is a header followed by `count` fixed width little-endian records. Stream info messages
+# from the server carry a JSON object instead, their count is its length in bytes.
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('<BBH')  # version, kind, record count
+
+KIND_RESULTS = 1         # client -> server, RESULT_RECORD records
+KIND_STREAM_INFO = 2     # server -> client, JSON parameters of the video stream
+KIND_FEEDBACK = 3        # client -> server, FEEDBACK_RECORD load of the detection pipeline
+
+RESULT_RECORD = np.dtype([
+    ('pts', '<i8'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('confidence', '<f4'),
+    ('latency_us', '<u4')
+])
+
+# counters are totals since the session started
+FEEDBACK_RECORD = np.dtype([
+    ('queue_depth', '<u4'),     # frames handed to the detectors and not reported yet
+    ('latency_us', '<u4'),      # mean detection time since the previous feedback
+    ('received', '<u4'),        # frames received from the track
+    ('processed', '<u4'),       # frames detected
+    ('dropped', '<u4')          # frames skipped by the drop policy or for lack of a free slot
+])
+
+RECORDS = {KIND_RESULTS: RESULT_RECORD, KIND_FEEDBACK: FEEDBACK_RECORD}
+
+
+def decode_message(message: bytes) -> tuple:
+    '''
+    Unpack a message without copying its records
+
+    return:             (kind, records) where records is a read-only numpy record array
+    raise ValueError:   if the message has another protocol version, an unknown kind or a bad length
+    '''
+    if not isinstance(message, (bytes, bytearray)) or len(message) < HEADER.size:
+        raise ValueError("not a binary protocol message")
+    version, kind, count = HEADER.unpack_from(message)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"unsupported protocol version {version}")
+    if kind not in RECORDS:
+        raise ValueError(f"unknown message kind {kind}")
+    dtype = RECORDS[kind]
+    if len(message) != HEADER.size + count * dtype.itemsize:
+        raise ValueError(f"message length {len(message)} does not match {count} records")
+    return kind, np.frombuffer(message, dtype=dtype, count=count, offset=HEADER.size)
+
+
+def encode_stream_info(info: dict) -> bytes:
+    '''
+    Pack the parameters of the video stream, see RTCServer.stream_info()
+    '''
+    payload = json.dumps(info).encode('utf8')
+    return HEADER.pack(PROTOCOL_VERSION, KIND_STREAM_INFO, len(payload)) + payload
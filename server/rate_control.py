@@ -0,0 +1,73 @@
+class RateController():
+    '''
+    Adapts the frame interval of a track to the load the client reports, see protocol.FEEDBACK_RECORD.
+
+    The client is overloaded when its detection queue holds more than max_queue frames, it dropped frames
+    since the previous feedback, or detection takes longer than the time between two frames. Then every
+    second frame more is skipped, down to min_fps. After recover_after consecutive feedbacks without
+    overload one frame less is skipped, back up to the full rate. If that overloads the client again
+    the calm period needed before the next step up doubles, so the rate settles instead of oscillating.
+    '''
+    def __init__(self, fps: float, min_fps: float = 5, max_queue: int = 2, recover_after: int = 4,
+                 max_recover_after: int = 64):
+        '''
+        param fps:              full frame rate of the track
+        param min_fps:          lowest frame rate the controller goes down to
+        param max_queue:        detection queue depth the client may hold without being overloaded
+        param recover_after:    feedbacks without overload before the rate goes up again
+        param max_recover_after: longest calm period the backoff grows to
+        param interval:         1 sends every frame, k every k-th
+        param changes:          number of rate changes
+        '''
+        self.fps = fps
+        self.max_interval = max(1, int(fps // min_fps))
+        self.max_queue = max_queue
+        self.recover_after = recover_after
+        self.max_recover_after = max_recover_after
+        self.interval = 1
+        self.changes = 0
+        self._hold = recover_after
+        self._calm = 0
+        self._raised = False
+        self._dropped = None
+
+    def update(self, feedback) -> int:
+        '''
+        Fold in one feedback record
+
+        return: the frame interval to use from now on
+        '''
+        dropped = int(feedback['dropped'])
+        new_drops = 0 if self._dropped is None else dropped - self._dropped
+        self._dropped = dropped
+        frame_time_us = 1e6 * self.interval / self.fps
+        overloaded = (feedback['queue_depth'] > self.max_queue or new_drops > 0
+                      or feedback['latency_us'] > frame_time_us)
+        if overloaded:
+            if self._raised:
+                # the last step up was too much
+                self._hold = min(self._hold * 2, self.max_recover_after)
+            self._raised = False
+            self._calm = 0
+            self._set(min(self.interval * 2, self.max_interval))
+        else:
+            self._calm += 1
+            if self._calm >= self._hold and self.interval > 1:
+                self._calm = 0
+                self._raised = True
+                self._set(self.interval - 1)
+            elif self._calm >= self._hold:
+                # stable at the full rate, forget the backoff
+                self._raised = False
+                self._hold = self.recover_after
+        return self.interval
+
+    def _set(self, interval: int):
+        if interval != self.interval:
+            print(f"client load changed, sending {self.fps / interval:.1f} fps")
+            self.interval = interval
+            self.changes += 1
+
+    @property
+    def current_fps(self) -> float:
+        return self.fps / self.interval
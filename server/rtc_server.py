@@ -1,9 +1,15 @@
 import aiortc
+from aiortc.contrib.media import MediaRelay
 from aiortc.contrib.signaling import TcpSocketSignaling, BYE
-from ball_bouncing_track import BallBouncingTrack
+from ball_bouncing_track import BallBouncingTrack, RelayedTrack
+from encoding import FrameEncoder, codec_preferences
+from protocol import KIND_FEEDBACK, decode_message, encode_stream_info
+from rate_control import RateController
 from typing import Tuple
-import cv2
 import numpy as np
+from display import OverlayDisplay
+from metrics import Metrics
+from accuracy import AccuracyStats, TargetStats
 
 
 class RTCServer():
@@ -11,13 +17,63 @@ class RTCServer():
     RTCServer creates ball bouncing video and send frames to client. When the client sends back
     coordinates, server will display ball based on received coordinates and calucalte error.
     '''
-    def __init__(self, host: str, port: str, velocity: int, radius: int, width: int, height: int):
-        self.ball_position = {}
-        self.signal = TcpSocketSignaling(host, port)
+    def __init__(self, host: str, port: str, velocity: int, radius: int, width: int, height: int,
+                 display: bool = True, display_fps: float = 30, signal = None, source: BallBouncingTrack = None,
+                 relay: MediaRelay = None, exit_on_failure: bool = True, metrics: Metrics = None, fps: float = 30,
+                 paced: bool = True, adaptive: bool = False, min_fps: float = 5, balls: int = 1,
+                 collisions: bool = False, profile: dict = None):
+        '''
+        param display:      show the overlay of server and client ball, False runs headless
+        param display_fps:  highest overlay redraw rate
+        param signal:       signaling of an already accepted connection, a TcpSocketSignaling on host:port if None
+        param source:       shared ball bouncing track to relay instead of generating frames for this client only
+        param relay:        MediaRelay fanning out the shared source track, required with source
+        param exit_on_failure:  exit the program when the connection fails, otherwise only this session ends
+        param metrics:      stage timings, disabled if None
+        param fps:          frame rate of the generated video
+        param paced:        generate frames at fps, False generates them as fast as they are sent
+        param adaptive:     lower the frame rate while the client reports it can't keep up, see RateController.
+                            Tracks shared with other clients always keep their rate
+        param min_fps:      lowest frame rate when adaptive
+        param balls:        number of balls in the generated video, ignored with source
+        param collisions:   let the balls bounce off each other, ignored with source
+        param profile:      encoder profile, see encoding.PROFILES. aiortc negotiates the codec and encodes if None.
+                            A shared source encodes with its own encoder, the profile only picks the codec
+        param stats:        counters of received messages, records and scored records
+        param accuracy:     error statistics of the scored records
+        param targets:      per ball statistics of multi ball streams, None for a single ball
+        '''
+        self.metrics = Metrics() if metrics is None else metrics
+        self.signal = TcpSocketSignaling(host, port) if signal is None else signal
         self.pc = aiortc.RTCPeerConnection()
         self.channel = self.pc.createDataChannel("RTCchannel")
-        self.stream_track = BallBouncingTrack(velocity, radius, width, height, self.ball_position)
-        self.pc.addTrack(self.stream_track)
+        self.profile = {} if profile is None else profile
+        if source is None:
+            self.stream_track = BallBouncingTrack(velocity, radius, width, height, metrics=self.metrics, fps=fps,
+                                                  paced=paced, balls=balls, collisions=collisions,
+                                                  encoder=FrameEncoder.from_profile(self.profile, fps))
+            self.ground_truth = self.stream_track.ground_truth
+            sender = self.pc.addTrack(self.stream_track)
+        else:
+            # frames are generated once for every client of the source, each client is scored on its own
+            self.stream_track = source
+            self.ground_truth = source.new_ground_truth()
+            sender = self.pc.addTrack(RelayedTrack(relay.subscribe(source, buffered=False), self.ground_truth))
+        # packets of the track's own encoder can only be sent with its codec
+        codec = self.profile.get('codec') if self.stream_track.encoder is None else self.stream_track.encoder.codec
+        if codec is not None:
+            transceiver = next(t for t in self.pc.getTransceivers() if t.sender is sender)
+            transceiver.setCodecPreferences(codec_preferences(codec))
+        self.display = OverlayDisplay(width, height, radius, display_fps, headless=not display)
+        self.stats = dict.fromkeys(('messages', 'records', 'scored', 'feedback'), 0)
+        self.rate_control = RateController(fps, min_fps) if adaptive and source is None else None
+        self.accuracy = AccuracyStats()
+        # estimates further than a radius from every ball can't belong to one
+        self.targets = TargetStats(self.stream_track.balls, radius, self.accuracy) \
+            if self.stream_track.balls > 1 else None
+        self._stream_info_sent = False
+        self.exit_on_failure = exit_on_failure
+        self._shut_down = False
 
     def calculate_error(self, actual: Tuple[int, int], estimated: Tuple[int, int]):
         '''
@@ -25,18 +81,78 @@ class RTCServer():
         '''
         return np.linalg.norm(np.asarray(actual) - np.asarray(estimated))
 
+    def stream_info(self) -> dict:
+        '''
+        Parameters that determine the ball position of every pts the client receives
+        '''
+        frame = self.stream_track.frame_generator
+        return {'velocity': self.stream_track.velocity, 'radius': frame.radius, 'width': frame.width,
+                'height': frame.height, 'pts_step': self.ground_truth.pts_step,
+                'pts_offset': self.ground_truth.pts_offset, 'balls': self.stream_track.balls,
+                'collisions': self.stream_track.collisions}
+
+    def on_feedback(self, records: np.ndarray):
+        '''
+        Adapt the frame rate to the load the client reports
+        '''
+        self.stats['feedback'] += len(records)
+        if self.rate_control is not None and len(records):
+            self.stream_track.frame_interval = self.rate_control.update(records[-1])
+
+    def score_targets(self, records: np.ndarray) -> int:
+        '''
+        Score the records of a multi ball stream. The client sends all estimates of a frame in one
+        message, consecutively; records with zero confidence only mark a frame without detections.
+
+        return: number of frames scored
+        '''
+        if not len(records):
+            return 0
+        bounds = np.flatnonzero(np.diff(records['pts'])) + 1
+        groups = np.split(records, bounds)
+        positions, found = self.ground_truth.lookup_many(np.array([group['pts'][0] for group in groups]))
+        for i in np.flatnonzero(found):
+            group = groups[i][groups[i]['confidence'] > 0]
+            self.targets.add(positions[i], np.column_stack((group['x'], group['y'])))
+        return int(found.sum())
+
+    def score_records(self, records: np.ndarray) -> int:
+        '''
+        Score the records of a single ball stream. Reports for frames that are unknown, evicted or already
+        scored are only counted, so are records without a position, e.g. frames without detections of a
+        client reporting many balls.
+
+        return: number of records scored
+        '''
+        records = records[np.isfinite(records['x']) & np.isfinite(records['y'])]
+        start = self.metrics.start()
+        positions, found = self.ground_truth.lookup_many(records['pts'])
+        self.metrics.stop('match', start)
+        start = self.metrics.start()
+        hits = np.flatnonzero(found)
+        if len(hits):
+            truths = positions[hits]
+            estimates = np.column_stack((records['x'][hits], records['y'][hits]))
+            self.accuracy.add(truths, estimates)
+            # the overlay only ever shows the latest pair
+            self.display_frame(tuple(truths[-1].tolist()), tuple(np.rint(estimates[-1]).astype(int).tolist()))
+            #print timestamp and corresponding values every few seconds
+            for i in hits[records['pts'][hits] % 50000 == 0].tolist():
+                server_loc = tuple(positions[i].tolist())
+                client_estimated_loc = (round(float(records['x'][i])), round(float(records['y'][i])))
+                error = self.calculate_error(server_loc, client_estimated_loc)
+                print(f"=====timestamp {int(records['pts'][i])}=====\n\tserver ball location: "
+                    f"{server_loc}\n\tclient estimated location: {client_estimated_loc}\n\t"
+                    f"Error(euclidean distance): {round(error,2)}")
+        self.metrics.stop('score', start)
+        return len(hits)
+
     def display_frame(self, server_loc: Tuple[int, int], client_estimated_loc: Tuple[int, int]):
         '''
-        Display an overlay of server side generated bouncing ball(green) and ball received from the client(red)
+        Display an overlay of server side generated bouncing ball(green) and ball received from the client(red).
+        Drawing happens on the display thread, see display.OverlayDisplay
         '''
-        radius = self.stream_track.radius
-        frame_server = np.zeros((self.stream_track.height, self.stream_track.width, 3), dtype='uint8')
-        frame_client_estimated = np.zeros((self.stream_track.height, self.stream_track.width, 3), dtype='uint8')
-        cv2.circle(frame_server, server_loc, radius=radius, color=(0,255,0), thickness=-1)
-        cv2.circle(frame_client_estimated, client_estimated_loc, radius=radius, color=(0,0,255), thickness=-1)
-        frame = cv2.addWeighted(frame_server, 0.5, frame_client_estimated, 0.5, 0)
-        cv2.imshow("server", frame)
-        cv2.waitKey(1)
+        self.display.update(server_loc, client_estimated_loc)
 
     async def register_on_callbacks(self):
         '''
@@ -46,43 +162,63 @@ class RTCServer():
         @channel.on("message")
         def on_message(message):
             '''
-            Process received messages from client
+            Process received batches of results and load feedback from client, see protocol.py
 
-            values: [x_position, y_position, timestamp]
+            records: [(pts, x_position, y_position, confidence, latency_us)]
             '''
-            values = message.split('\t') 
-
+            metrics = self.metrics
+            start = metrics.start()
             try:
-                ball_location_dict = self.stream_track.ball_location_dict
-                timestamp = int(values[2])
-                server_loc = ball_location_dict[timestamp]
-                client_estimated_loc = (int(values[0]), int(values[1]))
-                self.display_frame(server_loc, client_estimated_loc)
-                error = self.calculate_error(server_loc, client_estimated_loc)
-                #print timestamp and corresponding values every few seconds
-                if timestamp % 50000 == 0:
-                    print(f"=====timestamp {timestamp}=====\n\tserver ball location: "
-                        f"{server_loc}\n\tclient estimated location: {client_estimated_loc}\n\t"
-                        f"Error(euclidean distance): {round(error,2)}")
-                del ball_location_dict[int(values[2])]
-            except Exception as e:
+                kind, records = decode_message(message)
+            except ValueError as e:
                 print("Process Client Message Error:", e)
+                metrics.count('bad_messages')
+                return
+            metrics.stop('decode', start)
+            # the first report means frames arrive, so the pts offset of the client is known by now
+            if not self._stream_info_sent:
+                self.channel.send(encode_stream_info(self.stream_info()))
+                self._stream_info_sent = True
+            if kind == KIND_FEEDBACK:
+                self.on_feedback(records)
+                return
+
+            if self.targets is not None:
+                start = metrics.start()
+                scored = self.score_targets(records)
+                metrics.stop('score', start)
+                self.stats['messages'] += 1
+                self.stats['records'] += len(records)
+                self.stats['scored'] += scored
+                metrics.count('records', len(records))
+                metrics.count('scored', scored)
+                return
+
+            scored = self.score_records(records)
+            self.stats['messages'] += 1
+            self.stats['records'] += len(records)
+            self.stats['scored'] += scored
+            metrics.count('records', len(records))
+            metrics.count('scored', scored)
         
         @self.pc.on("connectionstatechange")
         async def on_connectionstatechange():
             '''
-            Log details about connection state. if connection fails, just exit program
+            Log details about connection state. if connection fails, exit program or end this session
             '''
             print(f"connection state is {self.pc.connectionState}")
             if self.pc.connectionState == "failed":
-                await self.pc.close()
-                exit(-1)
+                if self.exit_on_failure:
+                    await self.pc.close()
+                    exit(-1)
+                await self.shutdown()
 
     async def run(self):
         '''
         Run server
         '''
         await self.register_on_callbacks()
+        self.display.start()
 
         # creates SDP offer to send to client over tcp
         offer = await self.pc.createOffer()
@@ -101,6 +237,16 @@ class RTCServer():
         '''
         Close all connections
         '''
+        if self._shut_down:
+            return
+        self._shut_down = True
+        print("client reports:", self.ground_truth.counters)
+        print("accuracy:", self.accuracy.summary())
+        if self.targets is not None:
+            print("balls:", self.targets.summary())
+        if self.ground_truth is not self.stream_track.ground_truth:
+            self.stream_track.release_ground_truth(self.ground_truth)
+        self.display.stop()
         await self.signal.close()
         try:
             await self.channel.close()
@@ -1,17 +1,83 @@
+import argparse
 import asyncio
+from encoding import PROFILES, make_profile
+from metrics import Metrics
 from rtc_server import RTCServer
+from session_server import SessionServer
 
-async def main():
+# largest frame the client's shared slots hold by default, its max_frame_shape of packed I420 planes
+MAX_WIDTH, MAX_HEIGHT = 1920, 1080
+
+async def main(args):
     '''
     Build and run server
     '''
-    while True:
-        server = RTCServer(host='localhost', port='12345', velocity=5, radius=17, width=300, height=200)
-        await server.run()
-        await server.shutdown()
+    metrics = Metrics()
+    if args.metrics_jsonl or args.metrics_port:
+        metrics.export(args.metrics_jsonl, args.metrics_port, args.metrics_interval)
+    stream = dict(velocity=args.velocity, radius=args.radius, width=args.width, height=args.height)
+    profile = make_profile(args.profile, codec=args.codec, bitrate=args.bitrate,
+                           keyframe_interval=args.keyframe_interval)
+    try:
+        if args.multi_session:
+            # serve every connecting client concurrently from this process
+            server = SessionServer(host=args.host, port=args.port, **stream, max_sessions=args.max_sessions,
+                                   metrics=metrics, fps=args.fps, paced=not args.uncapped, profile=profile,
+                                   stats_interval=args.stats_interval)
+            await server.serve()
+            return
+        while True:
+            server = RTCServer(host=args.host, port=args.port, **stream, display=not args.headless,
+                               metrics=metrics, fps=args.fps, paced=not args.uncapped, adaptive=args.adaptive,
+                               min_fps=args.min_fps, balls=args.balls, collisions=args.collisions,
+                               profile=profile)
+            await server.run()
+            await server.shutdown()
+    finally:
+        metrics.close()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ball bouncing server')
+    parser.add_argument('--host', default='localhost', help='signaling host')
+    parser.add_argument('--port', default='12345', help='signaling port')
+    parser.add_argument('--width', type=int, default=300, help='frame width')
+    parser.add_argument('--height', type=int, default=200, help='frame height')
+    parser.add_argument('--radius', type=int, default=17, help='ball radius')
+    parser.add_argument('--velocity', type=int, default=5, help='ball velocity in pixels per frame on both axes')
+    parser.add_argument('--fps', type=float, default=30, help='frame rate, sets the pts clock')
+    parser.add_argument('--uncapped', action='store_true',
+                        help='generate frames as fast as they are sent, pts still follow --fps')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='lower the frame rate while the client reports it falls behind, single session only')
+    parser.add_argument('--min-fps', type=float, default=5, help='lowest frame rate with --adaptive')
+    parser.add_argument('--balls', type=int, default=1,
+                        help='number of balls, the client needs --max-balls to report them all')
+    parser.add_argument('--collisions', action='store_true', help='let the balls bounce off each other')
+    parser.add_argument('--profile', default='default', choices=tuple(PROFILES),
+                        help='encoder profile of the video, see encoding.PROFILES')
+    parser.add_argument('--codec', choices=('vp8', 'h264'), help='only offer this codec, overrides the profile')
+    parser.add_argument('--bitrate', type=int,
+                        help='encode with this fixed bitrate in bits per second instead of adapting it')
+    parser.add_argument('--keyframe-interval', type=int, help='frames between two keyframes with a fixed bitrate')
+    parser.add_argument('--headless', action='store_true', help='do not show the overlay')
+    parser.add_argument('--multi-session', action='store_true',
+                        help='serve many clients at once, headless, sharing one generated stream')
+    parser.add_argument('--max-sessions', type=int, default=64, help='concurrent session limit of --multi-session')
+    parser.add_argument('--stats-interval', type=float, default=10,
+                        help='seconds between two session stats of --multi-session, 0 only prints them at shutdown')
+    parser.add_argument('--metrics-jsonl', help='append stage timings to this file every --metrics-interval seconds')
+    parser.add_argument('--metrics-port', type=int, help='serve stage timings for Prometheus on this local port')
+    parser.add_argument('--metrics-interval', type=float, default=10)
+    args = parser.parse_args()
+    if args.multi_session and args.balls > 1:
+        parser.error('--balls is only supported for single sessions')
+    if args.width % 2 or args.height % 2:
+        parser.error('--width and --height must be even, the encoders and the client store I420 frames')
+    if args.width > MAX_WIDTH or args.height > MAX_HEIGHT:
+        parser.error(f'the client holds frames up to {MAX_WIDTH}x{MAX_HEIGHT}')
+    if args.bitrate is not None and args.codec is None and PROFILES[args.profile]['codec'] is None:
+        parser.error('--bitrate needs --codec or a profile with a codec')
     try:
-        asyncio.run(main())
+        asyncio.run(main(args))
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,155 @@
+import asyncio
+import itertools
+import time
+from aiortc.contrib.media import MediaRelay
+from ball_bouncing_track import BallBouncingTrack
+from encoding import FrameEncoder
+from metrics import Metrics
+from rtc_server import RTCServer
+from signaling import StreamSignaling
+
+
+class SessionServer():
+    '''
+    Serves many concurrent clients from one process. Every TCP signaling connection gets its own
+    RTCServer session with its own peer connection, data channel and scoring state. Sessions with
+    identical stream parameters share one BallBouncingTrack through a MediaRelay, so each frame is
+    generated once however many clients watch it.
+    '''
+    def __init__(self, host: str, port: str, velocity: int, radius: int, width: int, height: int,
+                 max_sessions: int = 64, metrics: Metrics = None, fps: float = 30, paced: bool = True,
+                 profile: dict = None, stats_interval: float = 10):
+        '''
+        param host:             signaling host to listen on
+        param port:             signaling port to listen on
+        param velocity:         ball moving velocity of new sessions
+        param radius:           ball radius of new sessions
+        param width:            frame width of new sessions
+        param height:           frame height of new sessions
+        param max_sessions:     connections beyond this many concurrent sessions are refused
+        param metrics:          stage timings shared by all sessions, disabled if None
+        param fps:              frame rate of the shared tracks
+        param paced:            generate frames at fps, False generates them as fast as they are sent
+        param profile:          encoder profile, see encoding.PROFILES. Shared tracks with fixed encoder
+                                settings encode each frame once for all of their sessions
+        param stats_interval:   seconds between two printed stats() while serving, only at shutdown if 0
+        '''
+        self.host = host
+        self.port = port
+        self.params = (velocity, radius, width, height)
+        self.max_sessions = max_sessions
+        self.metrics = Metrics() if metrics is None else metrics
+        self.fps = fps
+        self.paced = paced
+        self.profile = {} if profile is None else profile
+        self.stats_interval = stats_interval
+        self.sessions = {}
+        self.finished = {'sessions': 0, 'messages': 0, 'records': 0, 'scored': 0, 'frames': 0}
+        self._relay = MediaRelay()
+        self._sources = {}  # params -> [track, number of sessions]
+        self._ids = itertools.count(1)
+        self._server = None
+        self._started = time.monotonic()
+
+    async def serve(self):
+        '''
+        Accept signaling connections until cancelled, printing the stats every stats_interval seconds
+        and once more when done
+        '''
+        self._server = await asyncio.start_server(self._on_connect, host=self.host, port=int(self.port))
+        print(f"serving sessions on {self.host}:{self.port}")
+        report = asyncio.ensure_future(self._report_stats()) if self.stats_interval else None
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            if report is not None:
+                report.cancel()
+            self.print_stats()
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self.print_stats()
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if len(self.sessions) >= self.max_sessions:
+            print("session limit reached, refusing connection")
+            writer.close()
+            return
+        await self.run_session(StreamSignaling(reader, writer))
+
+    async def run_session(self, signal, params: tuple = None):
+        '''
+        Run one session to completion
+
+        param signal:   signaling of the accepted connection
+        param params:   (velocity, radius, width, height), the server defaults if None
+        '''
+        params = self.params if params is None else params
+        session_id = next(self._ids)
+        source = self._acquire_source(params)
+        session = RTCServer(self.host, self.port, *params, display=False, signal=signal, source=source,
+                            relay=self._relay, exit_on_failure=False, metrics=self.metrics, profile=self.profile)
+        self.sessions[session_id] = (session, time.monotonic())
+        print(f"session {session_id} started, {len(self.sessions)} active")
+        try:
+            await session.run()
+        finally:
+            await session.shutdown()
+            del self.sessions[session_id]
+            self.finished['sessions'] += 1
+            for key in ('messages', 'records', 'scored'):
+                self.finished[key] += session.stats[key]
+            self._release_source(params)
+            print(f"session {session_id} ended, {len(self.sessions)} active")
+
+    def _acquire_source(self, params: tuple) -> BallBouncingTrack:
+        if params not in self._sources:
+            track = BallBouncingTrack(*params, metrics=self.metrics, fps=self.fps, paced=self.paced,
+                                      encoder=FrameEncoder.from_profile(self.profile, self.fps))
+            self._sources[params] = [track, 0]
+        self._sources[params][1] += 1
+        return self._sources[params][0]
+
+    def _release_source(self, params: tuple):
+        '''
+        Stop the shared track once its last session is gone, the next session starts a fresh stream
+        '''
+        self._sources[params][1] -= 1
+        if self._sources[params][1] == 0:
+            track, _ = self._sources.pop(params)
+            self.finished['frames'] += track.frames
+            track.stop()
+
+    def stats(self) -> dict:
+        '''
+        Per session and aggregate throughput counters
+
+        return: {'sessions': {id: counters}, 'aggregate': counters}
+        '''
+        now = time.monotonic()
+        sessions = {}
+        for session_id, (session, started) in self.sessions.items():
+            elapsed = max(now - started, 1e-9)
+            sessions[session_id] = dict(session.stats, seconds=elapsed,
+                                        records_per_second=session.stats['records'] / elapsed,
+                                        accuracy=session.accuracy.summary(), **session.ground_truth.counters)
+        aggregate = dict(self.finished, active=len(self.sessions), shared_tracks=len(self._sources))
+        for key in ('messages', 'records', 'scored'):
+            aggregate[key] += sum(session.stats[key] for session, _ in self.sessions.values())
+        aggregate['frames'] += sum(track.frames for track, _ in self._sources.values())
+        elapsed = max(now - self._started, 1e-9)
+        aggregate['records_per_second'] = aggregate['records'] / elapsed
+        aggregate['frames_per_second'] = aggregate['frames'] / elapsed
+        return {'sessions': sessions, 'aggregate': aggregate}
+
+    def print_stats(self):
+        '''
+        Print the active sessions and the aggregate counters
+        '''
+        stats = self.stats()
+        for session_id, counters in stats['sessions'].items():
+            print(f"session {session_id}: {counters['records']} records, "
+                  f"{counters['records_per_second']:.1f} records/s, accuracy: {counters['accuracy']}")
+        print("sessions:", stats['aggregate'])
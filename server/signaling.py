@@ -0,0 +1,33 @@
+import asyncio
+from aiortc.contrib.signaling import BYE, object_from_string, object_to_string
+
+
+class StreamSignaling():
+    '''
+    Signaling over one accepted TCP connection, speaking the same newline delimited JSON as
+    aiortc's TcpSocketSignaling so unchanged clients can connect.
+    '''
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    async def send(self, obj):
+        self._writer.write(object_to_string(obj).encode('utf8') + b'\n')
+        await self._writer.drain()
+
+    async def receive(self):
+        try:
+            data = await self._reader.readuntil()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return object_from_string(data.decode('utf8'))
+
+    async def close(self):
+        if self._writer is None:
+            return
+        try:
+            await self.send(BYE)
+        except ConnectionError:
+            pass
+        self._writer.close()
+        self._writer = None
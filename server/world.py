@@ -0,0 +1,168 @@
+import cv2 as cv
+import numpy as np
+
+
+class BallWorld():
+    '''
+    Many balls of one radius bouncing across the screen, stored as position and velocity arrays and moved
+    in vectorized steps. Stands in for Frame where a stream needs more than one ball: get_frame(),
+    ball_move() and seek() behave the same, with centers() as the ground truth of every ball.
+
+    Balls bounce off the frame edges like Frame.ball_move does, their velocity turns back inside once
+    they are past an edge. With collisions, touching balls that approach each other exchange the velocity
+    component along the line between their centers, as equal masses do in an elastic collision, one
+    contact per ball and step. Pairs are only tested between neighbouring cells of a grid with cells of
+    one ball diameter.
+    '''
+    def __init__(self, count: int, radius: int = 10, width: int = 640, height: int = 480, velocity: float = 5,
+                 collisions: bool = False, seed: int = 0, buffers: int = 3):
+        '''
+        param count:        number of balls
+        param radius:       ball radius
+        param width:        frame width
+        param height:       frame height
+        param velocity:     ball speed per frame along each axis of a diagonal move, directions are random
+        param collisions:   let balls bounce off each other
+        param seed:         seed of the random start positions and directions
+        param buffers:      number of reused output frames, a returned frame is redrawn `buffers` frames later
+        param positions:    (count, 2) ball centers [x_position, y_position]
+        param velocities:   (count, 2) moves per frame
+        param steps:        number of ball_move calls so far
+        param collided:     pairs of balls that bounced off each other so far
+        '''
+        if 2 * radius >= min(width, height):
+            raise ValueError(f"balls of radius {radius} do not fit a {width}x{height} frame")
+        rng = np.random.default_rng(seed)
+        self.count = count
+        self.radius = radius
+        self.width = width
+        self.height = height
+        self.collisions = collisions
+        self._low = np.array([radius, radius])
+        self._high = np.array([width - radius, height - radius])
+        self.positions = rng.uniform(self._low, self._high, size=(count, 2))
+        angles = rng.uniform(0, 2 * np.pi, count)
+        self.velocities = velocity * np.sqrt(2) * np.column_stack((np.cos(angles), np.sin(angles)))
+        self.steps = 0
+        self.collided = 0
+
+        # pixel offsets of the same filled circle Frame draws
+        sprite = np.zeros((2 * radius + 1, 2 * radius + 1), dtype='uint8')
+        cv.circle(sprite, (radius, radius), radius=radius, thickness=-1, color=255)
+        dy, dx = np.nonzero(sprite)
+        self._dx, self._dy = dx - radius, dy - radius
+        self._buffers = [np.zeros((height, width, 3), dtype='uint8') for _ in range(buffers)]
+        self._drawn = [None] * buffers
+        self._next_buffer = 0
+
+    def centers(self) -> np.ndarray:
+        '''
+        Ball centers as drawn into the frames
+
+        return: (count, 2) int array of [x_position, y_position]
+        '''
+        return np.rint(self.positions).astype(np.int32)
+
+    def get_frame(self) -> np.ndarray:
+        '''
+        Draw every ball into the next reused buffer. Only the pixels drawn there previously are cleared,
+        and all balls are written with one scatter, so the cost depends on the number of balls rather than
+        the frame size. The returned frame must not be modified.
+        '''
+        index = self._next_buffer
+        self._next_buffer = (index + 1) % len(self._buffers)
+        pixels = self._buffers[index].reshape(-1, 3)
+        if self._drawn[index] is not None:
+            pixels[self._drawn[index], 2] = 0
+
+        centers = self.centers()
+        xs = centers[:, 0, None] + self._dx
+        ys = centers[:, 1, None] + self._dy
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        drawn = ys[inside] * self.width + xs[inside]
+        pixels[drawn, 2] = 255
+        self._drawn[index] = drawn
+        return self._buffers[index]
+
+    def ball_move(self):
+        '''
+        Move every ball one step, bouncing off the frame edges and, with collisions, off each other
+        '''
+        # past an edge the ball heads back inside, a collision in the same step can't keep it out
+        below, above = self.positions < self._low, self.positions > self._high
+        self.velocities[below] = np.abs(self.velocities[below])
+        self.velocities[above] = -np.abs(self.velocities[above])
+        if self.collisions:
+            self._collide()
+        self.positions += self.velocities
+        if self.collisions:
+            # a ball pushed past an edge is put back on it and heads inside, so it stays in the frame
+            below, above = self.positions < self._low, self.positions > self._high
+            np.clip(self.positions, self._low, self._high, out=self.positions)
+            self.velocities[below] = np.abs(self.velocities[below])
+            self.velocities[above] = -np.abs(self.velocities[above])
+        self.steps += 1
+
+    def seek(self, step: int):
+        '''
+        Move the balls forward to their state after `step` ball_move calls from the start. Collisions make
+        the state depend on every step before, so the world can't go back.
+        '''
+        if step < self.steps:
+            raise ValueError(f"can't seek back from step {self.steps} to {step}")
+        for _ in range(step - self.steps):
+            self.ball_move()
+
+    def pairs(self) -> tuple:
+        '''
+        Candidate pairs of balls closer than one cell, from the uniform grid
+
+        return: (i, j) index arrays with i != j, every pair at most once
+        '''
+        cell = 2 * self.radius
+        cells = (self.positions // cell).astype(np.int64)
+        rows = self.height // cell + 3
+        # one extra row and column on each side, balls past the edges stay in their own cell
+        keys = (cells[:, 0] + 1) * rows + cells[:, 1] + 1
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        firsts, seconds = [], []
+        # half of the 3x3 neighbourhood, so every pair of cells is visited once
+        for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+            neighbours = keys + dx * rows + dy
+            lo = np.searchsorted(sorted_keys, neighbours, 'left')
+            counts = np.searchsorted(sorted_keys, neighbours, 'right') - lo
+            first = np.repeat(np.arange(self.count), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            second = order[np.repeat(lo, counts) + offsets]
+            if (dx, dy) == (0, 0):
+                keep = first < second
+                first, second = first[keep], second[keep]
+            firsts.append(first)
+            seconds.append(second)
+        return np.concatenate(firsts), np.concatenate(seconds)
+
+    def _collide(self):
+        '''
+        Elastic collisions of equal masses between touching balls that approach each other
+        '''
+        i, j = self.pairs()
+        delta = self.positions[j] - self.positions[i]
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        touching = (distance < 2 * self.radius) & (distance > 0)
+        i, j, delta, distance = i[touching], j[touching], delta[touching], distance[touching]
+        normal = delta / distance[:, None]
+        approach = np.einsum('ij,ij->i', self.velocities[i] - self.velocities[j], normal)
+        hit = np.flatnonzero(approach > 0)
+        # a ball in several contacts only bounces off the closest one this step, adding up the impulses of
+        # every contact would not conserve energy in crowded worlds
+        hit = hit[np.argsort(distance[hit], kind='stable')]
+        balls = np.concatenate((i[hit], j[hit]))
+        first = np.full(self.count, len(hit))
+        np.minimum.at(first, balls, np.tile(np.arange(len(hit)), 2))
+        rank = np.arange(len(hit))
+        hit = hit[(first[i[hit]] == rank) & (first[j[hit]] == rank)]
+        impulse = approach[hit, None] * normal[hit]
+        self.velocities[i[hit]] -= impulse
+        self.velocities[j[hit]] += impulse
+        self.collided += len(hit)
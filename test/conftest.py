@@ -0,0 +1,7 @@
+import os
+import sys
+
+# client and server modules import their siblings the same way they do when run as scripts
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for side in ('client', 'server'):
+    sys.path.append(os.path.join(ROOT, side))
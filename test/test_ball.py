@@ -1,10 +1,31 @@
 import numpy as np
-import multiprocessing as mp
 import cv2
 import pytest
-from client.ball_detection import *
+from ball_detection import *
+from frame_ring import FrameRing
+from detection_pool import DetectionPool
+from detectors import make_detector
+from display import FrameViewer, DISPLAY_OFF, DISPLAY_EVERY_NTH, DISPLAY_THREAD
+from protocol import ResultBatcher, RESULT_RECORD, KIND_RESULTS, KIND_FEEDBACK, FEEDBACK_RECORD, \
+    decode_stream_info, encode_records
+from capture import CaptureWriter, CaptureReader, ReplaySource
+from tracker import BallTracker, PREDICTED_CONFIDENCE
+from rtc_client import RTCClient
+from aiortc.contrib.signaling import BYE
+from ground_truth import GroundTruthRing
+from ball_bouncing_track import BallBouncingTrack
+from signaling import StreamSignaling
+from accuracy import AccuracyStats, TargetStats, assign_targets
+from world import BallWorld
+from rate_control import RateController
+from encoding import FrameEncoder, codec_preferences, make_profile
+# the bare protocol, display and metrics are the client's, the server's modules of the same name go by package
+from server import protocol as server_protocol, display as server_display
+from server.display import OverlayDisplay
+from server.metrics import Metrics, Histogram
 from unittest import mock
-from server.frame import *
+import select
+from frame import *
 
 
 @pytest.fixture
@@ -62,74 +83,1100 @@ def test_detect_center():
     assert error < 3
 
 @pytest.fixture
-def mp_params():
+def ring():
+    '''
+    fixture for initialzing a small shared memory frame ring
+    '''
+    ring = FrameRing(slots=2, max_shape=(4, 4, 3))
+    yield ring
+    ring.close()
+
+@pytest.mark.client
+def test_frame_ring_round_trip(ring):
+    '''
+    Test frames written into a slot are read back in place with their pts
+    '''
+    slot = ring.reserve((4, 4, 3))
+    slot[:] = 7
+    ring.commit(3000)
+    assert ring.qsize() == 1
+    frame, pts = ring.get()
+    assert pts == 3000
+    assert frame.shape == (4, 4, 3)
+    assert (frame == 7).all()
+    assert ring.qsize() == 0
+
+@pytest.mark.client
+def test_frame_ring_drops_when_full(ring):
+    '''
+    Test producer drops frames instead of overwriting slots the consumer has not read
+    '''
+    frame = np.ones((2, 2, 3), dtype='uint8')
+    assert ring.put(frame, 1)
+    assert ring.put(frame, 2)
+    assert not ring.put(frame, 3)
+    assert ring.dropped == 1
+    assert ring.get()[1] == 1
+    # slot is still held until the next get
+    assert not ring.put(frame, 4)
+    assert ring.get()[1] == 2
+    assert ring.put(frame, 5)
+    with pytest.raises(ValueError):
+        ring.reserve((8, 8, 3))
+
+@pytest.mark.client
+def test_frame_ring_attach_by_pickle(ring):
+    '''
+    Test a ring handed to another process sees the same shared slots
+    '''
+    import pickle
+    other = pickle.loads(pickle.dumps(ring))
+    ring.put(np.full((4, 4), 9, dtype='uint8'), 42)
+    frame, pts = other.get()
+    assert pts == 42
+    assert (frame == 9).all()
+    del frame
+    other.close()
+
+@pytest.fixture
+def mp_params(ring):
     '''
     fixture for initialzing params from process on client side
     '''
-    que = mp.Queue()
-    que.qsize = mock.Mock(return_value=1)
-    que.get = mock.Mock(return_value=(1,1))
-    val = mp.Value(POINT)
-    val.x = 1
-    val.y = 1
-    val.time_stamp = -1
-    cond = mp.Value(ctypes.c_int)
-    cond.value = 0
-    return (que, val, cond)
+    results = (RESULT * 8)()
+    ring.put(np.zeros((4, 4, 3), dtype='uint8'), 1, 3)
+    return (ring, results)
 
 @pytest.mark.client
 def test_update_center_values_return_none(mp_params):
     '''
-    Test values stay the same when detect_center returns None
+    Test result is marked as missed when detect_center returns None
     '''
-    que, val, cond = mp_params
-    x = val.x
-    y = val.y
-    with mock.patch('client.ball_detection.detect_center', return_value = None, autospec=True):
-        update_center_values(que, val, cond)
+    que, results = mp_params
+    with mock.patch('ball_detection.detect_center', return_value = None, autospec=True):
+        assert update_center_values(que, results)
     
-    assert val.x == x
-    assert val.y == y
-    assert val.time_stamp == 1
-    assert cond.value == 1
+    assert results[3].status == RESULT_MISSED
 
 @pytest.mark.client
 def test_update_center_values_return_values(mp_params):
     '''
-    Test values get updated when detect_center returns actual values
+    Test result gets filled in when detect_center returns actual values
     '''
-    que, val, cond = mp_params
+    que, results = mp_params
     x = 5
     y = 5
-    with mock.patch('client.ball_detection.detect_center', return_value = (x,y,1), autospec=True):
-        update_center_values(que, val, cond)
+    with mock.patch('ball_detection.detect_center', return_value = (x,y,1), autospec=True):
+        assert update_center_values(que, results)
     
-    assert val.x == x
-    assert val.y == y
-    assert val.time_stamp == 1
-    assert cond.value == 1
+    assert results[3].x == x
+    assert results[3].y == y
+    assert results[3].status == RESULT_FOUND
 
 @pytest.mark.client
-def test_update_center_values_no_update(mp_params):
+def test_update_center_values_latest_policy(mp_params):
     '''
-    Test values stay the same when condition equals 1
+    Test latest policy skips to the newest frame and counts the dropped ones
     '''
-    que, val, cond = mp_params
-    x = val.x
-    y = val.y
-    cond.val = 1
-    with mock.patch('client.ball_detection.detect_center', return_value = (1,1,1), autospec=True):
-        update_center_values(que, val, cond)
-    
-    assert val.x == x
-    assert val.y == y
-    assert val.time_stamp == 1
-    assert cond.value == 1
+    que, results = mp_params
+    stats = FRAME_STATS()
+    que.put(np.zeros((4, 4, 3), dtype='uint8'), 2, 4)
+    with mock.patch('ball_detection.detect_center', return_value = (5,5,1), autospec=True):
+        assert update_center_values(que, results, DROP_LATEST, stats=stats)
+    assert results[3].status == RESULT_DROPPED
+    assert results[4].status == RESULT_FOUND
+    assert (stats.received, stats.processed, stats.dropped) == (2, 1, 1)
+
+@pytest.mark.client
+def test_update_center_values_every_nth_policy(mp_params):
+    '''
+    Test every_nth policy only runs the detector on every n-th frame
+    '''
+    que, results = mp_params
+    stats = FRAME_STATS()
+    with mock.patch('ball_detection.detect_center', return_value = (5,5,1), autospec=True) as detect:
+        for pts in range(6):
+            update_center_values(que, results, DROP_EVERY_NTH, 3, stats)
+            que.put(np.zeros((4, 4, 3), dtype='uint8'), pts, pts)
+    assert detect.call_count == 2
+    assert (stats.received, stats.processed, stats.dropped) == (6, 2, 4)
+    with pytest.raises(ValueError):
+        update_center_values(que, results, DROP_EVERY_NTH, 3)
+
+@pytest.mark.client
+def test_update_center_values_empty_queue(ring):
+    '''
+    Test nothing is processed without frames so the process can block on its wakeup
+    '''
+    assert not update_center_values(ring, (RESULT * 8)())
+
+@pytest.fixture
+def pool():
+    '''
+    fixture for initialzing a detection pool without starting its processes
+    '''
+    pool = DetectionPool(workers=2, ring_slots=2, max_frame_shape=(4, 4, 3), table_size=8)
+    yield pool
+    pool.shutdown()
+
+@pytest.mark.client
+def test_detection_pool_round_robin(pool):
+    '''
+    Test frames are spread over the workers in turn
+    '''
+    for pts in range(4):
+        assert pool.submit(np.zeros((4, 4, 3), dtype='uint8'), pts * 10)
+    assert [ring.get_tagged()[1:] for ring in pool._rings] == [(0, 0), (10, 1)]
+    # both rings are full now
+    assert not pool.submit(np.zeros((4, 4, 3), dtype='uint8'), 40)
+    assert pool.stats()['ring_full'] == 1
+
+@pytest.mark.client
+def test_detection_pool_results_in_pts_order(pool):
+    '''
+    Test out of order completions are handed back in pts order with misses and drops handled
+    '''
+    for pts in range(4):
+        pool.submit(np.zeros((4, 4, 3), dtype='uint8'), pts * 10)
+    results = pool._results
+    results[1].x, results[1].y, results[1].status = 3, 4, RESULT_FOUND
+    assert pool.results() == []
+    results[0].x, results[0].y, results[0].latency_us, results[0].status = 1, 2, 50, RESULT_FOUND
+    results[3].status = RESULT_MISSED
+    assert pool.results() == [(1, 2, 0, 1.0, 50), (3, 4, 10, 1.0, 0)]
+    results[2].status = RESULT_DROPPED
+    assert pool.results() == [(3, 4, 30, 0.0, 0)]
+
+@pytest.fixture
+def ball_frame():
+    '''
+    fixture for a frame with a filled red ball like the ones the server sends
+    '''
+    frame = np.zeros((480,640,3), dtype='uint8')
+    return cv2.circle(frame, (400, 250), 20, (0,0,255), thickness=-1)
+
+@pytest.mark.client
+@pytest.mark.parametrize('name', ['moments', 'components'])
+@pytest.mark.parametrize('roi', [False, True])
+def test_detector_backends(ball_frame, name, roi):
+    '''
+    Test threshold based backends find the ball center and radius
+    '''
+    detector = make_detector(name, roi)
+    for _ in range(2):
+        x, y, radius = detector.detect(ball_frame)
+        assert np.linalg.norm(np.array((400, 250)) - np.array((x, y))) < 1
+        assert abs(radius - 20) < 1
+    assert detector.detect(np.zeros((480,640,3), dtype='uint8')) is None
+
+@pytest.mark.client
+def test_roi_detector_falls_back_to_full_frame(ball_frame):
+    '''
+    Test the roi detector searches a window around the last center and the full frame once the ball is lost
+    '''
+    detector = make_detector('moments', roi=True)
+    detector.detect(ball_frame)
+    assert detector.full_searches == 1
+    assert detector.window(ball_frame.shape) == (366, 216, 435, 285)
+    detector.detect(ball_frame)
+    assert (detector.roi_searches, detector.full_searches) == (1, 1)
+
+    moved = cv2.circle(np.zeros((480,640,3), dtype='uint8'), (100, 100), 20, (0,0,255), thickness=-1)
+    x, y, _ = detector.detect(moved)
+    assert (detector.roi_searches, detector.full_searches) == (2, 2)
+    assert np.linalg.norm(np.array((100, 100)) - np.array((x, y))) < 1
+    with pytest.raises(ValueError):
+        make_detector('unknown')
+
+@pytest.mark.client
+def test_copy_i420_matches_to_ndarray(ball_frame):
+    '''
+    Test decoded planes are packed like av.VideoFrame.to_ndarray and split back into planes
+    '''
+    import av
+    video_frame = av.VideoFrame.from_ndarray(ball_frame, format='bgr24').reformat(format='yuv420p')
+    packed = copy_i420(video_frame, np.empty((720, 640), dtype='uint8'))
+    assert (packed == video_frame.to_ndarray()).all()
+    y_plane, u_plane, v_plane = split_i420(packed)
+    assert y_plane.shape == (480, 640)
+    assert u_plane.shape == v_plane.shape == (240, 320)
+
+@pytest.mark.client
+@pytest.mark.parametrize('name', ['hough', 'moments', 'components'])
+def test_estimate_center_on_yuv_planes(ball_frame, name):
+    '''
+    Test detector backends find the ball on I420 planes without converting to BGR
+    '''
+    packed = cv2.cvtColor(ball_frame, cv2.COLOR_BGR2YUV_I420)
+    x, y, _ = estimate_center(packed, make_detector(name))
+    assert np.linalg.norm(np.array((400, 250)) - np.array((x, y))) < 3
+
+@pytest.mark.client
+def test_result_batcher_batches_records():
+    '''
+    Test results are held back until a batch is full and packed into one message, and sent right away
+    without a flush interval
+    '''
+    batcher = ResultBatcher(max_records=2, flush_interval=60)
+    assert batcher.wait_time() is None
+    batcher.add(3000, 1.5, 2.5, 1.0, 120)
+    assert not batcher.due()
+    assert 59 < batcher.wait_time() <= 60
+    batcher.add(6000, 3.5, 4.5, 0.0, 80)
+    assert batcher.due()
+    kind, records = server_protocol.decode_message(batcher.flush())
+    assert kind == server_protocol.KIND_RESULTS
+    assert records['pts'].tolist() == [3000, 6000]
+    assert records['x'].tolist() == [1.5, 3.5]
+    assert records['latency_us'].tolist() == [120, 80]
+    assert len(batcher) == 0
+    batcher = ResultBatcher(max_records=2)
+    batcher.add(9000, 1.5, 2.5)
+    assert batcher.due() and batcher.wait_time() == 0
+
+@pytest.mark.server
+def test_decode_message_rejects_bad_messages():
+    '''
+    Test messages of other versions, unknown kinds or wrong lengths are rejected
+    '''
+    header = server_protocol.HEADER
+    records = np.zeros(2, dtype=server_protocol.RESULT_RECORD).tobytes()
+    assert server_protocol.RESULT_RECORD == RESULT_RECORD
+    for message in (b'1\t2\t3', header.pack(9, 1, 2) + records, header.pack(1, 99, 2) + records,
+                    header.pack(1, 1, 3) + records):
+        with pytest.raises(ValueError):
+            server_protocol.decode_message(message)
+
+@pytest.mark.server
+def test_ground_truth_ring_lookup_and_eviction():
+    '''
+    Test positions are found by nearest pts step and evicted once the ring wraps
+    '''
+    truth = GroundTruthRing(pts_step=3000, capacity=4)
+    for k in range(6):
+        truth.insert(k * 3000, (k, k + 1))
+    assert len(truth) == 4
+    assert truth.lookup(4 * 3000 - 1) == (4, 5)
+    assert truth.lookup(4 * 3000) is None
+    assert truth.lookup(0) is None
+    assert truth.lookup(9 * 3000) is None
+    assert truth.counters == {'reported': 1, 'missing': 2, 'late': 1, 'duplicate': 1, 'unknown': 1}
+
+@pytest.mark.server
+def test_ground_truth_ring_lookup_many():
+    '''
+    Test a batch of reports is scored at once and a frame reported twice in one batch only counts once
+    '''
+    truth = GroundTruthRing(pts_step=3000, capacity=8)
+    for k in range(8):
+        truth.insert(k * 3000, (10 * k, 0))
+    positions, found = truth.lookup_many(np.array([3000, 6000, 6000, 2999 * 7]))
+    assert found.tolist() == [True, True, False, True]
+    assert positions[found, 0].tolist() == [10, 20, 70]
+    assert truth.counters['duplicate'] == 1
+
+@pytest.mark.server
+@pytest.mark.parametrize('cache_size', [0, 1000])
+def test_get_frame_matches_drawn_circle(cache_size):
+    '''
+    Test the incrementally rendered frames equal a freshly drawn circle, including clipped edges
+    '''
+    frame = Frame(7, 10, 64, 48, buffers=2, cache_size=cache_size)
+    for _ in range(40):
+        expected = np.zeros((48, 64, 3), dtype='uint8')
+        cv2.circle(expected, (frame.x_position, frame.y_position), radius=10, thickness=-1, color=(0, 0, 255))
+        assert (frame.get_frame() == expected).all()
+        frame.ball_move()
+
+@pytest.mark.server
+@pytest.mark.parametrize('params', [(5, 40, 100, 100), (5, 17, 300, 200), (7, 10, 64, 48), (13, 5, 40, 33)])
+def test_positions_at_matches_ball_move(params):
+    '''
+    Test the closed form trajectory matches stepping the ball, bounces included
+    '''
+    frame = Frame(*params)
+    expected = []
+    for _ in range(1000):
+        expected.append((frame.x_position, frame.y_position))
+        frame.ball_move()
+    assert (Frame(*params).positions_at(np.arange(1000)) == np.array(expected)).all()
+    assert Frame(*params).position_at(999) == expected[-1]
+
+@pytest.mark.server
+def test_seek_matches_ball_move(frame):
+    '''
+    Test seeking gives the same ball state and frame as moving the ball step by step
+    '''
+    other = Frame(5, 40, 100, 100)
+    for step in (0, 3, 10, 27):
+        other.seek(step)
+        moved = Frame(5, 40, 100, 100)
+        for _ in range(step):
+            moved.ball_move()
+        assert (other.x_position, other.y_position, other.x_velocity, other.y_velocity) == \
+            (moved.x_position, moved.y_position, moved.x_velocity, moved.y_velocity)
+        assert np.array_equal(other.get_frame(), moved.get_frame())
+
+@pytest.mark.server
+def test_ground_truth_ring_with_trajectory(frame):
+    '''
+    Test positions are computed from the frame index instead of being stored
+    '''
+    truth = GroundTruthRing(pts_step=3000, capacity=4, trajectory=frame.positions_at)
+    for k in range(12):
+        truth.insert(k * 3000)
+    assert truth.lookup(10 * 3000 + 1) == frame.position_at(10)
+    assert truth.lookup(3 * 3000) is None
+
+@pytest.mark.server
+def test_overlay_display_matches_blended_circles():
+    '''
+    Test the reused overlay buffer looks like blending the server and client balls at half weight
+    '''
+    display = OverlayDisplay(64, 48, 10, headless=True)
+    frame_server = np.zeros((48, 64, 3), dtype='uint8')
+    frame_client = np.zeros((48, 64, 3), dtype='uint8')
+    cv2.circle(frame_server, (20, 20), radius=10, color=(0,255,0), thickness=-1)
+    cv2.circle(frame_client, (30, 25), radius=10, color=(0,0,255), thickness=-1)
+    expected = cv2.addWeighted(frame_server, 0.5, frame_client, 0.5, 0)
+    display.render((5, 5), (40, 40))
+    assert (display.render((20, 20), (30, 25)) == expected).all()
+    # headless display neither starts a thread nor takes updates
+    display.start()
+    display.update((1, 1), (2, 2))
+    assert display._thread is None and display._mailbox is None
+
+@pytest.mark.client
+def test_frame_viewer_modes():
+    '''
+    Test the viewer shows every n-th frame inline, keeps only the latest frame in thread mode and
+    ignores frames when off
+    '''
+    frame = mock.Mock()
+    viewer = FrameViewer(DISPLAY_EVERY_NTH, every_nth=3)
+    with mock.patch.object(FrameViewer, 'show') as show:
+        for _ in range(7):
+            viewer.offer(frame)
+        assert show.call_count == 3
+
+        viewer = FrameViewer(DISPLAY_THREAD)
+        viewer.offer(1)
+        viewer.offer(2)
+        assert viewer._mailbox == 2 and show.call_count == 3
+
+        viewer = FrameViewer(DISPLAY_OFF)
+        viewer.start()
+        viewer.offer(frame)
+        assert viewer._thread is None and viewer.offered == 0
+    with pytest.raises(ValueError):
+        FrameViewer('sometimes')
+
+
+@pytest.mark.server
+def test_shared_track_scores_each_client_separately():
+    '''
+    Test a client joining a shared track late is scored from its own first frame
+    '''
+    track = BallBouncingTrack(5, 17, 300, 200)
+    pts_step = track.ground_truth.pts_step
+    for k in range(3):
+        track.ground_truth.insert(k * pts_step)
+    late = track.new_ground_truth()
+    for k in range(3, 6):
+        for ground_truth in track._ground_truths:
+            ground_truth.insert(k * pts_step)
+    late.pts_offset = 3 * pts_step
+    # the late client counts pts from its first frame, frame 3 of the track
+    assert late.lookup(0) == track.frame_generator.position_at(3)
+    assert late.lookup(3 * pts_step) is None
+    assert track.ground_truth.lookup(3 * pts_step) == track.frame_generator.position_at(3)
+    track.release_ground_truth(late)
+    assert track._ground_truths == [track.ground_truth]
+
+@pytest.mark.server
+def test_single_ball_server_skips_records_without_position():
+    '''
+    Test a frame without detections from a client reporting many balls, sent as nan with zero confidence,
+    is counted but not scored by a single ball server
+    '''
+    import asyncio
+    import sys
+
+    async def receive(records):
+        with mock.patch.dict(sys.modules, protocol=server_protocol, display=server_display):
+            from rtc_server import RTCServer
+        session = RTCServer('localhost', '12345', 5, 17, 300, 200, display=False, signal=mock.Mock())
+        await session.register_on_callbacks()
+        session._stream_info_sent = True
+        for k in range(2):
+            session.ground_truth.insert(k * session.ground_truth.pts_step)
+        session.channel.emit('message', encode_records(KIND_RESULTS, records))
+        session.stream_track.stop()
+        await session.pc.close()
+        return session
+
+    records = np.zeros(2, dtype=RESULT_RECORD)
+    records['x'][0] = records['y'][0] = np.nan
+    records['x'][1], records['y'][1] = 22, 22
+    records['pts'][1] = 3000
+    records['confidence'][1] = 1.0
+    session = asyncio.run(receive(records))
+    assert (session.stats['records'], session.stats['scored']) == (2, 1)
+    assert session.accuracy.summary()['count'] == 1
+
+@pytest.mark.server
+def test_session_server_aggregates_sessions(capsys):
+    '''
+    Test two sessions on one shared track are counted while they run and summed once they ended
+    '''
+    import asyncio
+    import sys
+
+    def session(*args, **kwargs):
+        records = 10 * (len(sessions) + 1)
+        sessions.append(mock.Mock(run=finish.wait, shutdown=mock.AsyncMock(),
+                                  stats={'messages': 2, 'records': records, 'scored': records - 1, 'feedback': 0},
+                                  ground_truth=mock.Mock(counters={})))
+        return sessions[-1]
+
+    sessions = []
+    finish = asyncio.Event()
+    # the flat rtc_server import would resolve display and protocol to the client's modules
+    with mock.patch.dict(sys.modules, rtc_server=mock.Mock(RTCServer=session)):
+        from session_server import SessionServer
+
+    async def serve_two():
+        server = SessionServer('localhost', '12345', 5, 17, 300, 200, stats_interval=0)
+        runs = [asyncio.ensure_future(server.run_session(None)) for _ in range(2)]
+        await asyncio.sleep(0)
+        active = server.stats()
+        finish.set()
+        await asyncio.gather(*runs)
+        return active, server
+
+    active, server = asyncio.run(serve_two())
+    assert set(active['sessions']) == {1, 2}
+    assert active['aggregate']['active'] == 2 and active['aggregate']['shared_tracks'] == 1
+    aggregate = server.stats()['aggregate']
+    assert {key: aggregate[key] for key in ('sessions', 'messages', 'records', 'scored', 'active', 'shared_tracks')} \
+        == {'sessions': 2, 'messages': 4, 'records': 30, 'scored': 28, 'active': 0, 'shared_tracks': 0}
+    server.print_stats()
+    assert "'records': 30" in capsys.readouterr().out.splitlines()[-1]
+
+@pytest.mark.server
+def test_stream_signaling_round_trip():
+    '''
+    Test session signaling speaks the newline delimited JSON of TcpSocketSignaling
+    '''
+    import asyncio
+    from aiortc import RTCSessionDescription
+    from aiortc.contrib.signaling import BYE
+
+    async def round_trip():
+        accepted = asyncio.get_running_loop().create_future()
+        server = await asyncio.start_server(lambda r, w: accepted.set_result(StreamSignaling(r, w)), '127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        client = StreamSignaling(reader, writer)
+        session = await accepted
+        await session.send(RTCSessionDescription(sdp='v=0', type='offer'))
+        received = await client.receive()
+        await session.close()
+        bye = await client.receive()
+        end = await client.receive()
+        await client.close()
+        server.close()
+        return received, bye, end
+
+    received, bye, end = asyncio.run(round_trip())
+    assert received.type == 'offer' and received.sdp == 'v=0'
+    assert bye is BYE and end is None
+
+
+@pytest.mark.server
+def test_metrics_histograms_and_prometheus_text():
+    '''
+    Test stage timings land in fixed buckets, export as cumulative Prometheus buckets and cost nothing
+    while disabled
+    '''
+    disabled = Metrics()
+    disabled.stop('generate', disabled.start())
+    disabled.count('frames')
+    assert disabled.histograms == {} and disabled.counters == {}
+
+    histogram = Histogram((0.001, 0.01))
+    for value in (0.0005, 0.001, 0.005, 1.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.quantile(0.5) == 0.001 and histogram.quantile(1.0) == float('inf')
 
+    metrics = Metrics(enabled=True, buckets=(0.001, 0.01))
+    metrics.observe('detect', 0.002)
+    metrics.count('frames', 3)
+    text = metrics.prometheus()
+    assert 'ball_stage_seconds_bucket{stage="detect",le="0.001"} 0' in text
+    assert 'ball_stage_seconds_bucket{stage="detect",le="+Inf"} 1' in text
+    assert 'ball_frames_total 3' in text
+    assert metrics.snapshot()['stages']['detect']['buckets'] == [0, 1, 0]
 
+@pytest.mark.server
+def test_metrics_module_is_the_same_on_both_sides():
+    '''
+    Test the client and server copies of metrics.py did not drift apart
+    '''
+    import os
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, 'client', 'metrics.py')) as c, open(os.path.join(root, 'server', 'metrics.py')) as s:
+        assert c.read() == s.read()
+
+
+@pytest.mark.server
+def test_accuracy_stats_match_exact_statistics():
+    '''
+    Test streamed batches give the same mean, RMSE and max as scoring all pairs at once, percentiles
+    within one histogram bin and the rolling window only holds the latest errors
+    '''
+    rng = np.random.default_rng(0)
+    truths = rng.uniform(0, 300, (1000, 2))
+    estimates = truths + rng.normal(0, 2, (1000, 2))
+    errors = np.linalg.norm(truths - estimates, axis=1)
+
+    accuracy = AccuracyStats(batch_size=64, window=100, resolution=0.25)
+    for start in range(0, 1000, 7):
+        accuracy.add(truths[start:start + 7], estimates[start:start + 7])
+    summary = accuracy.summary()
+    assert summary['count'] == 1000
+    assert summary['mean'] == pytest.approx(errors.mean())
+    assert summary['rmse'] == pytest.approx(np.sqrt(np.mean(errors ** 2)))
+    assert summary['max'] == pytest.approx(errors.max())
+    for q in (50, 90, 99):
+        assert abs(summary[f'p{q}'] - np.percentile(errors, q)) <= 0.25
+    assert summary['window']['count'] == 100
+    assert summary['window']['max'] == pytest.approx(errors[-100:].max())
+    assert AccuracyStats().summary() == {'count': 0}
+
+@pytest.mark.server
+def test_accuracy_stats_leave_out_nan_estimates():
+    '''
+    Test pairs with a nan estimate are left out of every statistic instead of breaking the histogram
+    '''
+    accuracy = AccuracyStats(batch_size=4)
+    accuracy.add([(10, 10), (20, 20), (30, 30)], [(13, 14), (np.nan, np.nan), (30, 30)])
+    accuracy.add([(0, 0)] * 4, [(np.nan, 0)] * 4)
+    summary = accuracy.summary()
+    assert (summary['count'], summary['mean'], summary['max']) == (2, 2.5, 5.0)
+    assert summary['window']['count'] == 2
+    assert summary['p99'] <= 5.0
+
+
+@pytest.mark.client
+def test_capture_round_trip(ball_frame, tmp_path):
+    '''
+    Test captured frames, pts and stream info read back from the mapped file and replay in order
+    '''
+    import av
+    path = str(tmp_path / 'capture.bin')
+    writer = CaptureWriter(path, capacity=2)
+    writer.set_stream_info({'velocity': 5, 'pts_offset': 0})
+    frames = []
+    for pts in (0, 3000, 6000):
+        frame = av.VideoFrame.from_ndarray(np.roll(ball_frame, pts // 100, axis=1), format='bgr24').reformat(
+            format='yuv420p')
+        frame.pts = pts
+        frames.append(frame)
+        writer.append(frame)
+    writer.close()
+    assert writer.skipped == 1
+
+    reader = CaptureReader(path)
+    assert len(reader) == 2 and reader.info == {'velocity': 5, 'pts_offset': 0}
+    replayed = list(ReplaySource(reader, realtime=False))
+    assert [pts for pts, _ in replayed] == [0, 3000]
+    for (_, captured), frame in zip(replayed, frames):
+        assert np.array_equal(captured, frame.to_ndarray())
+
+@pytest.mark.server
+def test_stream_info_message_round_trip():
+    '''
+    Test the stream info the server encodes decodes on the client and other messages are rejected
+    '''
+    info = {'velocity': 5, 'radius': 17, 'pts_step': 3000, 'pts_offset': 9000}
+    assert decode_stream_info(server_protocol.encode_stream_info(info)) == info
+    with pytest.raises(ValueError):
+        decode_stream_info(encode_records(KIND_RESULTS, np.zeros(1, dtype=RESULT_RECORD)))
+
+
+@pytest.mark.server
+def test_track_fps_and_uncapped_pts():
+    '''
+    Test pts follow the chosen frame rate and an uncapped track hands out frames without waiting
+    '''
+    import asyncio
+    import time
+
+    async def pull(track, count):
+        return [(await track.recv()).pts for _ in range(count)]
+
+    track = BallBouncingTrack(5, 17, 300, 200, fps=60, paced=False)
+    start = time.monotonic()
+    assert asyncio.run(pull(track, 10)) == [i * 1500 for i in range(10)]
+    assert time.monotonic() - start < 0.1
+    assert track.ground_truth.pts_step == 1500
+    assert track.ground_truth.lookup(9 * 1500) == track.frame_generator.position_at(9)
+
+
+@pytest.mark.server
+def test_encoder_profiles():
+    '''
+    Test profiles take overrides, only fixed settings get an encoder of the track, and the preferences
+    of a codec leave only that codec in the offer
+    '''
+    import asyncio
+    import aiortc
+
+    profile = make_profile('vp8-fast', bitrate=200000)
+    assert profile['codec'] == 'vp8' and profile['bitrate'] == 200000 and profile['options'] == {'cpu-used': '16'}
+    assert FrameEncoder.from_profile(make_profile('h264')) is None
+    encoder = FrameEncoder.from_profile(make_profile('h264', bitrate=300000, keyframe_interval=10))
+    assert (encoder.codec, encoder.bitrate, encoder.keyframe_interval) == ('h264', 300000, 10)
+    for name, overrides in (('missing', {}), ('default', {'bitrate': 100000}), ('default', {'codec': 'av1'})):
+        with pytest.raises(ValueError):
+            make_profile(name, **overrides)
+
+    async def offer(codec):
+        pc = aiortc.RTCPeerConnection()
+        pc.addTransceiver('video', direction='sendonly').setCodecPreferences(codec_preferences(codec))
+        await pc.setLocalDescription(await pc.createOffer())
+        await pc.close()
+        return {line.split()[1].split('/')[0] for line in pc.localDescription.sdp.splitlines()
+                if line.startswith('a=rtpmap:')}
+
+    assert asyncio.run(offer('h264')) == {'H264', 'rtx'}
+    assert asyncio.run(offer('vp8')) == {'VP8', 'rtx'}
+
+@pytest.mark.server
+def test_track_with_encoder_sends_packets():
+    '''
+    Test a track with an encoder hands out one packet per frame with the frame's pts, starting with a
+    keyframe, and the packets decode to the ball
+    '''
+    import asyncio
+    import av
+
+    async def pull(track, count):
+        return [await track.recv() for _ in range(count)]
+
+    encoder = FrameEncoder('vp8', 500000, keyframe_interval=4)
+    track = BallBouncingTrack(5, 17, 300, 200, paced=False, encoder=encoder)
+    packets = asyncio.run(pull(track, 6))
+    assert all(isinstance(packet, av.Packet) for packet in packets)
+    assert [packet.pts for packet in packets] == [i * 3000 for i in range(6)]
+    assert [packet.is_keyframe for packet in packets] == [True, False, False, False, True, False]
+    assert encoder.frames == 6 and encoder.bytes == sum(packet.size for packet in packets)
+
+    decoder = av.CodecContext.create('libvpx', 'r')
+    decoded = [frame for packet in packets for frame in decoder.decode(packet)][-1]
+    found = make_detector('moments').detect(decoded.to_ndarray(format='bgr24'))
+    assert np.hypot(*(np.array(found[:2]) - track.ground_truth.lookup(5 * 3000))) < 2
+
+@pytest.mark.server
+def test_rate_controller_backs_off_and_recovers():
+    '''
+    Test overload halves the frame rate down to min_fps, calm feedback steps it back up and a step up
+    that overloads again doubles the wait before the next one
+    '''
+    def feedback(queue_depth=0, latency_us=1000, dropped=0):
+        record = np.zeros(1, dtype=FEEDBACK_RECORD)[0]
+        record['queue_depth'], record['latency_us'], record['dropped'] = queue_depth, latency_us, dropped
+        return record
+
+    control = RateController(fps=60, min_fps=10, max_queue=2, recover_after=2)
+    assert control.update(feedback()) == 1
+    assert control.update(feedback(queue_depth=3)) == 2
+    assert control.update(feedback(dropped=5)) == 4
+    assert control.update(feedback(dropped=5, latency_us=100000)) == 6
+    assert control.current_fps == 10
+    assert [control.update(feedback(dropped=5)) for _ in range(4)] == [6, 5, 5, 4]
+    # the step up to 4 overloads, the next step up waits twice as long
+    assert control.update(feedback(queue_depth=3, dropped=5)) == 6
+    assert [control.update(feedback(dropped=5)) for _ in range(4)] == [6, 6, 6, 5]
+
+@pytest.mark.server
+def test_track_frame_interval_keeps_pts_and_positions_in_step():
+    '''
+    Test a track sending every k-th frame advances pts and the ball as if all frames were generated
+    '''
+    import asyncio
+
+    async def pull(track, count):
+        return [(await track.recv()).pts for _ in range(count)]
+
+    track = BallBouncingTrack(5, 17, 300, 200, paced=False)
+    step = track.pts_step
+    pts = asyncio.run(pull(track, 2))
+    track.frame_interval = 3
+    pts += asyncio.run(pull(track, 2))
+    assert pts == [0, step, 4 * step, 7 * step]
+    assert (track.frame_generator.x_position, track.frame_generator.y_position) == \
+        track.frame_generator.position_at(8)
+    assert track.ground_truth.lookup(7 * step) == track.frame_generator.position_at(7)
+    assert track.ground_truth.lookup(5 * step) is None
+
+@pytest.mark.client
+def test_feedback_message_decodes_on_the_server():
+    '''
+    Test the client's feedback records are understood by the server
+    '''
+    feedback = np.zeros(1, dtype=FEEDBACK_RECORD)
+    feedback['queue_depth'], feedback['dropped'] = 3, 7
+    kind, records = server_protocol.decode_message(encode_records(KIND_FEEDBACK, feedback))
+    assert kind == server_protocol.KIND_FEEDBACK
+    assert records['queue_depth'][0] == 3 and records['dropped'][0] == 7
+
+@pytest.mark.client
+def test_tracker_predicts_skipped_frames_and_bounces():
+    '''
+    Test detect every n-th frame mode follows a stepping ball through a bounce off the frame edge
+    '''
+    positions, _ = bounce_position(np.arange(60), 17, 5, 17, 83)
+    tracker = BallTracker(detect_every=4)
+    tracker.bounds = (100, 100)
+    detected = 0
+    for step, x in enumerate(positions):
+        pts = step * 3000
+        if tracker.should_detect():
+            detected += 1
+            estimate = tracker.update(pts, (x, 50, 17))
+            assert estimate == (x, 50, 1.0)
+        else:
+            estimate = tracker.predict(pts)
+            assert estimate[2] == PREDICTED_CONFIDENCE
+            # the first bounce is predicted off the radius, later ones off the learned turning points
+            assert abs(estimate[0] - x) < (10.5 if step < 20 else 0.5)
+            assert abs(estimate[1] - 50) < 0.5
+    assert detected < 25
+    assert tracker.resets == 0
+
+@pytest.mark.client
+def test_tracker_detects_again_after_a_miss_or_jump():
+    '''
+    Test the tracker leaves the predict mode when detection misses or jumps away from the prediction
+    '''
+    tracker = BallTracker(detect_every=8)
+    assert tracker.update(0, None) is None
+    for step in range(2):
+        assert tracker.should_detect()
+        tracker.update(step * 3000, (10 + 5 * step, 20))
+    assert not tracker.should_detect()
+    tracker.update(2 * 3000, None)
+    assert tracker.should_detect()
+    tracker.update(3 * 3000, (25, 20))
+    assert tracker.should_detect()
+    tracker.update(4 * 3000, (30, 20))
+    assert not tracker.should_detect()
+    tracker.update(5 * 3000, (90, 60))
+    assert tracker.resets == 1
+    assert tracker.should_detect()
+
+@pytest.mark.client
+def test_detection_pool_tracker_fills_skipped_frames(pool):
+    '''
+    Test skipped and dropped frames get the tracker estimate in pts order
+    '''
+    pool.tracker = BallTracker()
+    for pts in (0, 3000):
+        pool.submit(np.zeros((4, 4, 3), dtype='uint8'), pts)
+    assert pool.skip(6000)
+    pool.submit(np.zeros((4, 4, 3), dtype='uint8'), 9000)
+    assert pool.pending() == 3
+    results = pool._results
+    for seq, x in ((0, 10), (1, 15)):
+        results[seq].x, results[seq].y, results[seq].latency_us, results[seq].status = x, 20, 40, RESULT_FOUND
+    results[3].status = RESULT_DROPPED
+    estimates = pool.results()
+    assert estimates[:2] == [(10, 20, 0, 1.0, 40), (15, 20, 3000, 1.0, 40)]
+    assert [pts for _, _, pts, _, _ in estimates] == [0, 3000, 6000, 9000]
+    assert [confidence for _, _, _, confidence, _ in estimates[2:]] == [PREDICTED_CONFIDENCE] * 2
+    assert estimates[3][0] == pytest.approx(25, abs=0.5)
+    assert pool.pending() == 0
+    assert pool.stats()['skipped'] == 1
+
+@pytest.mark.client
+def test_detection_pool_drops_frames_of_an_exited_worker(pool, capsys):
+    '''
+    Test a frame stuck with a worker that exited doesn't hold back later results, and the worker
+    gets no more frames
+    '''
+    alive = [True, True]
+    pool._procs = [mock.Mock(is_alive=lambda: alive[0], exitcode=1), mock.Mock(is_alive=lambda: alive[1])]
+    pool.submit(np.zeros((4, 4, 3), dtype='uint8'), 0)
+    pool.submit(np.zeros((4, 4, 3), dtype='uint8'), 3000)
+    alive[0] = False
+    pool._results[1].x, pool._results[1].y, pool._results[1].status = 10, 20, RESULT_FOUND
+    assert pool.results() == [(10, 20, 3000, 1.0, 0)]
+    assert pool.pending() == 0
+    assert pool.stats()['lost'] == 1
+    assert pool.submit(np.zeros((4, 4, 3), dtype='uint8'), 6000)
+    assert pool._entry_workers[2] == 1
+    assert capsys.readouterr().out.count("Detection worker 0 exited with code 1") == 1
+
+@pytest.mark.client
+def test_detection_pool_reset_starts_a_new_session(pool):
+    '''
+    Test reset discards results still in flight, restarts the counters and the tracker, and a late
+    result of the previous session doesn't end up in the new one
+    '''
+    pool.tracker = BallTracker()
+    pool.submit(np.zeros((4, 4, 3), dtype='uint8'), 0)
+    pool.skip(3000)
+    pool._stats[0].received = 5
+    pool.tracker.update(0, (10, 20))
+    pool.reset()
+    assert pool.results() == []
+    assert pool.pending() == 0
+    assert set(pool.stats().values()) == {0}
+    assert pool.tracker.predict(3000) is None
+
+    pool.submit(np.zeros((4, 4, 3), dtype='uint8'), 6000)
+    results = pool._results
+    results[0].status = RESULT_FOUND
+    assert pool.results() == []
+    results[2].x, results[2].y, results[2].status = 1, 2, RESULT_FOUND
+    assert pool.results() == [(1, 2, 6000, 1.0, 0)]
+
+@pytest.mark.client
+def test_client_reconnects_with_bounded_backoff(pool):
+    '''
+    Test the client retries an unreachable signaling server with doubling delays up to the max,
+    closes the signaling and leaves a shared detection pool running
+    '''
+    import asyncio
+
+    async def connect():
+        client = RTCClient('localhost', '12345', pool=pool, display=DISPLAY_OFF, reconnect_delay=0.1,
+                           max_reconnect_delay=0.3)
+        client.signal = mock.Mock(receive=mock.AsyncMock(side_effect=[OSError] * 4 + [BYE]), close=mock.AsyncMock())
+        with mock.patch('asyncio.sleep', new=mock.AsyncMock()) as sleep:
+            assert not await client.consume_signal()
+        await client.shutdown()
+        client.signal.close.assert_awaited_once()
+        return [call.args[0] for call in sleep.call_args_list]
 
+    assert asyncio.run(connect()) == [0.1, 0.2, 0.3, 0.3]
+    assert not pool._notify_reader.closed
 
+@pytest.mark.client
+def test_client_destructor_after_failed_init():
+    '''
+    Test a client whose constructor raised is destroyed without an error of its own
+    '''
+    import gc
+    import sys
 
+    with mock.patch.object(sys, 'unraisablehook') as unraisable:
+        with pytest.raises(ValueError):
+            RTCClient('localhost', '12345', max_targets=100000, display=DISPLAY_OFF)
+        gc.collect()
+    assert not unraisable.called
+
+@pytest.mark.client
+def test_client_delivery_survives_a_closed_channel(pool, capsys):
+    '''
+    Test result delivery waits while the channel isn't open, keeps going after a failed send, and
+    shutdown reports an error that ended it
+    '''
+    import asyncio
+    from aiortc.exceptions import InvalidStateError
 
+    async def deliver(errors):
+        client = RTCClient('localhost', '12345', pool=pool, display=DISPLAY_OFF)
+        client.send_results = mock.Mock(side_effect=errors)
+        client.channel = mock.Mock(readyState='connecting')
+        client._delivery = asyncio.ensure_future(client._deliver_results())
+        for state in ('connecting', 'open', 'open'):
+            client.channel.readyState = state
+            client._results_ready.set()
+            for _ in range(3):
+                await asyncio.sleep(0)
+        sends, done = client.send_results.call_count, client._delivery.done()
+        await client.shutdown()
+        return sends, done
 
+    assert asyncio.run(deliver([InvalidStateError(), None])) == (2, False)
+    assert "Send Results Error" in capsys.readouterr().out
+    assert asyncio.run(deliver([RuntimeError('send failed')])) == (1, True)
+    assert "Deliver Results Error: RuntimeError('send failed')" in capsys.readouterr().out
 
+@pytest.mark.client
+def test_client_drops_frames_the_slots_cannot_hold(pool):
+    '''
+    Test frames of an odd size or too large for the shared slots are counted as unsupported instead of
+    crashing the track, and frames that fit still reach the pool
+    '''
+    import asyncio
+    import av
+
+    async def run_track(sizes):
+        client = RTCClient('localhost', '12345', pool=pool, display=DISPLAY_OFF)
+        frames = [av.VideoFrame(width, height, 'yuv420p') for width, height in sizes]
+        for pts, frame in enumerate(frames):
+            frame.pts = pts
+        client.track = mock.Mock(recv=mock.AsyncMock(side_effect=frames))
+        assert all([await client._run_track() for _ in frames])
+        stats = client.frame_stats()
+        await client.shutdown()
+        return stats
+
+    assert not pool.fits((9, 8)) and pool.fits((6, 4))
+    stats = asyncio.run(run_track([(5, 5), (16, 16), (4, 4), (5, 5)]))
+    assert stats['unsupported'] == 3
+    assert pool.pending() == 1
+
+@pytest.mark.client
+def test_detection_pool_notifies_when_results_are_ready(ball_frame):
+    '''
+    Test a worker wakes up a reader of the notification pipe once its result is in the table
+    '''
+    pool = DetectionPool(max_frame_shape=ball_frame.shape, drop_policy=DROP_FIFO, detector=make_detector('moments'))
+    pool.start()
+    try:
+        fd = pool.notify_fileno()
+        assert select.select([fd], [], [], 0)[0] == []
+        assert pool.submit(ball_frame, 3000)
+        assert select.select([fd], [], [], 10)[0] == [fd]
+        pool.clear_notifications()
+        assert select.select([fd], [], [], 0)[0] == []
+        [(x, y, pts, confidence, _)] = pool.results()
+        assert (round(x), round(y), pts, confidence) == (400, 250, 3000, 1.0)
+    finally:
+        pool.shutdown()
+
+@pytest.mark.server
+def test_ball_world_moves_like_frame():
+    '''
+    Test a one ball world bounces off the edges exactly like Frame.ball_move
+    '''
+    frame = Frame(5, 17, 300, 200)
+    world = BallWorld(1, 17, 300, 200)
+    world.positions[:] = (17, 17)
+    world.velocities[:] = (5, 5)
+    for _ in range(200):
+        world.ball_move()
+    world.seek(250)
+    assert world.centers().tolist() == [list(frame.position_at(250))]
+    with pytest.raises(ValueError):
+        world.seek(10)
+
+@pytest.mark.server
+def test_ball_world_collisions_and_grid_pairs():
+    '''
+    Test the grid finds every touching pair and balls bounce off each other keeping their energy
+    '''
+    world = BallWorld(400, 5, 320, 240, collisions=True, seed=1)
+    i, j = world.pairs()
+    distances = np.hypot(*(world.positions[:, None] - world.positions[None]).transpose(2, 0, 1))
+    touching = {(a, b) for a, b in zip(*np.nonzero(np.triu(distances < 10, 1)))}
+    assert touching <= {(min(a, b), max(a, b)) for a, b in zip(i.tolist(), j.tolist())}
+    assert len(set(zip(i.tolist(), j.tolist()))) == len(i)
+
+    world = BallWorld(2, 5, 100, 100, collisions=True)
+    world.positions[:] = ((40, 50), (49, 50))
+    world.velocities[:] = ((2, 1), (-3, 0))
+    world.ball_move()
+    assert world.velocities.tolist() == [[-3, 1], [2, 0]]
+    assert world.collided == 1
+
+    world = BallWorld(2000, 5, 320, 240, collisions=True)
+    energy = np.sum(world.velocities ** 2)
+    world.seek(100)
+    assert np.isclose(np.sum(world.velocities ** 2), energy)
+
+@pytest.mark.server
+def test_ball_world_keeps_colliding_balls_inside():
+    '''
+    Test balls of a crowded world never leave the frame, collisions next to an edge included
+    '''
+    world = BallWorld(200, 6, 640, 480, velocity=4, collisions=True)
+    for _ in range(3000):
+        world.ball_move()
+        centers = world.centers()
+        assert (centers >= 6).all() and (centers <= (634, 474)).all()
+    assert world.collided
+    # balls put back on an edge move on instead of sliding along it
+    on_edge = (world.positions == world._low) | (world.positions == world._high)
+    assert on_edge.any(axis=1).sum() < 10
+
+@pytest.mark.server
+def test_ball_world_draws_every_ball_into_reused_buffers():
+    '''
+    Test balls are drawn like Frame draws them and stale balls are cleared from a reused buffer
+    '''
+    world = BallWorld(3, 17, 300, 200, buffers=1)
+    world.positions[:] = ((20, 20), (100, 100), (200, 150))
+    single = Frame(5, 17, 300, 200)
+    single.x_position, single.y_position = world.centers()[0].tolist()
+    drawn = world.get_frame()
+    assert np.count_nonzero(drawn[..., 2]) <= 3 * np.count_nonzero(single.get_frame()[..., 2])
+    assert (drawn[tuple(world.centers()[:, ::-1].T)] == (0, 0, 255)).all()
+    before = world.centers()
+    world.positions += (60, 20)
+    drawn = world.get_frame()
+    assert (drawn[tuple(world.centers()[:, ::-1].T)] == (0, 0, 255)).all()
+    assert not drawn[tuple(before[:, ::-1].T)].any()
+
+@pytest.mark.server
+def test_assign_targets_and_per_ball_stats():
+    '''
+    Test estimates are matched to ball ids in any order with outliers and missing balls counted
+    '''
+    truths = np.array([[10, 10], [50, 50], [90, 10]])
+    estimates = np.array([[91, 10], [200, 200], [10, 11.5]])
+    balls, paired, errors = assign_targets(truths, estimates, gate=5, chunk=2)
+    assert balls.tolist() == [2, 0]
+    assert paired.tolist() == [0, 2]
+    assert errors.tolist() == [1, 1.5]
+    stats = TargetStats(3, gate=5)
+    stats.add(truths, estimates)
+    stats.add(truths, np.empty((0, 2)))
+    summary = stats.summary()
+    assert (summary['frames'], summary['matched'], summary['missed'], summary['false_positives']) == (2, 2, 4, 1)
+    assert summary['worst_balls'] == {0: 1.5, 2: 1.0}
+    assert np.isnan(stats.ball_errors()[1])
+    assert stats.accuracy.summary()['count'] == 2
+
+@pytest.mark.server
+def test_multi_ball_track_stores_every_ball():
+    '''
+    Test a multi ball track keeps the position of every ball for scoring
+    '''
+    import asyncio
+
+    async def pull(track, count):
+        return [(await track.recv()).pts for _ in range(count)]
+
+    track = BallBouncingTrack(5, 6, 320, 240, balls=50, collisions=True, paced=False)
+    positions, found = track.ground_truth.lookup_many(np.array(asyncio.run(pull(track, 3))))
+    assert found.all()
+    assert positions.shape == (3, 50, 2)
+    assert (positions[1] != positions[0]).any()
+    track.stop()
+
+@pytest.mark.client
+def test_detection_reports_every_ball():
+    '''
+    Test workers fill the target table with every ball and the pool reports one result per ball
+    '''
+    world = BallWorld(20, 6, 320, 240, seed=2)
+    frame = world.get_frame()
+    pool = DetectionPool(max_frame_shape=frame.shape, drop_policy=DROP_FIFO, table_size=8, max_targets=32)
+    assert pool.submit(frame, 3000)
+    pool.submit(np.zeros_like(frame), 6000)
+    for _ in range(2):
+        assert update_center_values(pool._rings[0], pool._results, DROP_FIFO, detector=make_detector('components'),
+                                    targets=pool._targets)
+    results = pool.results()
+    estimates = np.array([(x, y) for x, y, pts, _, _ in results if pts == 3000])
+    balls, _, _ = assign_targets(world.centers(), estimates, gate=1)
+    assert len(estimates) == pool._results[0].count
+    assert len(balls) >= 16
+    assert [(pts, confidence) for _, _, pts, confidence, _ in results if pts == 6000] == [(6000, 0.0)]
+    pool.shutdown()